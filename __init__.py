@@ -13,3 +13,7 @@
 #
 #     python sync_s3_image_files.py
 #
+#
+# check the startup time budget of the command line entry points
+#
+#     python benchmarks/bench_import_time.py
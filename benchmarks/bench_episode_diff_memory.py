@@ -0,0 +1,143 @@
+# call from project directory
+# python benchmarks/bench_episode_diff_memory.py [--num-episodes 13] [--num-frames 28800]
+#
+# Compares the memory used by the process_episode diff (G, C, J1, J2, J3)
+# for a full-season, unsubsampled run with python object string key columns
+# versus the shared categorical key columns and int64 frame_ids used by 
+# process_episode.
+
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+from typing import Dict, List, Tuple
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+import pandas as pd
+
+from episode_service import DATA_STAGES, find_episode_key_dtypes, encode_episode_keys_df
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("bench_episode_diff_memory")
+
+RARITY_CLASSES = ['Common', 'Uncommon', 'Rare', 'Legendary', 'Mythic']
+
+# fraction of frames whose ml_key changes between runs
+RELABEL_FRACTION = 0.02
+
+
+def make_episode_img_frames(season_code: str, episode_code: str, num_frames: int) -> List[str]:
+    '''
+    Return num_frames consecutive img_frames at 24 fps
+    e.g. TT_S01_E01_FRM-00-00-00-00, TT_S01_E01_FRM-00-00-00-01, ...
+    '''
+    img_frames = []
+    for frame in range(num_frames):
+        ss, ff = divmod(frame, 24)
+        mm, ss = divmod(ss, 60)
+        hh, mm = divmod(mm, 60)
+        img_frames.append(f"TT_{season_code}_{episode_code}_FRM-{hh:02d}-{mm:02d}-{ss:02d}-{ff:02d}")
+    return img_frames
+
+
+def make_episode_dfs(episode_id: str, img_frames: List[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Return object-string versions of G and C for one episode
+    where C holds every frame and RELABEL_FRACTION of them have a new_ml_key in G
+    object dtype is forced so newer pandas string dtypes match the pinned pandas
+    '''
+    ml_keys = [f"{stage}/{rarity}" for stage in DATA_STAGES for rarity in RARITY_CLASSES]
+    current_ml_keys = random.choices(ml_keys, k=len(img_frames))
+    new_ml_keys = [
+        random.choice(ml_keys) if random.random() < RELABEL_FRACTION else ml_key
+        for ml_key in current_ml_keys]
+    img_src_base = f"tuttle_twins/{episode_id.lower()}/default_eng/v1/frames/thumbnails/"
+
+    G = pd.DataFrame({
+        'episode_id': [episode_id] * len(img_frames),
+        'img_src': [img_src_base + img_frame + ".jpg" for img_frame in img_frames],
+        'img_frame': list(img_frames),
+        'new_ml_key': new_ml_keys}, dtype=object)
+    C = pd.DataFrame({
+        'episode_id': [episode_id] * len(img_frames),
+        'img_frame': list(img_frames),
+        'ml_key': current_ml_keys}, dtype=object)
+    return G, C
+
+
+def run_episode_diff(G: pd.DataFrame, C: pd.DataFrame, frame_key: str) -> Dict[str, pd.DataFrame]:
+    '''
+    The merges and comparisons of process_episode, without any s3 operations
+    frame_key is 'img_frame' for object strings or 'frame_id' once encoded
+    '''
+    J1 = C.merge(G, how='left', on=['episode_id', frame_key], suffixes=('',''), sort=False)
+    J1 = J1[J1['ml_key'].ne(J1['new_ml_key'])]
+    G2 = G[['episode_id', frame_key, 'new_ml_key']]
+    J2 = G2.merge(C, how='left', on=['episode_id', frame_key], suffixes=('',''), sort=False)
+    J2 = J2[J2['new_ml_key'].ne(J2['ml_key'])]
+    G3 = G[['episode_id', frame_key, 'img_src', 'new_ml_key']]
+    J3 = J2.merge(G3, how='left', on=['episode_id', frame_key, 'new_ml_key'], suffixes=('',''), sort=False)
+    return {'G': G, 'C': C, 'J1': J1, 'J2': J2, 'J3': J3}
+
+
+def measure_season(num_episodes: int, num_frames: int, categorical: bool) -> Dict[str,float]:
+    '''
+    Return the total deep memory of all diff dataframes and the peak
+    traced allocation of a single episode diff, in MiB
+    '''
+    random.seed(0)
+    total_df_bytes = 0
+    peak_bytes = 0
+    for e in range(1, num_episodes + 1):
+        episode_code = f"E{e:02d}"
+        episode_id = "S01" + episode_code
+        img_frames = make_episode_img_frames("S01", episode_code, num_frames)
+
+        # G and C are built inside the traced region, as they would be
+        # parsed from the google sheet and the s3 listing
+        tracemalloc.start()
+        G, C = make_episode_dfs(episode_id, img_frames)
+        frame_key = 'img_frame'
+        if categorical:
+            key_dtypes = find_episode_key_dtypes(G, C)
+            G = encode_episode_keys_df(G, key_dtypes)
+            C = encode_episode_keys_df(C, key_dtypes)
+            frame_key = 'frame_id'
+        dfs = run_episode_diff(G, C, frame_key)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        del img_frames
+        peak_bytes = max(peak_bytes, peak)
+        total_df_bytes += sum(df.memory_usage(deep=True).sum() for df in dfs.values())
+
+    return {
+        "df_mib": total_df_bytes / 2**20,
+        "peak_mib": peak_bytes / 2**20
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory benchmark of the process_episode diff")
+    parser.add_argument('--num-episodes', type=int, default=13,
+                        help='number of episodes in the season')
+    parser.add_argument('--num-frames', type=int, default=28800,
+                        help='number of frames per episode')
+    args = parser.parse_args()
+
+    object_result = measure_season(args.num_episodes, args.num_frames, categorical=False)
+    categorical_result = measure_season(args.num_episodes, args.num_frames, categorical=True)
+
+    print(f"{'mode':<12} {'dataframes MiB':>15} {'peak episode MiB':>17}")
+    print(f"{'object':<12} {object_result['df_mib']:15.1f} {object_result['peak_mib']:17.1f}")
+    print(f"{'encoded':<12} {categorical_result['df_mib']:15.1f} {categorical_result['peak_mib']:17.1f}")
+    print(f"reduction: {object_result['df_mib'] / categorical_result['df_mib']:.1f}x dataframes, "
+          f"{object_result['peak_mib'] / categorical_result['peak_mib']:.1f}x peak")
+
+
+if __name__ == "__main__":
+    main()
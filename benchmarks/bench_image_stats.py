@@ -0,0 +1,114 @@
+# call from project directory
+# python benchmarks/bench_image_stats.py [--num-frames 20] [--width 1920] [--height 1080]
+#
+# Compares the time and peak memory of the multi-pass statistics of the
+# original plotImageHistogram (mean, std, min, max, a standardized float64
+# copy, two thresholded copies and a DataFrame for describe) with the
+# single-pass plot_hist_lib.image_stats.computeImageStats on full-resolution
+# uint8 frames. Neither version plots.
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+import numpy as np
+import pandas as pd
+
+from plot_hist_lib.image_stats import computeImageStats
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("bench_image_stats")
+
+MIN_THRESHOLD = 0.1
+MAX_THRESHOLD = 0.9
+BINS = 25
+
+
+def make_frame(rng: np.random.Generator, height: int, width: int) -> np.ndarray:
+    '''
+    Return a smooth-ish uint8 RGB frame with noise, closer to a movie
+    frame than uniform noise
+    '''
+    gradient = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 25, size=(height, width, 3)).astype(np.float32)
+    return np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+
+def multi_pass_stats(frame: np.ndarray) -> dict:
+    '''
+    The statistics of the original plotImageHistogram, without the plot
+    '''
+    mu = np.mean(frame)
+    std = np.std(frame)
+    minv = np.min(frame)
+    maxv = np.max(frame)
+    data = frame.flatten()
+    data = (data - mu) / std
+    data = data[data > MIN_THRESHOLD]
+    data = data[data < MAX_THRESHOLD]
+    df = pd.DataFrame(data=data)
+    df.describe()
+    counts, edges = np.histogram(data, bins=BINS)
+    return {'mean': mu, 'std': std, 'min': minv, 'max': maxv, 'threshold_counts': counts}
+
+
+def single_pass_stats(frame: np.ndarray) -> dict:
+    return computeImageStats(frame, min_threshold=MIN_THRESHOLD, max_threshold=MAX_THRESHOLD, bins=BINS)
+
+
+def measure(stats_func, frames) -> Dict[str,float]:
+    '''
+    Return the mean ms per frame and the peak traced MiB of one frame
+    '''
+    start = time.perf_counter()
+    for frame in frames:
+        stats_func(frame)
+    ms_per_frame = 1000 * (time.perf_counter() - start) / len(frames)
+
+    tracemalloc.start()
+    stats_func(frames[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms_per_frame": ms_per_frame, "peak_mib": peak / 2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory benchmark of the plotImageHistogram statistics")
+    parser.add_argument('--num-frames', type=int, default=20,
+                        help='number of frames')
+    parser.add_argument('--width', type=int, default=1920,
+                        help='frame width')
+    parser.add_argument('--height', type=int, default=1080,
+                        help='frame height')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [make_frame(rng, args.height, args.width) for _ in range(args.num_frames)]
+
+    # both versions must agree before they are timed
+    expected = multi_pass_stats(frames[0])
+    actual = single_pass_stats(frames[0])
+    assert np.isclose(expected['mean'], actual['mean']) and np.isclose(expected['std'], actual['std'])
+    assert (expected['min'], expected['max']) == (actual['min'], actual['max'])
+    assert expected['threshold_counts'].tolist() == actual['threshold_counts'].tolist()
+
+    multi_pass_result = measure(multi_pass_stats, frames)
+    single_pass_result = measure(single_pass_stats, frames)
+
+    print(f"{args.num_frames} frames of {args.width}x{args.height}x3")
+    print(f"{'mode':<12} {'ms per frame':>13} {'peak MiB':>9}")
+    print(f"{'multi-pass':<12} {multi_pass_result['ms_per_frame']:13.1f} {multi_pass_result['peak_mib']:9.1f}")
+    print(f"{'single-pass':<12} {single_pass_result['ms_per_frame']:13.1f} {single_pass_result['peak_mib']:9.1f}")
+    print(f"speedup: {multi_pass_result['ms_per_frame'] / single_pass_result['ms_per_frame']:.1f}x time, "
+          f"{multi_pass_result['peak_mib'] / single_pass_result['peak_mib']:.1f}x peak memory")
+
+
+if __name__ == "__main__":
+    main()
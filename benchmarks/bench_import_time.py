@@ -0,0 +1,78 @@
+# call from project directory
+# python benchmarks/bench_import_time.py [--repeat 5]
+#
+# Uses "python -X importtime" to measure the cumulative import time of
+# each command line entry point and fails if any exceeds its startup budget.
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("bench_import_time")
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entry point module -> startup budget in milliseconds
+ENTRY_POINT_BUDGETS_MS = {
+    "s3_utils": 150,
+    "sync_s3_image_files": 250,
+    "create_data_files": 250,
+}
+
+
+def measure_import_time_ms(module: str) -> float:
+    '''
+    Run "python -X importtime -c 'import <module>'" in a fresh interpreter
+    and return the cumulative import time of <module> in milliseconds
+    '''
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"import {module} failed: {result.stderr.splitlines()[-1:]}")
+
+    # e.g. "import time:       512 |      23145 | s3_utils"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) == 3 and parts[2].strip() == module and not parts[2].startswith("  "):
+            return int(parts[1]) / 1000.0
+    raise Exception(f"no importtime line found for {module}")
+
+
+def run_import_time_benchmark(repeat: int=5) -> Dict[str,float]:
+    '''
+    Return the best-of-<repeat> import time in milliseconds of each entry point
+    '''
+    results = {}
+    for module in ENTRY_POINT_BUDGETS_MS.keys():
+        results[module] = min(measure_import_time_ms(module) for _ in range(repeat))
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the command line entry points")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of fresh interpreters per entry point')
+    args = parser.parse_args()
+
+    results = run_import_time_benchmark(repeat=args.repeat)
+
+    num_over_budget = 0
+    for module, elapsed_ms in results.items():
+        budget_ms = ENTRY_POINT_BUDGETS_MS[module]
+        status = "ok" if elapsed_ms <= budget_ms else "OVER BUDGET"
+        if elapsed_ms > budget_ms:
+            num_over_budget += 1
+        print(f"{module:<24} {elapsed_ms:8.1f} ms  budget {budget_ms:5d} ms  {status}")
+
+    return 1 if num_over_budget > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
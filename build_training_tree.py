@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import re
+from typing import Dict, Set, Tuple
+
+from episode_service import DATA_STAGES, SOURCE_JPG_FILE_PATTERN
+from dataset_snapshot import read_stage_data_files_df
+from env import get_local_data_files_dir, get_local_source_images_dir
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("build_training_tree")
+
+# ============================================
+# build_training_tree MODULE OVERVIEW
+#
+# usage:
+#     python build_training_tree.py --root <root> [--size <img_size>] [--link-mode auto|hardlink|symlink]
+#
+# materializes <root>/<stage>/<label>/<file_name> for every row of the
+# <stage>_data.csv files from the flat directory of source images
+# filled by sync_s3_image_files, without copying any image.
+# Files are hardlinked, which costs no extra disk space. "auto" falls
+# back to absolute symlinks when a hardlink fails, e.g. when <root> is
+# on another filesystem. Updates are incremental: the tree is scanned
+# once, and only links that are missing, stale or no longer needed
+# are added or removed. Only the <stage> dirs of DATA_STAGES are
+# scanned, and only entries this tool creates are ever removed:
+# symlinks into the source dir and files named like a source image.
+# Directories and other files under <root> are left untouched.
+
+LINK_MODES = ['auto', 'hardlink', 'symlink']
+
+# max number of missing source files named in the log
+MAX_MISSING_FILES_LOGGED = 10
+
+# (stage, label, file_name)
+TreeEntry = Tuple[str, str, str]
+
+
+def scan_source_inodes(source_dir: str) -> Dict[str, int]:
+    '''
+    Return the dict of file_name -> inode of all files in source_dir
+    '''
+    with os.scandir(source_dir) as entries:
+        return {entry.name: entry.inode() for entry in entries if entry.is_file(follow_symlinks=False)}
+
+
+def is_tree_link(entry: os.DirEntry, source_dir: str, source_inodes: Dict[str, int]) -> bool:
+    '''
+    Return True if the entry may have been created by build_training_tree,
+    i.e. a symlink into source_dir or a file named like a source image
+    '''
+    if entry.is_symlink():
+        return os.path.dirname(os.readlink(entry.path)) == source_dir
+    if not entry.is_file(follow_symlinks=False):
+        return False
+    return entry.name in source_inodes or re.match(SOURCE_JPG_FILE_PATTERN, entry.name) is not None
+
+
+def scan_tree(root: str, source_dir: str, source_inodes: Dict[str, int]) -> Tuple[Set[TreeEntry], Set[TreeEntry]]:
+    '''
+    Scan the <root>/<stage>/<label>/ dirs of DATA_STAGES once and return
+    the tuple (current entries, stale entries) of the links created by
+    build_training_tree, where stale entries are links that no longer
+    point at the current source file
+    '''
+    current = set()
+    stale = set()
+    if not os.path.isdir(root):
+        return current, stale
+    for stage_entry in os.scandir(root):
+        if stage_entry.name not in DATA_STAGES or not stage_entry.is_dir(follow_symlinks=False):
+            continue
+        for label_entry in os.scandir(stage_entry.path):
+            if not label_entry.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(label_entry.path):
+                if not is_tree_link(entry, source_dir, source_inodes):
+                    continue
+                tree_entry = (stage_entry.name, label_entry.name, entry.name)
+                current.add(tree_entry)
+                if entry.is_symlink():
+                    is_current = os.readlink(entry.path) == os.path.join(source_dir, entry.name)
+                else:
+                    is_current = source_inodes.get(entry.name) == entry.inode()
+                if not is_current:
+                    stale.add(tree_entry)
+    return current, stale
+
+
+def get_tree_path(root: str, tree_entry: TreeEntry) -> str:
+    stage, label, file_name = tree_entry
+    return os.path.join(root, stage, label, file_name)
+
+
+def remove_empty_label_dirs(root: str, tree_entries: Set[TreeEntry]) -> None:
+    for stage, label in set((stage, label) for stage, label, _ in tree_entries):
+        label_dir = os.path.join(root, stage, label)
+        if os.path.isdir(label_dir) and len(os.listdir(label_dir)) == 0:
+            os.rmdir(label_dir)
+
+
+def build_training_tree(root: str, source_dir: str=None, link_mode: str='auto', data_files_dir: str=None) -> Dict[str,int]:
+    '''
+    Incrementally link <root>/<stage>/<label>/<file_name> to
+    <source_dir>/<file_name> for all rows of the stage data files
+    in data_files_dir, by default the local data files dir
+    Return a dict of num_added, num_removed, num_unchanged, num_missing and num_symlinked
+    '''
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"link_mode must be one of {LINK_MODES} not {link_mode}")
+    source_dir = os.path.abspath(source_dir if source_dir is not None else get_local_source_images_dir())
+    root = os.path.abspath(root)
+
+    data_files_dir = data_files_dir if data_files_dir is not None else get_local_data_files_dir()
+    stage_data_files = {stage: os.path.join(data_files_dir, f"{stage}_data.csv") for stage in DATA_STAGES}
+    rows = read_stage_data_files_df({stage: path for stage, path in stage_data_files.items() if os.path.isfile(path)})
+    required = set(zip(rows['stage'], rows['label'], rows['file_name']))
+
+    source_inodes = scan_source_inodes(source_dir)
+    current, stale = scan_tree(root, source_dir, source_inodes)
+
+    # stale links are replaced
+    to_remove = (current - required) | (current & stale)
+    to_add = required - (current - stale)
+
+    for tree_entry in to_remove:
+        os.remove(get_tree_path(root, tree_entry))
+    remove_empty_label_dirs(root, to_remove)
+
+    missing = sorted(tree_entry for tree_entry in to_add if tree_entry[2] not in source_inodes)
+    if len(missing) > 0:
+        examples = [file_name for _, _, file_name in missing[:MAX_MISSING_FILES_LOGGED]]
+        logger.warning(f"{len(missing)} files of the stage data files are not in {source_dir} e.g. {examples}")
+
+    num_added = 0
+    num_symlinked = 0
+    use_symlinks = link_mode == 'symlink'
+    for tree_entry in sorted(to_add - set(missing)):
+        src_path = os.path.join(source_dir, tree_entry[2])
+        dst_path = get_tree_path(root, tree_entry)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        if not use_symlinks:
+            try:
+                os.link(src_path, dst_path)
+                num_added += 1
+                continue
+            except OSError as exp:
+                if link_mode == 'hardlink':
+                    raise
+                logger.info(f"hardlink failed, using symlinks from here on: {str(exp)}")
+                use_symlinks = True
+        os.symlink(src_path, dst_path)
+        num_added += 1
+        num_symlinked += 1
+
+    return {
+        "num_added": num_added,
+        "num_removed": len(to_remove),
+        "num_unchanged": len(required & (current - stale)),
+        "num_missing": len(missing),
+        "num_symlinked": num_symlinked
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Link <root>/<stage>/<label>/<file_name> to the local source images for all stage data files",
+        usage="--help/-h --root <root> [--size <img_size>] [--link-mode auto|hardlink|symlink]")
+    parser.add_argument(
+        '--root', required=True,
+        metavar="<root>",
+        help='root directory of the training tree')
+    parser.add_argument(
+        '--size', default=None,
+        metavar="<img_size>",
+        help='optional <img_size> sub-directory of the local source images, see sync_s3_image_files --sizes')
+    parser.add_argument(
+        '--link-mode', default='auto',
+        choices=LINK_MODES,
+        help='hardlinks with a symlink fallback by default')
+    args = vars(parser.parse_args())
+
+    source_dir = get_local_source_images_dir()
+    if args['size'] is not None:
+        source_dir = os.path.join(source_dir, args['size'])
+
+    result = build_training_tree(root=args['root'], source_dir=source_dir, link_mode=args['link_mode'])
+    print("build_training_tree results:", json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
@@ -3,7 +3,8 @@ logging.basicConfig(level = logging.INFO)
 logger = logging.getLogger("create_data_files")
 
 import argparse
-from episode_service import create_all_stage_data_files
+from episode_service import create_all_stage_data_files, DATA_FILES_SUBSAMPLE_RATE
+from profile_utils import PROFILE_MODES, run_profiler
 
 from env import LOCAL_DATA_FILES_DIR, S3_MEDIA_ANGEL_NFT_BUCKET, S3_MANIFESTS_DIR
 
@@ -16,37 +17,65 @@ def main():
     activate
     python create_data_files.py --subsample 200
     """
-    ss = 100
+    ss = DATA_FILES_SUBSAMPLE_RATE
     parser = argparse.ArgumentParser(
         description=f"Create shuffled google data files in '{LOCAL_DATA_FILES_DIR}/' for all season manifest json files found under 's3://{S3_MEDIA_ANGEL_NFT_BUCKET}/{S3_MANIFESTS_DIR}'", 
-        usage=f"--help/-h [--subsample <pos int> default {ss}] [--cleanup] [--verbose]")
+        usage=f"--help/-h [--subsample <pos int> default {ss}] [--pushdown] [--group-near-duplicates] [--cleanup] [--snapshot] [--verbose] [--profile cpu|mem|both]")
     parser.add_argument(
         '--subsample', default=ss, 
         metavar="<subsample>",
         help='an optional subsample rate')
+    parser.add_argument(
+        '--pushdown', default=False, 
+        action=argparse.BooleanOptionalAction,
+        help='option to fetch only the subsampled rows of each google sheet')
+    parser.add_argument(
+        '--group-near-duplicates', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to give near-duplicate frames of the local frame hash index the same stage, see frame_hash_index.py')
     parser.add_argument(
         '--cleanup', default=True, 
         action=argparse.BooleanOptionalAction,
         help='option to cleanup intermediate data files')
+    parser.add_argument(
+        '--snapshot', default=True, 
+        action=argparse.BooleanOptionalAction,
+        help='option to publish the data files as an immutable snapshot with a delta file')
     parser.add_argument(
         '--verbose', default=False, 
         action=argparse.BooleanOptionalAction,
         help='optional verbose flag')
+    parser.add_argument(
+        '--profile', default=None,
+        choices=PROFILE_MODES,
+        help='optional cpu and/or memory profile written next to the stage data files')
 
     args = vars(parser.parse_args())
 
     subsample_rate = args['subsample']
+    pushdown_flag = args['pushdown']
+    group_near_duplicates_flag = args['group_near_duplicates']
     cleanup_flag = args['cleanup']
+    snapshot_flag = args['snapshot']
     verbosity_flag = args['verbose']
+    profile_mode = args['profile']
 
     logger.debug(f"subsample_rate: {subsample_rate}")
+    logger.debug(f"pushdown_flag: {pushdown_flag}")
+    logger.debug(f"group_near_duplicates_flag: {group_near_duplicates_flag}")
     logger.debug(f"cleanup_flag: {cleanup_flag}")
+    logger.debug(f"snapshot_flag: {snapshot_flag}")
     logger.debug(f"verbosity_flag: {verbosity_flag}")
+    logger.debug(f"profile_mode: {profile_mode}")
 
-    all_stage_data_files = create_all_stage_data_files(
-        subsample_rate=subsample_rate, 
-        cleanup=cleanup_flag,
-        verbosity=verbosity_flag)
+    with run_profiler(mode=profile_mode, name="create_data_files"):
+        all_stage_data_files = create_all_stage_data_files(
+            subsample_rate=subsample_rate, 
+            cleanup=cleanup_flag,
+            verbosity=verbosity_flag,
+            pushdown_subsample=pushdown_flag,
+            group_near_duplicates=group_near_duplicates_flag,
+            snapshot=snapshot_flag)
 
     logger.debug("all_stage_data_files:")
     for stage, file in all_stage_data_files.items():
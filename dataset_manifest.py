@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import argparse
+import io
+from typing import Dict, List
+
+from episode import Episode
+from episode_service import DATA_STAGES, find_sampled_google_episode_keys_df
+from season_service import download_all_seasons_episodes
+from storage import get_storage
+from env import S3_MEDIA_ANGEL_NFT_BUCKET
+from import_utils import lazy_import
+
+# pandas is only imported on first use
+pd = lazy_import("pandas")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("dataset_manifest")
+
+# ============================================
+# dataset_manifest MODULE OVERVIEW
+#
+# the "virtual dataset" alternative to process_episode.
+# Rather than copying source jpg files into tuttle_twins/ML/<stage>/<class>/
+# and moving or deleting them whenever the shuffle changes, one manifest
+# per stage lists the source keys and labels of that stage, e.g.
+#   s3://media.angel-nft.com/tuttle_twins/datasets/train_manifest.csv
+#     episode_id,img_frame,src_key,label
+#     S01E01,TT_S01_E01_FRM-00-00-08-11,tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/TT_S01_E01_FRM-00-00-08-11.jpg,Common
+# A loader reads the manifest with load_dataset_manifest_df and fetches
+# the source keys directly, so a reshuffle costs one manifest write per
+# stage instead of tens of thousands of s3 copies and deletes.
+
+DATASET_MANIFESTS_DIR = "tuttle_twins/datasets"
+
+DATASET_MANIFEST_FORMATS = ['csv', 'parquet']
+
+DATASET_MANIFEST_COLUMNS = ['episode_id', 'img_frame', 'src_key', 'label']
+
+CONTENT_TYPES = {
+    'csv': "text/csv",
+    'parquet': "application/vnd.apache.parquet"
+}
+
+
+def get_dataset_manifest_key(stage: str, format: str='csv') -> str:
+    '''
+    e.g. "tuttle_twins/datasets/train_manifest.csv"
+    '''
+    if format not in DATASET_MANIFEST_FORMATS:
+        raise ValueError(f"format must be one of {DATASET_MANIFEST_FORMATS} not {format}")
+    return f"{DATASET_MANIFESTS_DIR}/{stage}_manifest.{format}"
+
+
+def find_episode_manifest_df(G: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Convert G, the find_sampled_google_episode_keys_df of an episode
+    with columns [episode_id, img_src, img_frame, new_ml_key],
+    into columns ['stage'] + DATASET_MANIFEST_COLUMNS
+    Rows without a new_ml_key are not part of any stage and are dropped
+    '''
+    G = G[G['new_ml_key'].notnull()]
+    # new_ml_key = stage / label
+    parts = G['new_ml_key'].astype(str).str.split('/', n=1, expand=True)
+    return pd.DataFrame({
+        'stage': parts[0].to_numpy(),
+        'episode_id': G['episode_id'].astype(str).to_numpy(),
+        'img_frame': G['img_frame'].astype(str).to_numpy(),
+        'src_key': G['img_src'].astype(str).to_numpy(),
+        'label': parts[1].to_numpy()})
+
+
+def split_stage_manifest_dfs(episode_manifest_dfs: List[pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    '''
+    Concatenate the episode manifests and split them into
+    one manifest per stage of DATA_STAGES with columns
+    DATASET_MANIFEST_COLUMNS sorted by episode_id and img_frame
+    '''
+    if len(episode_manifest_dfs) > 0:
+        df = pd.concat(episode_manifest_dfs, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=['stage'] + DATASET_MANIFEST_COLUMNS)
+    df = df.sort_values(['episode_id', 'img_frame'], ignore_index=True)
+
+    stage_manifest_dfs = {}
+    for stage in DATA_STAGES:
+        stage_df = df[df['stage'] == stage]
+        stage_manifest_dfs[stage] = stage_df[DATASET_MANIFEST_COLUMNS].reset_index(drop=True)
+    return stage_manifest_dfs
+
+
+def dataset_manifest_to_bytes(df: pd.DataFrame, format: str='csv') -> bytes:
+    if format == 'csv':
+        return df.to_csv(index=False).encode("utf-8")
+    if format == 'parquet':
+        # parquet needs pyarrow or fastparquet
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    raise ValueError(f"format must be one of {DATASET_MANIFEST_FORMATS} not {format}")
+
+
+def dataset_manifest_from_bytes(data: bytes, format: str='csv') -> pd.DataFrame:
+    if format == 'csv':
+        return pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, engine='c')
+    if format == 'parquet':
+        return pd.read_parquet(io.BytesIO(data))
+    raise ValueError(f"format must be one of {DATASET_MANIFEST_FORMATS} not {format}")
+
+
+def publish_dataset_manifests(stage_manifest_dfs: Dict[str, pd.DataFrame], format: str='csv', bucket: str=S3_MEDIA_ANGEL_NFT_BUCKET) -> Dict[str,str]:
+    '''
+    Write each stage manifest as a single s3 object
+    Return the dict of stage -> manifest key
+    '''
+    manifest_keys = {}
+    for stage, df in stage_manifest_dfs.items():
+        key = get_dataset_manifest_key(stage, format)
+        get_storage().put_bytes(
+            bucket=bucket,
+            key=key,
+            body=dataset_manifest_to_bytes(df, format),
+            content_type=CONTENT_TYPES[format])
+        logger.info(f"published stage:{stage} num_rows:{len(df)} to s3://{bucket}/{key}")
+        manifest_keys[stage] = key
+    return manifest_keys
+
+
+def load_dataset_manifest_df(stage: str, format: str='csv', bucket: str=S3_MEDIA_ANGEL_NFT_BUCKET) -> pd.DataFrame:
+    '''
+    Read the manifest of the given stage from s3
+    Return a dataframe with columns DATASET_MANIFEST_COLUMNS
+    whose src_keys are read directly from bucket
+    '''
+    data = get_storage().get_bytes(bucket=bucket, key=get_dataset_manifest_key(stage, format))
+    return dataset_manifest_from_bytes(data, format)
+
+
+def publish_all_episode_manifests(episodes: List[Episode]=None, format: str='csv') -> Dict[str,str]:
+    '''
+    The virtual dataset mode of episode_service.process_all_episodes
+    Shuffle every episode and publish one manifest per stage
+    without any s3 copies, moves or deletes
+    '''
+    if episodes is None:
+        episodes = download_all_seasons_episodes()
+    episode_manifest_dfs = [
+        find_episode_manifest_df(find_sampled_google_episode_keys_df(episode))
+        for episode in episodes]
+    return publish_dataset_manifests(split_stage_manifest_dfs(episode_manifest_dfs), format=format)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Shuffle all episodes and publish per-stage dataset manifests instead of copying files into tuttle_twins/ML",
+        usage="--help/-h [--format csv|parquet]")
+    parser.add_argument(
+        '--format', default='csv',
+        choices=DATASET_MANIFEST_FORMATS,
+        help='file format of the dataset manifests')
+    args = vars(parser.parse_args())
+
+    publish_all_episode_manifests(format=args['format'])
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
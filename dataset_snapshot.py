@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+from env import get_local_data_files_dir
+from import_utils import lazy_import
+
+# pandas is only imported on first use
+pd = lazy_import("pandas")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("dataset_snapshot")
+
+# ============================================
+# dataset_snapshot MODULE OVERVIEW
+#
+# every create_all_stage_data_files run publishes an immutable snapshot
+# of its stage data files under <local data files dir>/snapshots/:
+#
+#   snapshots/LATEST                         the latest snapshot_id
+#   snapshots/<snapshot_id>/train_data.csv   file_name,label rows
+#   snapshots/<snapshot_id>/test_data.csv
+#   snapshots/<snapshot_id>/pred_data.csv
+#   snapshots/<snapshot_id>/snapshot.json    parent_id, created_at, row counts
+#   snapshots/<snapshot_id>/delta.csv        op,stage,file_name,label rows
+#   snapshots/<snapshot_id>/delta-<parent_id>.csv
+#
+# the snapshot_id is the sha256 of the sorted (stage, file_name, label)
+# rows, so identical datasets share one snapshot. delta.csv lists the
+# rows removed ("-") from and added ("+") to the parent snapshot, so a
+# consumer that holds the parent applies the delta instead of
+# re-reading and re-syncing the whole dataset. A relabelled file is
+# one "-" row and one "+" row. delta.csv is against the parent_id of
+# snapshot.json. When an existing snapshot becomes the latest again,
+# e.g. A -> B -> A, its data files are reused and only a
+# delta-<parent_id>.csv against the new parent is added, so a consumer
+# that holds B applies load_snapshot_delta_df(A, parent_id=B).
+
+SNAPSHOTS_DIR_NAME = "snapshots"
+
+# the number of hex digits of the sha256 used as the snapshot_id
+SNAPSHOT_ID_LEN = 16
+
+SNAPSHOT_COLUMNS = ['stage', 'file_name', 'label']
+DELTA_COLUMNS = ['op'] + SNAPSHOT_COLUMNS
+
+
+def get_snapshots_dir(data_files_dir: str=None) -> str:
+    data_files_dir = data_files_dir if data_files_dir is not None else get_local_data_files_dir()
+    return os.path.join(data_files_dir, SNAPSHOTS_DIR_NAME)
+
+
+def get_snapshot_dir(snapshot_id: str, data_files_dir: str=None) -> str:
+    return os.path.join(get_snapshots_dir(data_files_dir), snapshot_id)
+
+
+def get_snapshot_delta_file(snapshot_id: str, parent_id: str=None, data_files_dir: str=None) -> str:
+    '''
+    Return the delta.csv of the snapshot, or its delta-<parent_id>.csv
+    if parent_id is not the parent_id of its snapshot.json
+    '''
+    snapshot_dir = get_snapshot_dir(snapshot_id, data_files_dir)
+    if parent_id is not None:
+        with open(os.path.join(snapshot_dir, "snapshot.json"), "r") as f:
+            if json.load(f)['parent_id'] != parent_id:
+                return os.path.join(snapshot_dir, f"delta-{parent_id}.csv")
+    return os.path.join(snapshot_dir, "delta.csv")
+
+
+def read_stage_data_files_df(stage_data_files: Dict[str,str]) -> pd.DataFrame:
+    '''
+    Read the headerless file_name,label stage data files into one
+    dataframe with columns SNAPSHOT_COLUMNS sorted by all columns
+    '''
+    stage_dfs = []
+    for stage, stage_data_file in stage_data_files.items():
+        df = pd.read_csv(stage_data_file, header=None, names=['file_name', 'label'], dtype=str, keep_default_na=False)
+        df.insert(0, 'stage', stage)
+        stage_dfs.append(df)
+    if len(stage_dfs) == 0:
+        return pd.DataFrame(columns=SNAPSHOT_COLUMNS)
+    df = pd.concat(stage_dfs, ignore_index=True)
+    return df.sort_values(SNAPSHOT_COLUMNS, ignore_index=True)
+
+
+def compute_snapshot_id(rows: pd.DataFrame) -> str:
+    '''
+    Return the content hash of the sorted rows with columns SNAPSHOT_COLUMNS
+    '''
+    lines = rows['stage'] + ',' + rows['file_name'] + ',' + rows['label']
+    return hashlib.sha256(lines.str.cat(sep='\n').encode("utf-8")).hexdigest()[:SNAPSHOT_ID_LEN]
+
+
+def find_snapshot_delta_df(parent_rows: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Return the rows removed from ("-") and added to ("+") parent_rows
+    with columns DELTA_COLUMNS, removes first
+    '''
+    # repeated rows would multiply in the merge
+    parent_rows = parent_rows[SNAPSHOT_COLUMNS].drop_duplicates()
+    rows = rows[SNAPSHOT_COLUMNS].drop_duplicates()
+    df = parent_rows.merge(rows, how='outer', on=SNAPSHOT_COLUMNS, indicator=True)
+    removed = df[df['_merge'] == 'left_only'][SNAPSHOT_COLUMNS]
+    added = df[df['_merge'] == 'right_only'][SNAPSHOT_COLUMNS]
+    removed.insert(0, 'op', '-')
+    added.insert(0, 'op', '+')
+    return pd.concat([removed, added], ignore_index=True)[DELTA_COLUMNS]
+
+
+def apply_snapshot_delta(parent_rows: pd.DataFrame, delta: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Apply a delta to the rows of its parent snapshot and
+    return the sorted rows of the child snapshot
+    '''
+    removed = delta[delta['op'] == '-'][SNAPSHOT_COLUMNS]
+    added = delta[delta['op'] == '+'][SNAPSHOT_COLUMNS]
+    df = parent_rows[SNAPSHOT_COLUMNS].merge(removed, how='left', on=SNAPSHOT_COLUMNS, indicator=True)
+    df = df[df['_merge'] == 'left_only'][SNAPSHOT_COLUMNS]
+    df = pd.concat([df, added], ignore_index=True)
+    return df.sort_values(SNAPSHOT_COLUMNS, ignore_index=True)
+
+
+def get_latest_snapshot_id(data_files_dir: str=None) -> Optional[str]:
+    latest_file = os.path.join(get_snapshots_dir(data_files_dir), "LATEST")
+    if not os.path.isfile(latest_file):
+        return None
+    with open(latest_file, "r") as f:
+        return f.read().strip()
+
+
+def load_snapshot_rows_df(snapshot_id: str, data_files_dir: str=None) -> pd.DataFrame:
+    '''
+    Return the sorted rows of a snapshot with columns SNAPSHOT_COLUMNS
+    '''
+    snapshot_dir = get_snapshot_dir(snapshot_id, data_files_dir)
+    with open(os.path.join(snapshot_dir, "snapshot.json"), "r") as f:
+        stages = json.load(f)['num_rows'].keys()
+    stage_data_files = {stage: os.path.join(snapshot_dir, f"{stage}_data.csv") for stage in stages}
+    return read_stage_data_files_df(stage_data_files)
+
+
+def load_snapshot_delta_df(snapshot_id: str, parent_id: str=None, data_files_dir: str=None) -> pd.DataFrame:
+    '''
+    Return the delta of a snapshot against the given parent_id, by default
+    the parent_id of its snapshot.json, with columns DELTA_COLUMNS
+    '''
+    delta_file = get_snapshot_delta_file(snapshot_id, parent_id, data_files_dir)
+    return pd.read_csv(delta_file, dtype=str, keep_default_na=False)
+
+
+def publish_dataset_snapshot(stage_data_files: Dict[str,str], data_files_dir: str=None) -> str:
+    '''
+    Publish the given stage data files as an immutable snapshot with
+    a delta against the latest snapshot, and make it the latest
+    Return the snapshot_id
+    '''
+    rows = read_stage_data_files_df(stage_data_files)
+    snapshot_id = compute_snapshot_id(rows)
+    parent_id = get_latest_snapshot_id(data_files_dir)
+    snapshot_dir = get_snapshot_dir(snapshot_id, data_files_dir)
+
+    if parent_id is not None:
+        parent_rows = load_snapshot_rows_df(parent_id, data_files_dir)
+    else:
+        parent_rows = pd.DataFrame(columns=SNAPSHOT_COLUMNS)
+
+    if os.path.isdir(snapshot_dir):
+        logger.info(f"snapshot {snapshot_id} already exists")
+        delta_file = get_snapshot_delta_file(snapshot_id, parent_id, data_files_dir)
+        if parent_id is not None and parent_id != snapshot_id and not os.path.isfile(delta_file):
+            # the existing snapshot follows a new parent, e.g. A -> B -> A
+            delta = find_snapshot_delta_df(parent_rows, rows)
+            delta.to_csv(delta_file + ".tmp", index=False)
+            os.replace(delta_file + ".tmp", delta_file)
+            logger.info(f"snapshot {snapshot_id} new parent:{parent_id} removed:{(delta['op'] == '-').sum()} added:{(delta['op'] == '+').sum()}")
+    else:
+        delta = find_snapshot_delta_df(parent_rows, rows)
+
+        # the snapshot is built in a tmp dir and renamed into place,
+        # so a snapshot dir is always complete
+        tmp_dir = snapshot_dir + ".tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        num_rows = {}
+        for stage in stage_data_files.keys():
+            stage_rows = rows[rows['stage'] == stage][['file_name', 'label']]
+            stage_rows.to_csv(os.path.join(tmp_dir, f"{stage}_data.csv"), header=False, index=False)
+            num_rows[stage] = len(stage_rows)
+        delta.to_csv(os.path.join(tmp_dir, "delta.csv"), index=False)
+        with open(os.path.join(tmp_dir, "snapshot.json"), "w") as f:
+            json.dump({
+                'snapshot_id': snapshot_id,
+                'parent_id': parent_id,
+                'created_at': datetime.datetime.utcnow().isoformat(),
+                'num_rows': num_rows,
+                'num_removed': int((delta['op'] == '-').sum()),
+                'num_added': int((delta['op'] == '+').sum())
+            }, f, indent=4)
+        os.replace(tmp_dir, snapshot_dir)
+        logger.info(f"snapshot {snapshot_id} parent:{parent_id} removed:{(delta['op'] == '-').sum()} added:{(delta['op'] == '+').sum()}")
+
+    latest_file = os.path.join(get_snapshots_dir(data_files_dir), "LATEST")
+    with open(latest_file + ".tmp", "w") as f:
+        f.write(snapshot_id + "\n")
+    os.replace(latest_file + ".tmp", latest_file)
+    return snapshot_id
+
+
+if __name__ == "__main__":
+    logger.info("done")
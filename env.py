@@ -12,7 +12,6 @@ load_dotenv()
 # Data team.
 # See the README.md file for instructions
 GOOGLE_CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE")
-assert os.path.isfile(GOOGLE_CREDENTIALS_FILE)
 
 # The main S3 bucket
 S3_MEDIA_ANGEL_NFT_BUCKET = os.getenv("S3_MEDIA_ANGEL_NFT_BUCKET")
@@ -24,8 +23,31 @@ S3_MANIFESTS_DIR = os.getenv("S3_MANIFESTS_DIR")
 # Local directory for the stage data files
 # e.g. train.csv,  test.csv,  pred.csv
 LOCAL_DATA_FILES_DIR = os.getenv("LOCAL_DATA_FILES_DIR")
-assert os.path.isdir(LOCAL_DATA_FILES_DIR)
 
 # Directory for local copies of all source image files synced from S3
 LOCAL_SOURCE_IMAGES_DIR = os.getenv("LOCAL_SOURCE_IMAGES_DIR")
-assert os.path.isdir(LOCAL_SOURCE_IMAGES_DIR)
\ No newline at end of file
+
+# The AWS region of the s3 clients created by s3_utils.get_s3_client()
+AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+
+# Optional local mirror of the buckets, laid out as <LOCAL_STORAGE_DIR>/<bucket>/<key>
+# if set, storage.get_storage() reads and writes the mirror instead of S3
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR")
+
+# The local files and directories above are only verified on first use, 
+# so that command line calls that don't need them start up quickly.
+
+def get_google_credentials_file() -> str:
+    assert GOOGLE_CREDENTIALS_FILE is not None and os.path.isfile(GOOGLE_CREDENTIALS_FILE), \
+        f"ERROR: GOOGLE_CREDENTIALS_FILE not found: {GOOGLE_CREDENTIALS_FILE}"
+    return GOOGLE_CREDENTIALS_FILE
+
+def get_local_data_files_dir() -> str:
+    assert LOCAL_DATA_FILES_DIR is not None and os.path.isdir(LOCAL_DATA_FILES_DIR), \
+        f"ERROR: LOCAL_DATA_FILES_DIR not found: {LOCAL_DATA_FILES_DIR}"
+    return LOCAL_DATA_FILES_DIR
+
+def get_local_source_images_dir() -> str:
+    assert LOCAL_SOURCE_IMAGES_DIR is not None and os.path.isdir(LOCAL_SOURCE_IMAGES_DIR), \
+        f"ERROR: LOCAL_SOURCE_IMAGES_DIR not found: {LOCAL_SOURCE_IMAGES_DIR}"
+    return LOCAL_SOURCE_IMAGES_DIR
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from episode import Episode
+from episode_service import add_randomized_new_ml_folder_column, process_episode, fetch_google_episode_sheet_df, find_new_ml_img_class, \
+    build_ml_keys, drop_malformed_img_frames, find_source_frame_ids, find_missing_source_frame_ids, log_missing_source_frames, \
+    get_subsample_rate, set_subsample_rate, DATA_FILES_SUBSAMPLE_RATE
+from season_service import download_all_seasons_episodes
+from storage import get_storage
+from ml_listing import MLListingSnapshot
+from ml_verify import verify_episode_mappings, get_verify_status
+from frame_id import encode_frame_ids, decode_frame_ids
+from env import S3_MEDIA_ANGEL_NFT_BUCKET, get_local_data_files_dir
+from import_utils import lazy_import
+
+# pandas and numpy are only imported on first use
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("episode_delta")
+
+# ============================================
+# episode_delta MODULE OVERVIEW
+#
+# process_episode re-reads the sheet, re-samples and re-shuffles every
+# frame and diffs the whole episode against the ML tree on every run.
+# After a full run, the applied mapping of the sampled frames
+# (frame_id -> ml_key) is saved under <local data files dir>/applied/.
+# A delta run reads the sheet once, recomputes the classification of
+# only the applied frames, keeps each frame's stage, and makes s3
+# operations only for frames that were
+#   removed:    ml_key -> null          delete the ML file
+#   relabelled: ml_key -> new_ml_key    move the ML file
+#   added:      null -> new_ml_key      copy the source file
+# without listing the ML tree. A full run is made instead if there is
+# no applied mapping, the subsample rate changed or the last full run
+# is older than full_reconcile_seconds.
+# --verify checks the applied mappings of all episodes after the run
+# against one fresh paginated listing of the ML tree, see ml_verify,
+# and exits with status 1 if any episode does not match, --verify-only
+# makes that check without a run.
+
+APPLIED_STATE_DIR_NAME = "applied"
+
+# a full process_episode run is made at least this often
+FULL_RECONCILE_SECONDS = 7 * 24 * 60 * 60
+
+APPLIED_COLUMNS = ['frame_id', 'ml_key']
+
+
+def get_applied_state_dir() -> str:
+    return os.path.join(get_local_data_files_dir(), APPLIED_STATE_DIR_NAME)
+
+
+def get_applied_mapping_file(episode_id: str) -> str:
+    '''
+    e.g. <local data files dir>/applied/S01E01_applied.csv
+    '''
+    return os.path.join(get_applied_state_dir(), f"{episode_id}_applied.csv")
+
+
+def get_applied_state_index_file() -> str:
+    return os.path.join(get_applied_state_dir(), "applied_state.json")
+
+
+def load_applied_state_index() -> Dict[str, dict]:
+    '''
+    Return the dict of episode_id -> dict of reconciled_at, updated_at and subsample_rate
+    '''
+    index_file = get_applied_state_index_file()
+    if not os.path.isfile(index_file):
+        return {}
+    with open(index_file, "r") as f:
+        return json.load(f)
+
+
+def load_applied_mapping(episode_id: str) -> Tuple[Optional[pd.DataFrame], Optional[dict]]:
+    '''
+    Return the last applied mapping of the episode with columns
+    [frame_id, ml_key] and its state, or (None, None)
+    '''
+    state = load_applied_state_index().get(episode_id)
+    mapping_file = get_applied_mapping_file(episode_id)
+    if state is None or not os.path.isfile(mapping_file):
+        return None, None
+    applied = pd.read_csv(mapping_file, dtype={'frame_id': np.int64, 'ml_key': object})
+    return applied, state
+
+
+def save_applied_mapping(episode_id: str, applied: pd.DataFrame, full_reconcile: bool) -> None:
+    '''
+    Save the applied mapping of the episode and update its state
+    '''
+    os.makedirs(get_applied_state_dir(), exist_ok=True)
+    applied[APPLIED_COLUMNS].to_csv(get_applied_mapping_file(episode_id), index=False)
+
+    now = datetime.datetime.utcnow().isoformat()
+    index = load_applied_state_index()
+    state = index.get(episode_id, {})
+    state['updated_at'] = now
+    if full_reconcile:
+        state['reconciled_at'] = now
+        state['subsample_rate'] = get_subsample_rate()
+    index[episode_id] = state
+    tmp_file = get_applied_state_index_file() + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(index, f, indent=4)
+    os.replace(tmp_file, get_applied_state_index_file())
+
+
+def needs_full_reconcile(state: Optional[dict], full_reconcile_seconds: float=FULL_RECONCILE_SECONDS) -> bool:
+    if state is None or state.get('subsample_rate') != get_subsample_rate():
+        return True
+    reconciled_at = datetime.datetime.fromisoformat(state['reconciled_at'])
+    age = datetime.datetime.utcnow() - reconciled_at
+    return age.total_seconds() > full_reconcile_seconds
+
+
+def find_sheet_classes_df(episode: Episode) -> Tuple[str, pd.DataFrame]:
+    '''
+    Read the episode's google sheet once and return the tuple
+    (src_dir, df) where df has columns [frame_id, new_ml_img_class]
+    and src_dir is e.g. tuttle_twins/s01e01/default_eng/v1/frames/thumbnails
+    Rows with a malformed FRAME NUMBER are dropped and logged
+    '''
+    s3_thumbnails_base_url, df = fetch_google_episode_sheet_df(episode)
+    df = drop_malformed_img_frames(df, column='FRAME NUMBER')
+    tt_idx = s3_thumbnails_base_url.find("tuttle_twins")
+    src_dir = s3_thumbnails_base_url[tt_idx:].rstrip('/')
+    sheet_classes = pd.DataFrame({
+        'frame_id': encode_frame_ids(df['FRAME NUMBER']),
+        'new_ml_img_class': find_new_ml_img_class(df)})
+    return src_dir, sheet_classes
+
+
+def find_sheet_delta_df(applied: pd.DataFrame, sheet_classes: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Vectorized diff of the applied mapping [frame_id, ml_key] against the
+    fresh sheet classes [frame_id, new_ml_img_class].
+    Each applied frame keeps its stage. Frames without a stage get a
+    random one, as in add_randomized_new_ml_folder_column, which only
+    sticks once they are classified.
+    Return only the changed frames with columns [frame_id, ml_key, new_ml_key]
+    '''
+    df = applied.merge(sheet_classes.drop_duplicates(subset=['frame_id']), how='left', on='frame_id', sort=False)
+    has_ml_key = df['ml_key'].notnull()
+    has_class = df['new_ml_img_class'].notnull()
+
+    stage = df['ml_key'].where(has_ml_key, '').str.split('/', n=1).str[0]
+    num_unstaged = int((~has_ml_key).sum())
+    if num_unstaged > 0:
+        unstaged = add_randomized_new_ml_folder_column(pd.DataFrame(index=range(num_unstaged)))
+        stage.loc[~has_ml_key] = unstaged['new_ml_folder'].to_numpy()
+
+    new_ml_key = (stage + '/' + df['new_ml_img_class'].where(has_class, '')).where(has_class, None)
+    df = pd.DataFrame({
+        'frame_id': df['frame_id'].to_numpy(),
+        'ml_key': df['ml_key'].to_numpy(),
+        'new_ml_key': new_ml_key.to_numpy()})
+
+    # null == null is unchanged
+    changed = df['ml_key'].ne(df['new_ml_key']) & ~(df['ml_key'].isnull() & df['new_ml_key'].isnull())
+    return df[changed].reset_index(drop=True)
+
+
+def apply_sheet_delta(episode: Episode, delta: pd.DataFrame, src_dir: str, listing: MLListingSnapshot=None) -> pd.DataFrame:
+    '''
+    Make the s3 deletes, moves and copies of the delta rows
+    Return the applied rows with columns [frame_id, ml_key], where
+    frames whose copy failed keep their old ml_key
+    '''
+    episode_id = episode.get_episode_id()
+    has_ml_key = delta['ml_key'].notnull()
+    has_new_ml_key = delta['new_ml_key'].notnull()
+    applied = delta[['frame_id']].assign(ml_key=delta['new_ml_key'])
+
+    removed = delta[has_ml_key & ~has_new_ml_key]
+    if len(removed) > 0:
+        get_storage().batch_delete(bucket=S3_MEDIA_ANGEL_NFT_BUCKET, keys=list(build_ml_keys(removed['ml_key'], removed['frame_id'])))
+        if listing is not None:
+            listing.remove_episode_keys(episode_id, removed[['frame_id', 'ml_key']])
+
+    relabelled = delta[has_ml_key & has_new_ml_key]
+    if len(relabelled) > 0:
+        src_keys = list(build_ml_keys(relabelled['ml_key'], relabelled['frame_id']))
+        dst_keys = list(build_ml_keys(relabelled['new_ml_key'], relabelled['frame_id']))
+        copied_dst_keys = get_storage().copy_many(src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, src_keys=src_keys,
+                        dst_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, dst_keys=dst_keys)
+        # only the sources of the copied frames are deleted
+        is_copied = pd.Series(dst_keys, index=relabelled.index).isin(copied_dst_keys)
+        get_storage().batch_delete(bucket=S3_MEDIA_ANGEL_NFT_BUCKET, keys=[key for key, copied in zip(src_keys, is_copied) if copied])
+        not_copied = relabelled[~is_copied]
+        applied.loc[applied['frame_id'].isin(not_copied['frame_id']), 'ml_key'] = not_copied['ml_key'].to_numpy()
+        relabelled = relabelled[is_copied]
+        if listing is not None:
+            listing.add_episode_keys(episode_id, relabelled[['frame_id', 'new_ml_key']].rename(columns={'new_ml_key': 'ml_key'}))
+            listing.remove_episode_keys(episode_id, relabelled[['frame_id', 'ml_key']])
+
+    added = delta[~has_ml_key & has_new_ml_key]
+    if len(added) > 0:
+        missing_frame_ids = find_missing_source_frame_ids(added['frame_id'], find_source_frame_ids(src_dir))
+        if len(missing_frame_ids) > 0:
+            log_missing_source_frames(episode_id, src_dir, missing_frame_ids)
+            # frames without a source file stay unapplied
+            applied.loc[applied['frame_id'].isin(missing_frame_ids), 'ml_key'] = None
+            added = added[~added['frame_id'].isin(missing_frame_ids)]
+        img_frames = pd.Series(decode_frame_ids(added['frame_id']), dtype=object)
+        src_keys = list(src_dir + '/' + img_frames + ".jpg")
+        dst_keys = list(build_ml_keys(added['new_ml_key'], added['frame_id']))
+        copied_dst_keys = get_storage().copy_many(src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, src_keys=src_keys,
+                        dst_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, dst_keys=dst_keys)
+        is_copied = pd.Series(dst_keys, index=added.index).isin(copied_dst_keys)
+        applied.loc[applied['frame_id'].isin(added.loc[~is_copied, 'frame_id']), 'ml_key'] = None
+        added = added[is_copied]
+        if listing is not None:
+            listing.add_episode_keys(episode_id, added[['frame_id', 'new_ml_key']].rename(columns={'new_ml_key': 'ml_key'}))
+
+    logger.info(f"episode_id: {episode_id} delta removed:{len(removed)} relabelled:{len(relabelled)} added:{len(added)}")
+    return applied
+
+
+def process_episode_delta(episode: Episode, listing: MLListingSnapshot=None, full_reconcile_seconds: float=FULL_RECONCILE_SECONDS) -> str:
+    '''
+    Process only the frames of the episode whose classification
+    changed since the last applied mapping, or make a full
+    process_episode run if one is due
+    Return "full" or "delta"
+    '''
+    episode_id = episode.get_episode_id()
+    applied, state = load_applied_mapping(episode_id)
+    if applied is None or needs_full_reconcile(state, full_reconcile_seconds):
+        logger.info(f"episode_id: {episode_id} full reconcile")
+        applied = process_episode(episode, listing=listing)
+        if applied is not None:
+            save_applied_mapping(episode_id, applied, full_reconcile=True)
+        return "full"
+
+    src_dir, sheet_classes = find_sheet_classes_df(episode)
+    delta = find_sheet_delta_df(applied, sheet_classes)
+    if len(delta) == 0:
+        logger.info(f"episode_id: {episode_id} no changed frames")
+        return "delta"
+
+    changes = apply_sheet_delta(episode, delta, src_dir, listing=listing)
+    applied = applied.set_index('frame_id')
+    applied.loc[changes['frame_id'].to_numpy(), 'ml_key'] = changes['ml_key'].to_numpy()
+    save_applied_mapping(episode_id, applied.reset_index(), full_reconcile=False)
+    return "delta"
+
+
+def process_all_episodes_delta(full_reconcile_seconds: float=FULL_RECONCILE_SECONDS) -> Dict[str,str]:
+    '''
+    process_episode_delta for all episodes of all season manifests
+    Return a dict of episode_id -> "full" or "delta"
+    '''
+    results = {}
+    for episode in download_all_seasons_episodes():
+        results[episode.get_episode_id()] = process_episode_delta(episode, full_reconcile_seconds=full_reconcile_seconds)
+    return results
+
+
+def verify_applied_episodes(episode_ids: List[str]=None, listing: MLListingSnapshot=None) -> Dict[str,dict]:
+    '''
+    Verify the applied mapping of the given episode_ids, by default of all
+    applied episodes, against the listing, by default a fresh listing
+    of the ML tree
+    Return a dict of episode_id -> verify_episode_keys result
+    '''
+    episode_ids = episode_ids if episode_ids is not None else sorted(load_applied_state_index().keys())
+    mappings = {}
+    for episode_id in episode_ids:
+        applied, _ = load_applied_mapping(episode_id)
+        if applied is None:
+            logger.warning(f"episode_id: {episode_id} has no applied mapping to verify")
+            continue
+        mappings[episode_id] = applied
+    return verify_episode_mappings(mappings, listing=listing)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Apply only the changed google sheet classifications of all episodes to tuttle_twins/ML",
+        usage=f"--help/-h [--subsample <pos int> default {DATA_FILES_SUBSAMPLE_RATE}] [--full-reconcile <seconds>] [--verify] [--verify-only]")
+    parser.add_argument(
+        '--subsample', default=DATA_FILES_SUBSAMPLE_RATE,
+        metavar="<subsample>",
+        help='the subsample rate of full reconcile runs, the same default as create_data_files')
+    parser.add_argument(
+        '--full-reconcile', default=FULL_RECONCILE_SECONDS, type=float,
+        help='max seconds between full process_episode runs of an episode, 0 forces a full run')
+    parser.add_argument(
+        '--verify', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to verify the applied mappings against a fresh listing of tuttle_twins/ML after the run')
+    parser.add_argument(
+        '--verify-only', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to only verify the applied mappings, without a run')
+    args = vars(parser.parse_args())
+
+    if not args['verify_only']:
+        set_subsample_rate(args['subsample'])
+        results = process_all_episodes_delta(full_reconcile_seconds=args['full_reconcile'])
+        logger.info(f"results: {results}")
+
+    if args['verify'] or args['verify_only']:
+        status = get_verify_status(verify_applied_episodes())
+        if status != 0:
+            sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
@@ -1,19 +1,35 @@
-import pandas as pd
-import numpy as np
-import gspread
+from __future__ import annotations
+
+import io
 import os
+import re
+import sys
 from time import perf_counter
 from shutil import copyfile
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import random
 from random import choices
 import datetime
 from episode import Episode
 from file_utils import concatonate_file, concatonate_files
 from s3_key import get_S3Key_dict_list
-from s3_utils import s3_log_timer_info, s3_ls_recursive, s3_delete_files, s3_copy_files
+from s3_utils import s3_log_timer_info
+from storage import get_storage
 from season_service import download_all_seasons_episodes
-from env import S3_MEDIA_ANGEL_NFT_BUCKET, GOOGLE_CREDENTIALS_FILE, LOCAL_DATA_FILES_DIR
+from env import S3_MEDIA_ANGEL_NFT_BUCKET, LOCAL_DATA_FILES_DIR, get_google_credentials_file, get_local_data_files_dir
+from import_utils import lazy_import
+from frame_id import encode_frame_ids, decode_frame_ids, find_img_frame_mask
+from ml_listing import MLListingSnapshot
+from ml_verify import verify_episode_mappings, get_verify_status
+from profile_utils import profile_phase
+from dataset_snapshot import publish_dataset_snapshot
+
+# pandas, numpy and gspread are only imported on first use
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+gspread = lazy_import("gspread")
+# frame_hash_index imports episode_service through sync_s3_image_files
+frame_hash_index = lazy_import("frame_hash_index")
 
 import logging
 logging.basicConfig(level = logging.INFO)
@@ -23,6 +39,10 @@ from logger_utils import set_all_info_loggers_to_debug_level
 
 DATA_STAGES = ['train','test','pred']
 
+# the subsample rate of create_data_files and episode_delta, the applied
+# mappings of episode_delta are only valid for the rate they were sampled with
+DATA_FILES_SUBSAMPLE_RATE = 100
+
 _subsample_rate = 200
 
 def set_subsample_rate(rate):
@@ -38,6 +58,34 @@ def set_subsample_rate(rate):
 def get_subsample_rate():
     return _subsample_rate
 
+_pushdown_subsample = False
+
+def set_pushdown_subsample(flag: bool=False):
+    '''
+    if set, sample rows are chosen before the google sheet is read
+    and only those rows are fetched
+    '''
+    global _pushdown_subsample
+    _pushdown_subsample = bool(flag)
+    logger.debug(f"pushdown_subsample: {_pushdown_subsample}")
+
+def get_pushdown_subsample() -> bool:
+    return _pushdown_subsample
+
+_group_near_duplicates = False
+
+def set_group_near_duplicates(flag: bool=False):
+    '''
+    if set, the near-duplicate frames of the local frame hash index,
+    see frame_hash_index.find_frame_groups, get the same new_ml_folder
+    '''
+    global _group_near_duplicates
+    _group_near_duplicates = bool(flag)
+    logger.debug(f"group_near_duplicates: {_group_near_duplicates}")
+
+def get_group_near_duplicates() -> bool:
+    return _group_near_duplicates
+
 _verbosity_flag = False
 
 def set_verbosity(flag :bool=False):
@@ -91,20 +139,17 @@ def get_verbosity() -> bool:
 # J3 where new_ml_key is not null and ml_key is null copy img_src file to new_ml_key file
 
 #-----------------------------
-# C4 =  fresh s3_find_episode_jpg_keys_df(episode)
-# C4 with columns [last_modified, size, key, ml_folder, ml_image_class, img_frame, season_code, episode_code, episode_id]
-# C4 -> columns [episode_id, img_frame, ml_key]
-
-#-----------------------------
-# G still has columns [episode_id, img_frame, new_ml_key, img_src]
-# G2 -> G with columns [episode_id, img_frame, ml_key]
-
-#-----------------------------
-# assert C4 == G2
+# process_all_episodes verifies the (img_frame, ml_key) sets of the
+# applied mappings of all episodes against one fresh listing of
+# tuttle_twins/ML, see ml_verify, and python episode_service.py
+# exits with status 1 on a mismatch
     
-def add_randomized_new_ml_folder_column(df: pd.DataFrame) -> pd.DataFrame:
+def add_randomized_new_ml_folder_column(df: pd.DataFrame, groups=None) -> pd.DataFrame:
     '''
     per a percentage-wise distribution for episode_service.DATA_STAGES
+    if groups are given, one per row of df, all rows of a group get
+    the same new_ml_folder, e.g. the near-duplicate frames of
+    frame_hash_index.find_frame_groups
     '''
     percentage_distribution = [
         ("train", 0.7),
@@ -116,11 +161,168 @@ def add_randomized_new_ml_folder_column(df: pd.DataFrame) -> pd.DataFrame:
 
     choices = new_ml_folders = [x[0] for x in percentage_distribution]
     weights = new_percentages = [x[1] for x in percentage_distribution]
-    k = len(df)
-
-    df['new_ml_folder'] = random.choices(choices, weights=weights, k=k)
+    if groups is None:
+        k = len(df)
+        df['new_ml_folder'] = random.choices(choices, weights=weights, k=k)
+        return df
+
+    codes, unique_groups = pd.factorize(np.asarray(groups))
+    group_folders = np.array(random.choices(choices, weights=weights, k=len(unique_groups)), dtype=object)
+    df['new_ml_folder'] = group_folders[codes]
     return df
 
+# the only google episode sheet columns used to define G
+SHEET_FRAME_NUMBER_COLUMN = "FRAME NUMBER"
+SHEET_CLASSIFICATION_COLUMNS = [
+    "JONNY's RECLASSIFICATION",
+    "SUPERVISED CLASSIFICATION",
+    "UNSUPERVISED CLASSIFICATION"
+]
+
+_gspread_client = None
+
+def get_gspread_client():
+    '''
+    Return the shared gspread client, authorizing it on first use
+    '''
+    global _gspread_client
+    if _gspread_client is None:
+        _gspread_client = gspread.service_account(filename=get_google_credentials_file())
+    return _gspread_client
+
+def find_google_sheet_version(episode: Episode) -> str:
+    '''
+    Return the google drive version of the episode's spreadsheet,
+    which increases with every change to the spreadsheet. This is
+    a single small drive metadata request that doesn't open or
+    read the spreadsheet.
+    '''
+    spreadsheet_id = gspread.utils.extract_id_from_url(episode.get_google_spreadsheet_share_link())
+    client = get_gspread_client()
+    # gspread 6 moved Client.request to Client.http_client.request
+    request = client.http_client.request if hasattr(client, "http_client") else client.request
+    response = request(
+        "get",
+        f"{gspread.urls.DRIVE_FILES_API_V3_URL}/{spreadsheet_id}",
+        params={"fields": "version", "supportsAllDrives": True})
+    return str(response.json()["version"])
+
+@s3_log_timer_info
+def fetch_google_episode_sheet_df(episode: Episode) -> Tuple[str, pd.DataFrame]:
+    '''
+    Download the first sheet of the episode's google spreadsheet as a single 
+    CSV export and parse only the FRAME NUMBER and classification columns 
+    with pandas' C parser, so the METADATA column and other unused columns 
+    never become python objects. Empty cells are kept as empty strings.
+    Return the tuple (s3_thumbnails_base_url, df)
+    '''
+    gsheet = get_gspread_client().open_by_url(episode.get_google_spreadsheet_share_link())
+    csv_bytes = gsheet.export(format=gspread.utils.ExportFormat.CSV)
+
+    # the public 's3_thumbnails_base_url' is the name of column zero
+    header_df = pd.read_csv(io.BytesIO(csv_bytes), nrows=0, engine='c')
+    s3_thumbnails_base_url = header_df.columns[0]
+
+    usecols = [SHEET_FRAME_NUMBER_COLUMN] + SHEET_CLASSIFICATION_COLUMNS
+    dtype = {column: 'category' for column in SHEET_CLASSIFICATION_COLUMNS}
+    dtype[SHEET_FRAME_NUMBER_COLUMN] = str
+    df = pd.read_csv(io.BytesIO(csv_bytes), 
+        usecols=usecols, 
+        dtype=dtype, 
+        keep_default_na=False, 
+        engine='c')
+
+    logger.debug(f"fetch_google_episode_sheet_df() episode_id:{episode.get_episode_id()} csv_bytes:{len(csv_bytes)} df.shape:{df.shape}")
+    return s3_thumbnails_base_url, df
+
+# max number of A1 ranges per worksheet.batch_get request
+SHEET_MAX_RANGES_PER_REQUEST = 200
+
+def coalesce_row_ranges(rows: List[int]) -> List[Tuple[int,int]]:
+    '''
+    Coalesce a list of sheet row numbers into a sorted list
+    of inclusive (first_row, last_row) ranges
+    e.g. [2, 3, 4, 9, 11, 12] -> [(2, 4), (9, 9), (11, 12)]
+    '''
+    row_ranges = []
+    for row in sorted(set(rows)):
+        if len(row_ranges) > 0 and row == row_ranges[-1][1] + 1:
+            row_ranges[-1] = (row_ranges[-1][0], row)
+        else:
+            row_ranges.append((row, row))
+    return row_ranges
+
+def find_sample_row_ranges(num_data_rows: int, subsample_rate: int, first_data_row: int=2) -> List[Tuple[int,int]]:
+    '''
+    Randomly choose round(num_data_rows / subsample_rate) of the sheet rows
+    first_data_row .. first_data_row + num_data_rows - 1 
+    and return them as coalesced (first_row, last_row) ranges
+    '''
+    num_sampled_rows = min(num_data_rows, round(num_data_rows / subsample_rate))
+    data_rows = range(first_data_row, first_data_row + num_data_rows)
+    sampled_rows = random.sample(data_rows, num_sampled_rows)
+    return coalesce_row_ranges(sampled_rows)
+
+@s3_log_timer_info
+def fetch_sampled_google_episode_sheet_df(episode: Episode, subsample_rate: int) -> Tuple[str, pd.DataFrame]:
+    '''
+    Choose the sample rows of the first sheet of the episode's google 
+    spreadsheet from its row count before reading any data, then fetch 
+    only the FRAME NUMBER and classification cells of those rows using 
+    batched range reads, so the transfer volume scales with the sample 
+    rather than the episode. 
+    Blank trailing rows of the sheet grid are dropped, so the sample 
+    may be slightly smaller than round(num_rows / subsample_rate).
+    Return the tuple (s3_thumbnails_base_url, df)
+    '''
+    gsheet = get_gspread_client().open_by_url(episode.get_google_spreadsheet_share_link())
+    worksheet = gsheet.sheet1
+
+    # the public 's3_thumbnails_base_url' is the name of column zero
+    header = worksheet.row_values(1)
+    s3_thumbnails_base_url = header[0]
+
+    # the 1-based column numbers of the needed columns
+    usecols = [SHEET_FRAME_NUMBER_COLUMN] + SHEET_CLASSIFICATION_COLUMNS
+    col_numbers = [header.index(column) + 1 for column in usecols]
+    first_col = min(col_numbers)
+    last_col = max(col_numbers)
+    width = last_col - first_col + 1
+
+    # e.g. "C2:F2", "C731:F732"
+    num_data_rows = worksheet.row_count - 1
+    row_ranges = find_sample_row_ranges(num_data_rows, subsample_rate)
+    a1_ranges = [
+        gspread.utils.rowcol_to_a1(first_row, first_col) + ":" + gspread.utils.rowcol_to_a1(last_row, last_col)
+        for first_row, last_row in row_ranges]
+
+    rows = []
+    for i in range(0, len(a1_ranges), SHEET_MAX_RANGES_PER_REQUEST):
+        value_ranges = worksheet.batch_get(a1_ranges[i:i + SHEET_MAX_RANGES_PER_REQUEST])
+        for value_range in value_ranges:
+            for row in value_range:
+                # trailing empty cells are omitted by the sheets api
+                if len(row) > 0:
+                    rows.append(row + [''] * (width - len(row)))
+
+    df = pd.DataFrame(rows, columns=header[first_col - 1:last_col])
+    df = df[usecols]
+    for column in SHEET_CLASSIFICATION_COLUMNS:
+        df[column] = df[column].astype('category')
+
+    logger.debug(f"fetch_sampled_google_episode_sheet_df() episode_id:{episode.get_episode_id()} num_ranges:{len(a1_ranges)} df.shape:{df.shape}")
+    return s3_thumbnails_base_url, df
+
+def find_new_ml_img_class(df: pd.DataFrame) -> np.ndarray:
+    '''
+    Return the first non-empty classification of each row of a google
+    episode sheet df, in the order of SHEET_CLASSIFICATION_COLUMNS, or None
+    '''
+    return \
+        np.where(df["JONNY's RECLASSIFICATION"].str.len() > 0, df["JONNY's RECLASSIFICATION"],
+        np.where(df["SUPERVISED CLASSIFICATION"].str.len() > 0, df["SUPERVISED CLASSIFICATION"],
+        np.where(df["UNSUPERVISED CLASSIFICATION"].str.len() > 0, df["UNSUPERVISED CLASSIFICATION"], None)))
+
 @s3_log_timer_info
 def find_sampled_google_episode_keys_df(episode: Episode) -> pd.DataFrame:
     '''
@@ -132,20 +334,20 @@ def find_sampled_google_episode_keys_df(episode: Episode) -> pd.DataFrame:
     episode_id = episode.get_episode_id()
 
     # use the google credentials file and the episode's google_spreadsheet_share_link to read
-    # the raw contents of the first sheet into G
-    gc = gspread.service_account(filename=GOOGLE_CREDENTIALS_FILE)
-    gsheet = gc.open_by_url(episode.get_google_spreadsheet_share_link())
-    data = gsheet.sheet1.get_all_records()
-    df = pd.DataFrame(data)
-    assert len(df) > 0, f"ERROR: google sheet df is empty"
+    # the needed columns of the first sheet into G
+    # s3_thumbnails_base_url is the name of column zero, e.g. 
+    # https://s3.us-west-2.amazonaws.com/media.angel-nft.com/tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/
+    if get_pushdown_subsample():
+        # only the subsampled rows are fetched
+        s3_thumbnails_base_url, df = fetch_sampled_google_episode_sheet_df(episode, get_subsample_rate())
+        assert len(df) > 0, f"ERROR: google sheet df is empty"
+    else:
+        s3_thumbnails_base_url, df = fetch_google_episode_sheet_df(episode)
+        assert len(df) > 0, f"ERROR: google sheet df is empty"
     
-    # subsample to keep only 1 out of <subsample_rate> rows
-    num_subsampled_rows = round(len(df) / get_subsample_rate() )
-    df = df.sample(num_subsampled_rows)
-
-    # fetch the public 's3_thumbnails_base_url' from the name of column zero
-    # e.g. https://s3.us-west-2.amazonaws.com/media.angel-nft.com/tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/
-    s3_thumbnails_base_url = df.columns[0]
+        # subsample to keep only 1 out of <subsample_rate> rows
+        num_subsampled_rows = round(len(df) / get_subsample_rate() )
+        df = df.sample(num_subsampled_rows)
     
     # parse out 's3_img_src_base' from 's3_thumbnails_base_url'
     # e.g. "tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/"
@@ -177,13 +379,11 @@ def find_sampled_google_episode_keys_df(episode: Episode) -> pd.DataFrame:
     df['img_src'] = s3_img_src_base + df['img_frame'] + ".jpg"
 
     # compute the "new_ml_img_class" column as the first available "CLASSIFICATION" for that row or None
-    df['new_ml_img_class'] = \
-        np.where(df["JONNY's RECLASSIFICATION"].str.len() > 0, df["JONNY's RECLASSIFICATION"],
-        np.where(df["SUPERVISED CLASSIFICATION"].str.len() > 0, df["SUPERVISED CLASSIFICATION"],
-        np.where(df["UNSUPERVISED CLASSIFICATION"].str.len() > 0, df["UNSUPERVISED CLASSIFICATION"], None)))
+    df['new_ml_img_class'] = find_new_ml_img_class(df)
     
-    # add the randomized column 'new_ml_folder'
-    df = add_randomized_new_ml_folder_column(df)
+    # add the randomized column 'new_ml_folder', the same for all near-duplicate frames if set
+    groups = frame_hash_index.find_frame_groups(df['img_frame'].to_numpy()) if get_group_near_duplicates() else None
+    df = add_randomized_new_ml_folder_column(df, groups)
     
     # new_ml_key = new_ml_folder / new_img_class
     df['new_ml_key'] = np.where(~df['new_ml_folder'].isnull() & ~df['new_ml_img_class'].isnull(), df['new_ml_folder'] + '/' + df['new_ml_img_class'], None)
@@ -310,9 +510,8 @@ def s3_find_episode_jpg_keys_df(episode: Episode) -> pd.DataFrame:
     episode_id = episode.get_episode_id()
 
     # example key: tuttle_twins/ML/validate/Rare/TT_S01_E01_FRM-00-00-09-01.jpg
-    episode_key_pattern = f"TT_{episode.get_split_episode_id()}_FRM-.+\.jpg"
-    s3_uri = f"s3://media.angel-nft.com/tuttle_twins/ML/ | egrep -e \"{episode_key_pattern}\""
-    s3keys_list = s3_ls_recursive(s3_uri)
+    episode_key_pattern = re.compile(f"TT_{episode.get_split_episode_id()}_FRM-.+\\.jpg")
+    s3keys_list = [s3_key for s3_key in get_storage().list_objects(bucket, dir) if episode_key_pattern.search(s3_key.key)]
     if len(s3keys_list) == 0:
         logger.debug(f"episode_id:{episode_id} zero episode_jpg_keys found.")
         return pd.DataFrame()
@@ -335,11 +534,139 @@ def s3_find_episode_jpg_keys_df(episode: Episode) -> pd.DataFrame:
     logger.debug(f"s3_find_episode_jpg_keys_df() episode_id:{episode_id} df.shape:{df.shape}")
     return df
 
+def find_episode_key_dtypes(*dfs: pd.DataFrame) -> Dict[str, pd.CategoricalDtype]:
+    '''
+    Return shared categorical dtypes for the 'episode_id', 'ml_key' and 
+    'new_ml_key' columns of the given dataframes, so that G, C and their 
+    joins are merged and compared on integer category codes instead of python
+    object strings. 'ml_key' and 'new_ml_key' share one dtype so they can be
+    compared with each other.
+    '''
+    episode_ids = set()
+    ml_keys = set()
+    for df in dfs:
+        if 'episode_id' in df.columns:
+            episode_ids.update(df['episode_id'].dropna().unique())
+        for column in ['ml_key', 'new_ml_key']:
+            if column in df.columns:
+                ml_keys.update(df[column].dropna().unique())
+
+    ml_key_dtype = pd.CategoricalDtype(sorted(ml_keys))
+    return {
+        'episode_id': pd.CategoricalDtype(sorted(episode_ids)),
+        'ml_key': ml_key_dtype,
+        'new_ml_key': ml_key_dtype
+    }
+
+# max number of malformed img_frames named in the log
+MAX_MALFORMED_FRAMES_LOGGED = 10
+
+def drop_malformed_img_frames(df: pd.DataFrame, column: str='img_frame') -> pd.DataFrame:
+    '''
+    Return the rows of df whose column is a well-formed img_frame,
+    e.g. "TT_S01_E01_FRM-00-19-16-19", and log the dropped rows,
+    so one malformed sheet row or key doesn't abort the episode
+    '''
+    is_valid = find_img_frame_mask(df[column].to_numpy())
+    if not is_valid.all():
+        examples = df[column][~is_valid].tolist()[:MAX_MALFORMED_FRAMES_LOGGED]
+        logger.warning(f"{int((~is_valid).sum())} rows with a malformed {column} dropped e.g. {examples}")
+        df = df[is_valid]
+    return df
+
+def encode_episode_keys_df(df: pd.DataFrame, key_dtypes: Dict[str, pd.CategoricalDtype]) -> pd.DataFrame:
+    '''
+    Convert the key columns of df to the given shared categorical dtypes
+    and replace the 'img_frame' strings with sorted int64 'frame_id's.
+    Rows with a malformed 'img_frame' are dropped and logged.
+    Values missing from a dtype's categories become null and are logged.
+    '''
+    if 'img_frame' in df.columns:
+        df = drop_malformed_img_frames(df)
+        df = df.assign(frame_id=encode_frame_ids(df['img_frame'])) \
+            .drop(columns=['img_frame']) \
+            .sort_values('frame_id', ignore_index=True)
+    for column, dtype in key_dtypes.items():
+        if column in df.columns:
+            num_null = df[column].isnull().sum()
+            df[column] = df[column].astype(dtype)
+            num_unknown = df[column].isnull().sum() - num_null
+            if num_unknown > 0:
+                logger.warning(f"encode_episode_keys_df() {num_unknown} {column} values not found in categories")
+    return df
+
+def null_categorical_column(df: pd.DataFrame, dtype: pd.CategoricalDtype) -> pd.Categorical:
+    '''
+    Return an all-null categorical column of the given dtype for df
+    '''
+    return pd.Categorical.from_codes(np.full(len(df), -1), dtype=dtype)
+
+def build_ml_keys(ml_key: pd.Series, frame_id: pd.Series) -> pd.Series:
+    '''
+    Build the full s3 keys under tuttle_twins/ML from categorical ml_keys and int64 frame_ids
+    e.g. "tuttle_twins/ML/" + "train/Common" + "/" + "TT_S01_E01_FRM-00-18-21-08" + ".jpg"
+    '''
+    img_frame = pd.Series(decode_frame_ids(frame_id), index=frame_id.index)
+    return "tuttle_twins/ML/" + ml_key.astype(str) + '/' + img_frame + ".jpg"
+
+def find_current_episode_keys_df(episode: Episode, listing: MLListingSnapshot=None) -> pd.DataFrame:
+    '''
+    find current jpg keys under tuttle_twins/ML with episode_id
+    from the run's listing snapshot, if given, with columns [episode_id, frame_id, ml_key]
+    or else from a full listing of tuttle_twins/ML with columns [episode_id, img_frame, ml_key]
+    '''
+    if listing is not None:
+        return listing.get_episode_df(episode.get_episode_id())
+    return s3_find_episode_jpg_keys_df(episode)
+
+# e.g. TT_S01_E01_FRM-00-00-09-01.jpg
+SOURCE_JPG_FILE_PATTERN = r"^TT_S\d\d_E\d\d_FRM-\d\d-\d\d-\d\d-\d\d\.jpg$"
+
+# max number of missing source frames named in the log
+MAX_MISSING_FRAMES_LOGGED = 10
+
+@s3_log_timer_info
+def find_source_frame_ids(src_dir: str) -> np.ndarray:
+    '''
+    List the source jpg files under src_dir with one paginated listing, e.g.
+    tuttle_twins/s01e01/default_eng/v1/frames/thumbnails
+    and return their sorted unique int64 frame_ids
+    '''
+    keys = pd.Series(get_storage().list_keys(bucket=S3_MEDIA_ANGEL_NFT_BUCKET, dir=src_dir), dtype=object)
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    file_names = keys.str.rsplit('/', n=1).str[-1]
+    file_names = file_names[file_names.str.match(SOURCE_JPG_FILE_PATTERN)]
+    return np.unique(encode_frame_ids(file_names.str[:-len(".jpg")]))
+
+def find_missing_source_frame_ids(frame_ids: pd.Series, source_frame_ids: np.ndarray) -> np.ndarray:
+    '''
+    Return the frame_ids that have no source file in source_frame_ids
+    '''
+    frame_ids = frame_ids.to_numpy()
+    return frame_ids[~np.isin(frame_ids, source_frame_ids)]
+
+def log_missing_source_frames(episode_id: str, src_dir: str, missing_frame_ids: np.ndarray) -> None:
+    '''
+    Report all missing source frames of an episode in a single warning
+    '''
+    examples = decode_frame_ids(missing_frame_ids[:MAX_MISSING_FRAMES_LOGGED]).tolist()
+    logger.warning(f"episode_id: {episode_id} {len(missing_frame_ids)} frames of the google sheet have no source file under {src_dir} and were not copied e.g. {examples}")
+
 def log_progress(prefix, episode_id, action, num_files, num_sec, files_per_sec):
     logger.debug(f"{prefix} episode_id:{episode_id} {action} - num_files:{num_files} num_sec:{num_sec} rate:{files_per_sec:.3f} files/sec")
 
-def process_episode(episode: Episode) -> None:
-    '''Do everything required to process the given episode'''
+def process_episode(episode: Episode, listing: MLListingSnapshot=None) -> pd.DataFrame:
+    '''
+    Do everything required to process the given episode
+    if listing is given, the episode's current ML keys are taken from
+    that snapshot, which is kept current as files are changed, 
+    instead of from fresh listings of the ML tree
+    Return the applied mapping of the sampled frames with columns 
+    [frame_id, ml_key], where ml_key is null for frames that have no 
+    classification or no source file, or None if the sheet has no rows
+    the applied mapping is verified by ml_verify.verify_episode_mappings
+    '''
 
     episode_id = episode.get_episode_id()
     total_files_needed = 0
@@ -352,7 +679,7 @@ def process_episode(episode: Episode) -> None:
     G = find_sampled_google_episode_keys_df(episode)
     if len(G) == 0:
         logger.debug("find_sampled_google_episode_keys_df() episode_id:{episode_id} zero rows found. Skipping this episode")
-        return
+        return None
     
     total_files_needed = len(G)
     logger.debug(f">>> episode_id:{episode_id} total files needed in s3: {total_files_needed}")
@@ -363,11 +690,7 @@ def process_episode(episode: Episode) -> None:
 
     # --------------------------
     # C is files currently at ml_key
-    C = s3_find_episode_jpg_keys_df(episode)
-    if len(C) > 0:
-        expected = set(C[['episode_id', 'img_frame', 'ml_key']])
-        result = set(C.columns)
-        assert result == expected, f"ERROR: expected C.columns: {expected} not {result}"
+    C = find_current_episode_keys_df(episode, listing)
     
     # NOTE:
     #   if C has been pre-loaded and G has been significantly subsampled
@@ -377,14 +700,25 @@ def process_episode(episode: Episode) -> None:
     logger.debug(f"len(C): {len(C)}")
     logger.debug(f"len(G): {len(G)}")
 
+    # episode_id, ml_key and new_ml_key are categorical and img_frame 
+    # is replaced by the int64 frame_id from here on, so all merges, 
+    # comparisons and sorts use integers
+    key_dtypes = find_episode_key_dtypes(G, C)
+    G = encode_episode_keys_df(G, key_dtypes)
+    C = encode_episode_keys_df(C, key_dtypes)
+    if len(C) > 0:
+        expected = set(['episode_id', 'frame_id', 'ml_key'])
+        result = set(C.columns)
+        assert result == expected, f"ERROR: expected C.columns: {expected} not {result}"
+
     #-------------------------
     # J1 maps ml_key from C that needs to be at new_ml_key from G
-    # J1 = C join G on [episode_id, img_frame] to create
-    # J1 with columns [episode_id, img_frame, ml_key, nullable new_ml_key] 
+    # J1 = C join G on [episode_id, frame_id] to create
+    # J1 with columns [episode_id, frame_id, ml_key, nullable new_ml_key] 
     if len(C) > 0:       
         J1 = C.merge(G,  
             how='left', 
-            on=['episode_id', 'img_frame'], 
+            on=['episode_id', 'frame_id'], 
             suffixes=('',''),
             sort=False)
         
@@ -392,9 +726,9 @@ def process_episode(episode: Episode) -> None:
     # because no ml_key were found
     else:
         J1 = G.copy(deep=True)
-        J1['ml_key'] = None
+        J1['ml_key'] = null_categorical_column(J1, key_dtypes['ml_key'])
 
-    expected = set(['episode_id', 'img_frame', 'ml_key', 'img_src', 'new_ml_key'])
+    expected = set(['episode_id', 'frame_id', 'ml_key', 'img_src', 'new_ml_key'])
     result = set(J1.columns)
     assert result == expected, f"ERROR: expected J1.columns: {expected} not {result}"
             
@@ -410,11 +744,13 @@ def process_episode(episode: Episode) -> None:
     J1_del = J1[~J1['ml_key'].isnull() & J1['new_ml_key'].isnull()] 
     if len(J1_del) > 0:
         # tuttle_twins/ML/validate/Rare/TT_S01_E01_FRM-00-00-09-01.jpg 
-        J1_del['del_key'] = "tuttle_twins/ML/" + J1_del['ml_key'] + '/' + J1_del['img_frame'] + ".jpg"
+        J1_del['del_key'] = build_ml_keys(J1_del['ml_key'], J1_del['frame_id'])
         del_keys = list(J1_del['del_key'].to_numpy())
 
         del_start = perf_counter()
-        s3_delete_files(bucket=S3_MEDIA_ANGEL_NFT_BUCKET, keys=del_keys)
+        get_storage().batch_delete(bucket=S3_MEDIA_ANGEL_NFT_BUCKET, keys=del_keys)
+        if listing is not None:
+            listing.remove_episode_keys(episode_id, J1_del)
 
         action = "files deleted from ML"
         num_files_deleted = len(del_keys)
@@ -444,25 +780,34 @@ def process_episode(episode: Episode) -> None:
         '''
         
         # J1_mv['src_key'] = 
-        J1_mv.loc[:,'src_key'] = \
-            "tuttle_twins/ML/" + J1_mv['ml_key'] + '/' + J1_mv['img_frame'] + ".jpg"
+        J1_mv.loc[:,'src_key'] = build_ml_keys(J1_mv['ml_key'], J1_mv['frame_id'])
 
         # J1_mv['dst_key'] = 
-        J1_mv.loc[:,'dst_key'] = \
-            "tuttle_twins/ML/" + J1_mv['new_ml_key'] + '/' + J1_mv['img_frame'] + ".jpg"
+        J1_mv.loc[:,'dst_key'] = build_ml_keys(J1_mv['new_ml_key'], J1_mv['frame_id'])
         
+        # the listing snapshot changes from ml_key to new_ml_key
+        mv_removed = J1_mv[['frame_id', 'ml_key']]
+        mv_added = J1_mv[['frame_id', 'new_ml_key']].rename(columns={'new_ml_key': 'ml_key'})
+
         J1_mv = J1_mv[['src_key','dst_key']]
         src_keys = list(J1_mv['src_key'].to_numpy())
         dst_keys = list(J1_mv['dst_key'].to_numpy())
 
         mv_start = perf_counter()
         # mv part 1 - copy src_key to dst_key
-        s3_copy_files(src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, src_keys=src_keys,
+        copied_dst_keys = get_storage().copy_many(src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, src_keys=src_keys,
                         dst_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, dst_keys=dst_keys)
-        
-        # mv part 2 - delete src_key
-        del_keys = src_keys
-        s3_delete_files(bucket=S3_MEDIA_ANGEL_NFT_BUCKET, keys=del_keys)
+        is_copied = J1_mv['dst_key'].isin(copied_dst_keys).to_numpy()
+        if not is_copied.all():
+            logger.warning(f"episode_id: {episode_id} {(~is_copied).sum()} ML files were not found and not moved")
+
+        # mv part 2 - delete only the src_keys that were copied, so a failed copy never loses a frame
+        del_keys = list(J1_mv['src_key'][is_copied])
+        get_storage().batch_delete(bucket=S3_MEDIA_ANGEL_NFT_BUCKET, keys=del_keys)
+        if listing is not None:
+            listing.add_episode_keys(episode_id, mv_added[is_copied])
+            # a failed copy means that its src_key is gone, so all src_keys are removed
+            listing.remove_episode_keys(episode_id, mv_removed)
 
         action = "files moved from ML to ML"
         num_files_moved = len(del_keys)
@@ -471,15 +816,16 @@ def process_episode(episode: Episode) -> None:
         log_progress(">>>", episode_id, action, num_files_moved, num_sec, files_per_sec)
     
     #-----------------------------
-    # J2 = G2 join C2 on [episode_id, img_frame] to create
-    # J2 = columns=[episode_id, img_frame, new_ml_key, nullable ml_key ] 
+    # J2 = G2 join C2 on [episode_id, frame_id] to create
+    # J2 = columns=[episode_id, frame_id, new_ml_key, nullable ml_key ] 
     
     # G2 is files needed at new_ml_key
     # G2 is G without img_src
-    G2 = G[['episode_id', 'img_frame', 'new_ml_key']]
+    G2 = G[['episode_id', 'frame_id', 'new_ml_key']]
 
     # C2 is a fresh search of files still at ml_key
-    C2 = s3_find_episode_jpg_keys_df(episode)
+    C2 = find_current_episode_keys_df(episode, listing)
+    C2 = encode_episode_keys_df(C2, key_dtypes)
 
     # FIX J2
     # have len(C2) is 28077 and only need len(G2) is 281  
@@ -488,15 +834,15 @@ def process_episode(episode: Episode) -> None:
     if len(C2) > 0:
         J2 = G2.merge(C2,  
             how='left', 
-            on=['episode_id', 'img_frame'], 
+            on=['episode_id', 'frame_id'], 
             suffixes=('',''),
             sort=False)
     # if C2 is empty then set J2 to G2 + null ml_key
     else:
         J2 = G2.copy(deep=True)
-        J2['ml_key'] = None
+        J2['ml_key'] = null_categorical_column(J2, key_dtypes['ml_key'])
 
-    expected = set(['episode_id', 'img_frame', 'new_ml_key','ml_key'])
+    expected = set(['episode_id', 'frame_id', 'new_ml_key','ml_key'])
     result = set(J2.columns)
     assert result == expected, f"ERROR: expected J2.columns: {expected} not {result}"
     
@@ -505,85 +851,100 @@ def process_episode(episode: Episode) -> None:
 
     #-----------------------------
     # G3 keeps img_src
-    G3 = G[['episode_id', 'img_frame', 'img_src', 'new_ml_key']]
+    G3 = G[['episode_id', 'frame_id', 'img_src', 'new_ml_key']]
 
-    # J3 = J2 join G3 on [episode_id, img_frame] to create
-    # J3 with columns = [episode_id, img_frame, new_ml_key, ml_key, img_src]
+    # J3 = J2 join G3 on [episode_id, frame_id] to create
+    # J3 with columns = [episode_id, frame_id, new_ml_key, ml_key, img_src]
     if len(J2) > 0:
         J3 = J2.merge(G3,  
             how='left', 
-            on=['episode_id', 'img_frame', 'new_ml_key'], 
+            on=['episode_id', 'frame_id', 'new_ml_key'], 
             suffixes=('',''),
             sort=False)
     # if J2 is empty then J3 is G + null ml_key
     else:
         J3 = G.copy(deep=True)
-        J3['ml_key'] = None
+        J3['ml_key'] = null_categorical_column(J3, key_dtypes['ml_key'])
     
-    expected = set(['episode_id', 'img_frame', 'new_ml_key', 'ml_key', 'img_src'])
+    expected = set(['episode_id', 'frame_id', 'new_ml_key', 'ml_key', 'img_src'])
     result = set(J3.columns)
     assert result == expected, f"ERROR: expected J3.columns: {expected} not {result}"
 
     # J3 where new_ml_key is not null and ml_key is null copy img_src file to new_ml_key file
     J3_cp = J3[~J3['new_ml_key'].isnull() & J3['ml_key'].isnull()]
+
+    # filter J3_cp against an index of the episode's source files, built
+    # from one paginated listing only when there is something to copy, 
+    # so missing frames are reported together instead of failing one
+    # copy at a time
+    missing_frame_ids = np.empty(0, dtype=np.int64)
+    if len(J3_cp) > 0:
+        # all img_src of an episode share one directory
+        src_dir = os.path.dirname(J3_cp['img_src'].iloc[0])
+        missing_frame_ids = find_missing_source_frame_ids(J3_cp['frame_id'], find_source_frame_ids(src_dir))
+        if len(missing_frame_ids) > 0:
+            log_missing_source_frames(episode_id, src_dir, missing_frame_ids)
+            J3_cp = J3_cp[~J3_cp['frame_id'].isin(missing_frame_ids)]
     
     if len(J3_cp) > 0:
         # e.g. J3_cp['dst_file'] = "tuttle_twins/ML/" + "training/Common" + "/" + "TT_S01_E01_FRM-00-18-21-08" + ".jpg"
-        J3_cp['dst_file'] = "tuttle_twins/ML/" + J3_cp['new_ml_key'] + '/' + J3_cp['img_frame'] + ".jpg"
+        J3_cp['dst_file'] = build_ml_keys(J3_cp['new_ml_key'], J3_cp['frame_id'])
         src_keys = J3_cp['img_src']
         dst_keys = J3_cp['dst_file']
         
         cp_start = perf_counter()
-        s3_copy_files(src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, src_keys=src_keys, 
+        copied_dst_keys = get_storage().copy_many(src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, src_keys=src_keys, 
                         dst_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, dst_keys=dst_keys)
+        is_copied = dst_keys.isin(copied_dst_keys).to_numpy()
+        if not is_copied.all():
+            # frames whose copy failed are not in ML, like frames without a source file
+            failed_frame_ids = J3_cp['frame_id'].to_numpy()[~is_copied]
+            logger.warning(f"episode_id: {episode_id} {len(failed_frame_ids)} source files were not copied")
+            missing_frame_ids = np.concatenate([missing_frame_ids, failed_frame_ids])
+            J3_cp = J3_cp[is_copied]
 
         action = "files copied from src to ML"
-        num_files_copied = len(src_keys)
+        num_files_copied = len(J3_cp)
         num_sec = perf_counter() - cp_start
         files_per_sec = num_files_copied / num_sec
         log_progress(">>>", episode_id, action, num_files_copied, num_sec, files_per_sec)
 
-    #-----------------------------
-    # C4 = fresh s3_find_episode_jpg_keys_df(episode)
-    # C4 with columns [last_modified, size, ml_key, ml_folder, ml_image_class, img_frame, season_code, episode_code, episode_id]
-    C4 = s3_find_episode_jpg_keys_df(episode)
-    if len(C4) == 0:
-        raise Exception("zero jpg files found for episode_id:{episode_id} should not be possible")
-
-    expected = set(['episode_id', 'img_frame', 'ml_key'])
-    result = set(C4.columns)
-    assert result == expected, f"ERROR: expected C4.columns: {expected} not {result}"
-    
-    #-----------------------------
-    # G still has columns [episode_id, img_frame, img_src, new_ml_key]
-    # G2 is the cropped and renamed version of G, so it can be compared with C4
-    # G2 -> G with columns [episode_id, img_frame, ml_key]
-    G2 = G[['episode_id', 'img_frame', 'new_ml_key']]
-    G2 = G2.rename(columns={'new_ml_key' :'ml_key'})
-    expected = set(['episode_id', 'img_frame', 'ml_key'])
-    result = set(G2.columns)
-    assert result == expected, f"ERROR: expected G2.columns: {expected} not {result}"
+        if listing is not None:
+            listing.add_episode_keys(episode_id, J3_cp[['frame_id', 'new_ml_key']].rename(columns={'new_ml_key': 'ml_key'}))
 
     logger.debug(f"episode_id: {episode_id} num files needed in ML: {total_files_needed}")
     logger.debug(f"episode_id: {episode_id} num files deleted from ML: {num_files_deleted}")
     logger.debug(f"episode_id: {episode_id} um files moved within ML: {num_files_moved}")
     logger.debug(f"episode_id: {episode_id} num files copied from src: {num_files_copied}")
+    logger.debug(f"episode_id: {episode_id} num files missing from src: {len(missing_frame_ids)}")
     num_files_unchanged = total_files_needed - num_files_moved - max(num_files_deleted, num_files_copied)
     logger.debug(f"episode_id: {episode_id} num files unchanged: {num_files_unchanged}")
 
-    #-----------------------------
-    # assert C4 == G2
-    expected = G2.shape
-    result = C4.shape
-    if result != expected:
-        logger.debug(f"episode_id: {episode_id} final shape result: {result} != shape expected: {expected}")
-    else:
-        logger.debug(f"episode_id: {episode_id} final shape result: {result} == shape expected: {expected}")
+    applied = pd.DataFrame({
+        'frame_id': G['frame_id'].to_numpy(),
+        'ml_key': G['new_ml_key'].astype(object).where(~G['frame_id'].isin(missing_frame_ids), None).to_numpy()})
+    return applied
 
-def process_all_episodes() -> None:
-    all_episodes = download_all_seasons_episodes()
+def process_all_episodes() -> int:
+    '''
+    process_episode for all episodes of all season manifests, then verify
+    their applied mappings against one fresh listing of the ML tree
+    Return the status of ml_verify.get_verify_status, 0 if all episodes match
+    '''
+    with profile_phase("download all seasons episodes"):
+        all_episodes = download_all_seasons_episodes()
+    # list the ML tree once for all episodes
+    with profile_phase("list ML tree"):
+        listing = MLListingSnapshot.from_s3()
+    applied_by_episode = {}
     for episode in all_episodes:
-        process_episode(episode)
+        with profile_phase(f"episode {episode.get_episode_id()}"):
+            applied = process_episode(episode, listing=listing)
+        if applied is not None:
+            applied_by_episode[episode.get_episode_id()] = applied
+    # the snapshot only repeats the run's own changes, so verify against a fresh listing
+    with profile_phase("verify ML tree"):
+        return get_verify_status(verify_episode_mappings(applied_by_episode))
 
 def get_all_season_codes() -> List[str]:
     all_season_codes = set()
@@ -592,7 +953,7 @@ def get_all_season_codes() -> List[str]:
         all_season_codes.add(episode.get_season_code())
     return sorted(list(all_season_codes))
 
-def create_all_stage_data_files(subsample_rate :int=100, cleanup: bool=True, verbosity :bool=False) -> Dict[str,str]:
+def create_all_stage_data_files(subsample_rate :int=DATA_FILES_SUBSAMPLE_RATE, cleanup: bool=True, verbosity :bool=False, pushdown_subsample: bool=False, snapshot: bool=True, group_near_duplicates: bool=False) -> Dict[str,str]:
     '''
     This is the main entry point for create_date_files.py
 
@@ -602,44 +963,63 @@ def create_all_stage_data_files(subsample_rate :int=100, cleanup: bool=True, ver
     reports information about the settings used to create the set of data files
     
     if cleanup then remove all intermediate datafiles
+
+    if pushdown_subsample then only the subsampled rows of each google sheet are fetched
+
+    if group_near_duplicates then near-duplicate frames of the local frame hash
+    index get the same stage, see frame_hash_index.py
+
+    if snapshot then the stage data files are also published as an immutable
+    snapshot with a delta against the previous snapshot, see dataset_snapshot
     
     returns the final list of unstamped stage datafiles
     '''
 
     set_subsample_rate(subsample_rate)
     set_verbosity(verbosity)
+    set_pushdown_subsample(pushdown_subsample)
+    set_group_near_duplicates(group_near_duplicates)
+    get_local_data_files_dir()
 
     all_unstamped_stage_data_files = {}
     all_stamped_stage_data_files = {}
     all_episode_stage_data_files = []
-    all_episodes = download_all_seasons_episodes()
+    with profile_phase("download all seasons episodes"):
+        all_episodes = download_all_seasons_episodes()
 
     dt = datetime.datetime.utcnow().isoformat()
     ss = get_subsample_rate()
 
     # get all episodes of all season manifest files found in s3
     for episode in all_episodes:
-        # concatonate the contents of all episode_stage_data_files by stage into all_stamped_stage_data_files
-        episode_stage_data_files = create_google_episode_stage_data_files(episode=episode)
-        all_episode_stage_data_files.extend(list(episode_stage_data_files.values()))
-        for stage in DATA_STAGES:
-            stamped_stage_data_file = f"{LOCAL_DATA_FILES_DIR}/{stage}_{dt}_{ss}_data.csv"
-            concatonate_file( src_file=episode_stage_data_files[stage], dst_file=stamped_stage_data_file)
-            all_stamped_stage_data_files[stage] = stamped_stage_data_file
+        with profile_phase(f"episode {episode.get_episode_id()}"):
+            # concatonate the contents of all episode_stage_data_files by stage into all_stamped_stage_data_files
+            episode_stage_data_files = create_google_episode_stage_data_files(episode=episode)
+            all_episode_stage_data_files.extend(list(episode_stage_data_files.values()))
+            for stage in DATA_STAGES:
+                stamped_stage_data_file = f"{LOCAL_DATA_FILES_DIR}/{stage}_{dt}_{ss}_data.csv"
+                concatonate_file( src_file=episode_stage_data_files[stage], dst_file=stamped_stage_data_file)
+                all_stamped_stage_data_files[stage] = stamped_stage_data_file
             
-    for stage in DATA_STAGES:
-        # copy all stamped_stage_data_file to unstamped_stage_data_file
-        stamped_stage_data_file = all_stamped_stage_data_files[stage]
-        unstamped_stage_data_file = f"{LOCAL_DATA_FILES_DIR}/{stage}_data.csv"
-        copyfile(stamped_stage_data_file, unstamped_stage_data_file)
-        all_unstamped_stage_data_files[stage] = unstamped_stage_data_file
+    with profile_phase("copy stage data files"):
+        for stage in DATA_STAGES:
+            # copy all stamped_stage_data_file to unstamped_stage_data_file
+            stamped_stage_data_file = all_stamped_stage_data_files[stage]
+            unstamped_stage_data_file = f"{LOCAL_DATA_FILES_DIR}/{stage}_data.csv"
+            copyfile(stamped_stage_data_file, unstamped_stage_data_file)
+            all_unstamped_stage_data_files[stage] = unstamped_stage_data_file
     
+    if snapshot:
+        with profile_phase("publish snapshot"):
+            publish_dataset_snapshot(all_unstamped_stage_data_files)
+
     # remove all intermediate data files            
     if cleanup:
-        for episode_stage_data_file in all_episode_stage_data_files:
-            os.remove(episode_stage_data_file)
-        for stage in DATA_STAGES:
-            os.remove(all_stamped_stage_data_files[stage])
+        with profile_phase("cleanup"):
+            for episode_stage_data_file in all_episode_stage_data_files:
+                os.remove(episode_stage_data_file)
+            for stage in DATA_STAGES:
+                os.remove(all_stamped_stage_data_files[stage])
     
     # return only the 'unstamped' stage data files
     return all_unstamped_stage_data_files
@@ -655,11 +1035,12 @@ def get_file_names_from_all_stage_data_files():
 
     e.g. pred_data.csv, test_data.csv, train_data.csv
     '''
+    local_data_files_dir = get_local_data_files_dir()
     expected_stage_data_file_names = [stage + "_data.csv" for stage in DATA_STAGES]
-    existing_paths = os.listdir(LOCAL_DATA_FILES_DIR)
-    existing_file_names = [os.path.basename(path) for path in existing_paths if os.path.isfile(os.path.join(LOCAL_DATA_FILES_DIR,path))]
+    existing_paths = os.listdir(local_data_files_dir)
+    existing_file_names = [os.path.basename(path) for path in existing_paths if os.path.isfile(os.path.join(local_data_files_dir,path))]
     existing_stage_data_file_names = list(set(expected_stage_data_file_names).intersection(set(existing_file_names)))
-    existing_stage_data_files = [os.path.join(LOCAL_DATA_FILES_DIR, file_name) for file_name in existing_stage_data_file_names]
+    existing_stage_data_files = [os.path.join(local_data_files_dir, file_name) for file_name in existing_stage_data_file_names]
     tmp_file = "/tmp/tmp-" + datetime.datetime.utcnow().isoformat()
     concatonate_files(existing_stage_data_files, tmp_file)
     df = pd.read_csv(tmp_file, header=None, names=['file_name', 'label'])
@@ -668,6 +1049,17 @@ def get_file_names_from_all_stage_data_files():
     return file_names    
     
 
+def main():
+    '''
+    process all episodes and exit with status 1 if the ML tree
+    does not match their applied mappings
+    '''
+    status = process_all_episodes()
+    if status != 0:
+        sys.exit(status)
+
+
 if __name__ == "__main__":
+    main()
     logger.info("done")
 
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from episode_service import DATA_STAGES
+from dataset_snapshot import SNAPSHOT_COLUMNS, read_stage_data_files_df, find_snapshot_delta_df
+from sync_s3_image_files import DEFAULT_IMG_SIZE
+from env import get_local_data_files_dir, get_local_source_images_dir
+from import_utils import lazy_import
+
+# pandas, numpy and PIL are only imported on first use
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("frame_cache")
+
+# ============================================
+# frame_cache MODULE OVERVIEW
+#
+# usage:
+#     python frame_cache.py [--size <img_size>] [--workers <pos int>]
+#
+# decodes the source jpg of every row of the stage data files once
+# into a single uint8 np.memmap of shape (capacity, H, W, C) under
+# <local data files dir>/frame_cache/<img_size>/:
+#
+#   frames.u8          the raw memmap
+#   index.csv          stage,file_name,label,row,label_code
+#   frame_cache.json   height, width, channels, capacity and labels,
+#                      where label_code is the position in labels
+#
+# rebuilds are driven by the delta of the stage data files against
+# index.csv: relabelled and re-staged frames only change index.csv,
+# and only added frames are decoded, by a process pool. Added frames
+# are only written to rows that index.csv doesn't reference, so a
+# crash before index.csv is replaced leaves every indexed frame intact:
+# the rows of removed frames are free only once the new index.csv
+# has replaced the old one, and are reused by later rebuilds. The
+# memmap grows when there are no free rows left, and frame_cache.json
+# is replaced before index.csv, so its capacity and labels always
+# cover index.csv. A loader reads a batch as a slice of the memmap,
+# see load_frame_cache and load_frame_batch.
+
+FRAME_CACHE_DIR_NAME = "frame_cache"
+
+FRAME_CACHE_INDEX_COLUMNS = SNAPSHOT_COLUMNS + ['row', 'label_code']
+
+# max number of missing source files named in the log
+MAX_MISSING_FILES_LOGGED = 10
+
+# number of frames sent to each decode worker at a time
+DECODE_CHUNK_SIZE = 64
+
+
+def get_frame_cache_dir(img_size: str=DEFAULT_IMG_SIZE, data_files_dir: str=None) -> str:
+    data_files_dir = data_files_dir if data_files_dir is not None else get_local_data_files_dir()
+    return os.path.join(data_files_dir, FRAME_CACHE_DIR_NAME, img_size)
+
+
+def decode_frame(item: Tuple[str, Optional[Tuple[int,int]]]) -> np.ndarray:
+    '''
+    Decode the jpg at src_path into a uint8 RGB array of shape (H, W, 3),
+    resized to the given (width, height) if it differs
+    '''
+    src_path, size = item
+    with Image.open(src_path) as img:
+        img = img.convert("RGB")
+        if size is not None and img.size != size:
+            img = img.resize(size)
+        return np.asarray(img, dtype=np.uint8)
+
+
+def load_frame_cache_info(cache_dir: str) -> Optional[dict]:
+    info_file = os.path.join(cache_dir, "frame_cache.json")
+    if not os.path.isfile(info_file):
+        return None
+    with open(info_file, "r") as f:
+        return json.load(f)
+
+
+def load_frame_cache_index_df(cache_dir: str) -> pd.DataFrame:
+    index_file = os.path.join(cache_dir, "index.csv")
+    if not os.path.isfile(index_file):
+        return pd.DataFrame(columns=FRAME_CACHE_INDEX_COLUMNS)
+    return pd.read_csv(index_file, dtype={'stage': str, 'file_name': str, 'label': str}, keep_default_na=False)
+
+
+def open_frames_memmap(cache_dir: str, info: dict, mode: str='r') -> np.memmap:
+    shape = (info['capacity'], info['height'], info['width'], info['channels'])
+    return np.memmap(os.path.join(cache_dir, "frames.u8"), dtype=np.uint8, mode=mode, shape=shape)
+
+
+def build_frame_cache(img_size: str=DEFAULT_IMG_SIZE, source_dir: str=None, max_workers: int=None, data_files_dir: str=None) -> Dict[str,int]:
+    '''
+    Incrementally decode the frames of the stage data files in
+    data_files_dir, by default the local data files dir, into the
+    frame cache of img_size
+    Return a dict of num_decoded, num_freed, num_relabelled, num_missing and capacity,
+    where num_freed is the number of rows of removed frames
+    '''
+    source_dir = source_dir if source_dir is not None else get_local_source_images_dir()
+    data_files_dir = data_files_dir if data_files_dir is not None else get_local_data_files_dir()
+    cache_dir = get_frame_cache_dir(img_size, data_files_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    stage_data_files = {stage: os.path.join(data_files_dir, f"{stage}_data.csv") for stage in DATA_STAGES}
+    rows = read_stage_data_files_df({stage: path for stage, path in stage_data_files.items() if os.path.isfile(path)})
+    info = load_frame_cache_info(cache_dir)
+    index_df = load_frame_cache_index_df(cache_dir) if info is not None else pd.DataFrame(columns=FRAME_CACHE_INDEX_COLUMNS)
+
+    # frames without a source file are left out of the cache
+    is_found = (source_dir + os.sep + rows['file_name']).map(os.path.isfile) | rows['file_name'].isin(index_df['file_name'])
+    if not is_found.all():
+        missing = rows['file_name'][~is_found].tolist()
+        logger.warning(f"{len(missing)} files of the stage data files are not in {source_dir} e.g. {missing[:MAX_MISSING_FILES_LOGGED]}")
+    rows = rows[is_found]
+
+    delta = find_snapshot_delta_df(index_df, rows)
+    cached_rows = dict(zip(index_df['file_name'], index_df['row']))
+    required_file_names = set(rows['file_name'])
+    added_file_names = sorted(set(delta[delta['op'] == '+']['file_name']) - set(cached_rows.keys()))
+    num_freed = sum(1 for file_name in cached_rows if file_name not in required_file_names)
+    num_relabelled = int((delta['op'] == '+').sum()) - len(added_file_names)
+
+    if info is None:
+        if len(added_file_names) == 0:
+            logger.info("no frames to cache")
+            return {"num_decoded": 0, "num_freed": 0, "num_relabelled": 0, "num_missing": int((~is_found).sum()), "capacity": 0}
+        # the shape of the first frame is the shape of all frames
+        first_frame = decode_frame((os.path.join(source_dir, added_file_names[0]), None))
+        height, width, channels = first_frame.shape
+        info = {'height': height, 'width': width, 'channels': channels, 'capacity': 0, 'labels': []}
+
+    # added frames reuse the rows that index.csv doesn't reference first, then grow the memmap
+    free_rows = sorted(set(range(info['capacity'])) - set(cached_rows.values()))
+    new_rows = free_rows[:len(added_file_names)]
+    num_grown = len(added_file_names) - len(new_rows)
+    new_rows += list(range(info['capacity'], info['capacity'] + num_grown))
+    if num_grown > 0:
+        info['capacity'] += num_grown
+        frame_bytes = info['height'] * info['width'] * info['channels']
+        with open(os.path.join(cache_dir, "frames.u8"), "ab") as f:
+            f.truncate(info['capacity'] * frame_bytes)
+
+    if len(added_file_names) > 0:
+        frames = open_frames_memmap(cache_dir, info, mode='r+')
+        size = (info['width'], info['height'])
+        items = [(os.path.join(source_dir, file_name), size) for file_name in added_file_names]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for row, frame in zip(new_rows, executor.map(decode_frame, items, chunksize=DECODE_CHUNK_SIZE)):
+                frames[row] = frame
+        frames.flush()
+        del frames
+
+    for row, file_name in zip(new_rows, added_file_names):
+        cached_rows[file_name] = row
+    for label in sorted(set(rows['label']) - set(info['labels'])):
+        info['labels'].append(label)
+    label_codes = {label: code for code, label in enumerate(info['labels'])}
+
+    index_df = rows[SNAPSHOT_COLUMNS].copy()
+    index_df['row'] = index_df['file_name'].map(cached_rows).astype(int)
+    index_df['label_code'] = index_df['label'].map(label_codes).astype(int)
+
+    # frame_cache.json and then index.csv are replaced only after the frames are written
+    info_file = os.path.join(cache_dir, "frame_cache.json")
+    with open(info_file + ".tmp", "w") as f:
+        json.dump(info, f, indent=4)
+    os.replace(info_file + ".tmp", info_file)
+    index_file = os.path.join(cache_dir, "index.csv")
+    index_df.to_csv(index_file + ".tmp", index=False)
+    os.replace(index_file + ".tmp", index_file)
+
+    return {
+        "num_decoded": len(added_file_names),
+        "num_freed": num_freed,
+        "num_relabelled": num_relabelled,
+        "num_missing": int((~is_found).sum()),
+        "capacity": info['capacity']
+    }
+
+
+def load_frame_cache(img_size: str=DEFAULT_IMG_SIZE, data_files_dir: str=None) -> Tuple[np.memmap, pd.DataFrame, List[str]]:
+    '''
+    Return the read-only frames memmap, the index dataframe and
+    the labels of the label codes of the frame cache of img_size
+    '''
+    cache_dir = get_frame_cache_dir(img_size, data_files_dir)
+    info = load_frame_cache_info(cache_dir)
+    if info is None:
+        raise FileNotFoundError(f"no frame cache in {cache_dir}, see frame_cache.build_frame_cache")
+    return open_frames_memmap(cache_dir, info), load_frame_cache_index_df(cache_dir), info['labels']
+
+
+def load_frame_batch(frames: np.memmap, index_df: pd.DataFrame, file_names: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Return the (N, H, W, C) frames and the (N,) label codes of the given file_names
+    '''
+    batch_df = index_df.set_index('file_name').loc[file_names]
+    return frames[batch_df['row'].to_numpy()], batch_df['label_code'].to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Decode the local source images of all stage data files once into a memory-mapped frame cache",
+        usage="--help/-h [--size <img_size>] [--workers <pos int>]")
+    parser.add_argument(
+        '--size', default=None,
+        metavar="<img_size>",
+        help=f'optional <img_size> sub-directory of the local source images, see sync_s3_image_files --sizes, the cache is named after {DEFAULT_IMG_SIZE} by default')
+    parser.add_argument(
+        '--workers', default=None, type=int,
+        help='size of the decode process pool, the number of cpus by default')
+    args = vars(parser.parse_args())
+
+    source_dir = get_local_source_images_dir()
+    if args['size'] is not None:
+        source_dir = os.path.join(source_dir, args['size'])
+    img_size = args['size'] if args['size'] is not None else DEFAULT_IMG_SIZE
+
+    result = build_frame_cache(img_size=img_size, source_dir=source_dir, max_workers=args['workers'])
+    print("build_frame_cache results:", json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
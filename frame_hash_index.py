@@ -0,0 +1,384 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+from frame_id import encode_frame_ids, frame_id_episode_numbers, find_img_frame_mask
+from sync_s3_image_files import DEFAULT_IMG_SIZE
+from env import get_local_data_files_dir, get_local_source_images_dir
+from import_utils import lazy_import
+
+# numpy, PIL and scipy are only imported on first use
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+csgraph = lazy_import("scipy.sparse.csgraph")
+sparse = lazy_import("scipy.sparse")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("frame_hash_index")
+
+# ============================================
+# frame_hash_index MODULE OVERVIEW
+#
+# usage:
+#     python frame_hash_index.py [--size <img_size>] [--max-distance <int>] [--workers <pos int>]
+#
+# adjacent frames at 24 fps are near-duplicates, so a random stage per
+# frame leaks near-duplicates between train and test. This module keeps
+# a 64 bit perceptual difference hash (dhash) of every local source
+# thumbnail in <local data files dir>/frame_hash/<img_size>.npz as two
+# sorted packed arrays:
+#
+#   frame_ids   int64, see frame_id.encode_frame_ids
+#   hashes      uint64, one bit per pixel of the 9x8 grayscale thumbnail
+#               that is brighter than its right neighbor
+#
+# near-duplicates are frames whose hashes differ in at most max_distance
+# bits. find_neighbor_pairs avoids comparing all pairs: by the
+# pigeonhole principle two hashes within max_distance bits are equal
+# in at least one of max_distance + 1 bit blocks, so only frames sharing
+# a block value are compared, with a bit-parallel popcount of their xor.
+# find_neighbor_pairs searches the distinct hashes of np.unique, but
+# still returns every pair of positions, so n identical hashes, e.g.
+# the frames of a still scene, are n² / 2 pairs. find_frame_groups and
+# count_neighbor_pairs never expand them: the frames with the same hash
+# in the same episode are collapsed into one node by find_hash_nodes,
+# and only the pairs between nodes are found.
+# Neighbor pairs are found within and across episodes, and are merged
+# into groups by find_frame_groups, which are used to
+#   - give all near-duplicates the same stage, see
+#     episode_service.add_randomized_new_ml_folder_column(df, groups)
+#   - keep one frame per group before subsampling, see find_unique_frame_mask
+
+FRAME_HASH_DIR_NAME = "frame_hash"
+
+# the grayscale (width, height) of a thumbnail before hashing
+HASH_FRAME_SIZE = (9, 8)
+HASH_BITS = 64
+
+DEFAULT_MAX_DISTANCE = 4
+
+NEIGHBOR_SCOPES = ['all', 'within', 'across']
+
+# e.g. TT_S01_E01_FRM-00-00-00-00.jpg
+THUMBNAIL_FILE_PATTERN = re.compile(r"^TT_S\d\d_E\d\d_FRM-\d\d-\d\d-\d\d-\d\d\.jpg$")
+
+# number of thumbnails sent to each worker at a time
+HASH_CHUNK_SIZE = 256
+
+
+def get_frame_hash_index_file(img_size: str=DEFAULT_IMG_SIZE, data_files_dir: str=None) -> str:
+    data_files_dir = data_files_dir if data_files_dir is not None else get_local_data_files_dir()
+    return os.path.join(data_files_dir, FRAME_HASH_DIR_NAME, f"{img_size}.npz")
+
+
+def load_hash_frame(src_path: str) -> np.ndarray:
+    '''
+    Decode a thumbnail in PIL draft mode into a uint8 grayscale
+    array of shape (8, 9)
+    '''
+    with Image.open(src_path) as img:
+        img.draft("L", HASH_FRAME_SIZE)
+        return np.asarray(img.convert("L").resize(HASH_FRAME_SIZE, Image.BILINEAR), dtype=np.uint8)
+
+
+def compute_dhashes(hash_frames: np.ndarray) -> np.ndarray:
+    '''
+    Vectorized difference hashes of uint8 grayscale hash_frames
+    of shape (N, 8, 9) as a uint64 array of shape (N,)
+    '''
+    hash_frames = np.asarray(hash_frames)
+    bits = hash_frames[:, :, 1:] > hash_frames[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(hash_frames), HASH_BITS), axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    '''
+    Bit-parallel count of the set bits of each uint64 value
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    values = values - ((values >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    values = (values & np.uint64(0x3333333333333333)) + ((values >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    values = (values + (values >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((values * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def hamming_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return popcount64(np.bitwise_xor(a, b))
+
+
+def find_distinct_neighbor_pairs(hashes: np.ndarray, max_distance: int=DEFAULT_MAX_DISTANCE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Return the arrays (i, j, distance) of all pairs of positions i < j
+    of distinct hashes that differ in at most max_distance bits
+    '''
+    num_blocks = max_distance + 1
+    block_edges = np.linspace(0, HASH_BITS, num_blocks + 1).astype(int)
+
+    candidate_pairs = []
+    for first_bit, last_bit in zip(block_edges[:-1], block_edges[1:]):
+        mask = np.uint64((1 << int(last_bit - first_bit)) - 1)
+        block_values = (hashes >> np.uint64(first_bit)) & mask
+        order = np.argsort(block_values, kind='stable')
+        sorted_values = block_values[order]
+        # compare each frame with the following frames of its run of equal block values
+        offset = 1
+        while offset < len(order):
+            is_same = sorted_values[offset:] == sorted_values[:-offset]
+            if not is_same.any():
+                break
+            positions = np.flatnonzero(is_same)
+            candidate_pairs.append(np.stack([order[positions], order[positions + offset]], axis=1))
+            offset += 1
+
+    if len(candidate_pairs) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    pairs = np.sort(np.concatenate(candidate_pairs), axis=1).astype(np.int64)
+    # pairs found in several blocks are compared once
+    pair_keys = np.unique(pairs[:, 0] * len(hashes) + pairs[:, 1])
+    i, j = pair_keys // len(hashes), pair_keys % len(hashes)
+    distances = hamming_distances(hashes[i], hashes[j])
+    is_neighbor = distances <= max_distance
+    return i[is_neighbor], j[is_neighbor], distances[is_neighbor]
+
+
+def find_neighbor_pairs(hashes: np.ndarray, max_distance: int=DEFAULT_MAX_DISTANCE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Return the arrays (i, j, distance) of all pairs of positions i < j
+    of hashes that differ in at most max_distance bits, sorted by (i, j).
+    The pairs are found between the distinct hashes and expanded to
+    their positions afterwards, so n identical hashes are n² / 2 pairs,
+    see find_hash_nodes to avoid them.
+    '''
+    if max_distance < 0 or max_distance >= HASH_BITS:
+        raise ValueError(f"max_distance must be in [0, {HASH_BITS}) not {max_distance}")
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+    inverse = inverse.ravel()
+    ui, uj, unique_distances = find_distinct_neighbor_pairs(unique_hashes, max_distance)
+
+    # the positions of each distinct hash are order[starts[u]:starts[u] + counts[u]]
+    order = np.argsort(inverse, kind='stable')
+    counts = np.bincount(inverse, minlength=len(unique_hashes))
+    starts = np.cumsum(counts) - counts
+
+    # every position of hash ui with every position of hash uj
+    num_pairs = counts[ui] * counts[uj]
+    pair_index = np.repeat(np.arange(len(ui)), num_pairs)
+    k = np.arange(num_pairs.sum()) - np.repeat(np.cumsum(num_pairs) - num_pairs, num_pairs)
+    i_parts = [order[starts[ui][pair_index] + k // counts[uj][pair_index]]]
+    j_parts = [order[starts[uj][pair_index] + k % counts[uj][pair_index]]]
+    distance_parts = [unique_distances[pair_index]]
+
+    # the pairs of positions with identical hashes have distance 0
+    sorted_inverse = inverse[order]
+    for offset in range(1, int(counts.max(initial=0))):
+        positions = np.flatnonzero(sorted_inverse[offset:] == sorted_inverse[:-offset])
+        i_parts.append(order[positions])
+        j_parts.append(order[positions + offset])
+        distance_parts.append(np.zeros(len(positions), dtype=unique_distances.dtype))
+
+    i, j = np.concatenate(i_parts).astype(np.int64), np.concatenate(j_parts).astype(np.int64)
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    pair_order = np.argsort(i * len(hashes) + j, kind='stable')
+    return i[pair_order], j[pair_order], np.concatenate(distance_parts)[pair_order]
+
+
+def filter_neighbor_pairs(frame_ids: np.ndarray, i: np.ndarray, j: np.ndarray, scope: str='all') -> np.ndarray:
+    '''
+    Return the mask of the pairs (i, j) of positions of frame_ids that are
+    within one episode, across episodes or all pairs, see NEIGHBOR_SCOPES
+    '''
+    if scope not in NEIGHBOR_SCOPES:
+        raise ValueError(f"scope must be one of {NEIGHBOR_SCOPES} not {scope}")
+    if scope == 'all':
+        return np.ones(len(i), dtype=bool)
+    episode_numbers = frame_id_episode_numbers(frame_ids)
+    is_within = episode_numbers[i] == episode_numbers[j]
+    return is_within if scope == 'within' else ~is_within
+
+
+def find_neighbor_groups(num_frames: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    '''
+    Return the group number of each of num_frames positions, where
+    the neighbor pairs (i, j) are connected into the same group
+    '''
+    graph = sparse.coo_matrix((np.ones(len(i), dtype=np.int8), (i, j)), shape=(num_frames, num_frames))
+    _, groups = csgraph.connected_components(graph, directed=False)
+    return groups
+
+
+def find_hash_nodes(frame_ids: np.ndarray, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Collapse the frames with the same hash in the same episode into one node
+    Return the arrays (nodes, node_frame_ids, node_hashes) of the node of
+    each frame, and one of the frame_ids and the hash of each node
+    '''
+    hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+    node_keys = np.stack([hashes.view(np.int64), frame_id_episode_numbers(frame_ids)], axis=1)
+    unique_keys, nodes = np.unique(node_keys, axis=0, return_inverse=True)
+    nodes = nodes.ravel()
+    node_frame_ids = np.empty(len(unique_keys), dtype=np.int64)
+    node_frame_ids[nodes] = frame_ids
+    return nodes, node_frame_ids, np.ascontiguousarray(unique_keys[:, 0]).view(np.uint64)
+
+
+def count_neighbor_pairs(frame_ids: np.ndarray, hashes: np.ndarray, max_distance: int=DEFAULT_MAX_DISTANCE) -> Dict[str,int]:
+    '''
+    Count the near-duplicate pairs of the frames within and across episodes
+    from the pairs between their find_hash_nodes, weighted by node sizes
+    Return a dict of num_frames, num_pairs_within_episodes,
+    num_pairs_across_episodes and num_unique_frames
+    '''
+    nodes, node_frame_ids, node_hashes = find_hash_nodes(frame_ids, hashes)
+    node_sizes = np.bincount(nodes, minlength=len(node_hashes)).astype(np.int64)
+    i, j, _ = find_neighbor_pairs(node_hashes, max_distance)
+    is_within = filter_neighbor_pairs(node_frame_ids, i, j, 'within')
+    num_pairs = node_sizes[i] * node_sizes[j]
+    # the frames of a node are identical frames of one episode
+    num_node_pairs = int((node_sizes * (node_sizes - 1) // 2).sum())
+    groups = find_neighbor_groups(len(node_hashes), i, j)
+    return {
+        "num_frames": len(frame_ids),
+        "num_pairs_within_episodes": num_node_pairs + int(num_pairs[is_within].sum()),
+        "num_pairs_across_episodes": int(num_pairs[~is_within].sum()),
+        "num_unique_frames": len(np.unique(groups))
+    }
+
+
+def build_frame_hash_index(img_size: str=DEFAULT_IMG_SIZE, source_dir: str=None, max_workers: int=None, data_files_dir: str=None) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Incrementally hash the thumbnails of source_dir that are not in the index yet
+    Return the sorted arrays (frame_ids, hashes) of the saved index
+    '''
+    source_dir = source_dir if source_dir is not None else get_local_source_images_dir()
+    index_file = get_frame_hash_index_file(img_size, data_files_dir)
+    frame_ids, hashes = load_frame_hash_index(img_size, data_files_dir)
+
+    with os.scandir(source_dir) as entries:
+        file_names = sorted(entry.name for entry in entries if THUMBNAIL_FILE_PATTERN.match(entry.name))
+    new_frame_ids = encode_frame_ids([file_name[:-len(".jpg")] for file_name in file_names])
+    is_new = ~np.isin(new_frame_ids, frame_ids)
+    new_file_names = [file_name for file_name, new in zip(file_names, is_new) if new]
+
+    if len(new_file_names) > 0:
+        src_paths = [os.path.join(source_dir, file_name) for file_name in new_file_names]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            hash_frames = np.stack(list(executor.map(load_hash_frame, src_paths, chunksize=HASH_CHUNK_SIZE)))
+        frame_ids = np.concatenate([frame_ids, new_frame_ids[is_new]])
+        hashes = np.concatenate([hashes, compute_dhashes(hash_frames)])
+        order = np.argsort(frame_ids)
+        frame_ids, hashes = frame_ids[order], hashes[order]
+
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        with open(index_file + ".tmp", "wb") as f:
+            np.savez(f, frame_ids=frame_ids, hashes=hashes)
+        os.replace(index_file + ".tmp", index_file)
+    logger.info(f"{len(new_file_names)} thumbnails hashed, {len(frame_ids)} in the index")
+    return frame_ids, hashes
+
+
+def load_frame_hash_index(img_size: str=DEFAULT_IMG_SIZE, data_files_dir: str=None) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Return the sorted arrays (frame_ids, hashes) of the index, empty if there is none
+    '''
+    index_file = get_frame_hash_index_file(img_size, data_files_dir)
+    if not os.path.isfile(index_file):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+    with np.load(index_file) as npz:
+        return npz['frame_ids'], npz['hashes']
+
+
+def find_frame_groups(img_frames, max_distance: int=DEFAULT_MAX_DISTANCE, scope: str='all',
+        img_size: str=DEFAULT_IMG_SIZE, data_files_dir: str=None) -> np.ndarray:
+    '''
+    Return a group number for each of the img_frames, e.g.
+    "TT_S01_E01_FRM-00-19-16-19", where near-duplicate frames of the
+    given scope share a group. Frames that are not in the index or
+    are malformed are groups of their own.
+    Frames with the same hash in the same episode are collapsed into
+    one node, so identical frames cost no pairs, and each frame is
+    linked to its node.
+    '''
+    img_frames = np.asarray(img_frames, dtype=object)
+    is_valid = find_img_frame_mask(img_frames)
+    frame_ids = np.zeros(len(img_frames), dtype=np.int64)
+    frame_ids[is_valid] = encode_frame_ids(img_frames[is_valid])
+    index_frame_ids, index_hashes = load_frame_hash_index(img_size, data_files_dir)
+    positions = np.searchsorted(index_frame_ids, frame_ids)
+    positions = np.minimum(positions, max(len(index_frame_ids) - 1, 0))
+    is_indexed = (index_frame_ids[positions] == frame_ids) if len(index_frame_ids) > 0 else np.zeros(len(frame_ids), dtype=bool)
+    is_indexed &= is_valid
+    if not is_valid.all():
+        logger.warning(f"{int((~is_valid).sum())} malformed frames are groups of their own")
+    missing = int((is_valid & ~is_indexed).sum())
+    if missing > 0:
+        logger.warning(f"{missing} of {len(frame_ids)} frames are not in the frame hash index")
+
+    indexed = np.flatnonzero(is_indexed)
+    nodes, node_frame_ids, node_hashes = find_hash_nodes(frame_ids[indexed], index_hashes[positions[indexed]])
+    i, j, _ = find_neighbor_pairs(node_hashes, max_distance)
+    is_kept = filter_neighbor_pairs(node_frame_ids, i, j, scope)
+    i, j = i[is_kept], j[is_kept]
+
+    # the frames of a node are within one episode, so they are only
+    # linked across episodes through a kept pair of their node
+    is_linked = np.ones(len(indexed), dtype=bool)
+    if scope == 'across':
+        is_linked = np.isin(nodes, np.concatenate([i, j]))
+    num_frames = len(frame_ids)
+    groups = find_neighbor_groups(num_frames + len(node_hashes),
+        np.concatenate([num_frames + i, indexed[is_linked]]),
+        np.concatenate([num_frames + j, num_frames + nodes[is_linked]]))
+    # group numbers 0 .. num_groups - 1 of the frames only
+    _, groups = np.unique(groups[:num_frames], return_inverse=True)
+    return groups.ravel()
+
+
+def find_unique_frame_mask(groups: np.ndarray) -> np.ndarray:
+    '''
+    Return the mask that keeps the first frame of each group,
+    e.g. to dedup the frames of an episode before subsampling
+    '''
+    _, first_positions = np.unique(groups, return_index=True)
+    mask = np.zeros(len(groups), dtype=bool)
+    mask[first_positions] = True
+    return mask
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Hash the local source thumbnails and report their near-duplicates within and across episodes",
+        usage="--help/-h [--size <img_size>] [--max-distance <int>] [--workers <pos int>]")
+    parser.add_argument(
+        '--size', default=None,
+        metavar="<img_size>",
+        help=f'optional <img_size> sub-directory of the local source images, see sync_s3_image_files --sizes, the index is named after {DEFAULT_IMG_SIZE} by default')
+    parser.add_argument(
+        '--max-distance', default=DEFAULT_MAX_DISTANCE, type=int,
+        help='max number of differing hash bits of near-duplicates')
+    parser.add_argument(
+        '--workers', default=None, type=int,
+        help='size of the hashing process pool, the number of cpus by default')
+    args = vars(parser.parse_args())
+
+    source_dir = get_local_source_images_dir()
+    if args['size'] is not None:
+        source_dir = os.path.join(source_dir, args['size'])
+    img_size = args['size'] if args['size'] is not None else DEFAULT_IMG_SIZE
+
+    frame_ids, hashes = build_frame_hash_index(img_size=img_size, source_dir=source_dir, max_workers=args['workers'])
+    result = count_neighbor_pairs(frame_ids, hashes, args['max_distance'])
+    print("frame_hash_index results:", json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Tuple
+
+from import_utils import lazy_import
+
+# numpy is only imported on first use
+np = lazy_import("numpy")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("frame_id")
+
+# ============================================
+# frame_id MODULE OVERVIEW
+#
+# packs img_frame timecodes like "TT_S01_E02_FRM-00-19-16-19"
+# (season, episode, hh, mm, ss, ff) into a single int64 frame_id
+# using decimal fields, e.g. 102_00_19_16_19 -> 10200191619
+# so that frame_ids sort in (season, episode, time) order and
+# range queries like "all frames of minute 12" are integer ranges.
+
+IMG_FRAME_TEMPLATE = "TT_S00_E00_FRM-00-00-00-00"
+IMG_FRAME_LEN = len(IMG_FRAME_TEMPLATE)
+
+# (first digit index, last digit index + 1) of each 2-digit field in IMG_FRAME_TEMPLATE
+SEASON_DIGITS = (4, 6)
+EPISODE_DIGITS = (8, 10)
+HH_DIGITS = (15, 17)
+MM_DIGITS = (18, 20)
+SS_DIGITS = (21, 23)
+FF_DIGITS = (24, 26)
+DIGIT_INDICES = [i for first, last in [SEASON_DIGITS, EPISODE_DIGITS, HH_DIGITS, MM_DIGITS, SS_DIGITS, FF_DIGITS] for i in range(first, last)]
+LITERAL_INDICES = [i for i in range(IMG_FRAME_LEN) if i not in DIGIT_INDICES]
+
+# the decimal place of each field in a frame_id
+EPISODE_RADIX = 10**8
+HH_RADIX = 10**6
+MM_RADIX = 10**4
+SS_RADIX = 10**2
+
+_ZERO = ord('0')
+
+
+@lru_cache(maxsize=None)
+def _template_codes() -> np.ndarray:
+    return np.array([ord(c) for c in IMG_FRAME_TEMPLATE], dtype=np.uint32)
+
+
+def _field(digits: np.ndarray, field: Tuple[int,int]) -> np.ndarray:
+    first, _ = field
+    return digits[:, first].astype(np.int64) * 10 + digits[:, first + 1]
+
+
+def _parse_codes(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Return the digits of the rows of unicode code points of img_frames
+    and the mask of the rows that don't match IMG_FRAME_TEMPLATE
+    '''
+    bad_literals = (codes[:, LITERAL_INDICES] != _template_codes()[LITERAL_INDICES]).any(axis=1)
+    # unsigned wrap-around makes code points below '0' larger than 9
+    digits = np.zeros_like(codes)
+    digits[:, DIGIT_INDICES] = codes[:, DIGIT_INDICES] - np.uint32(_ZERO)
+    bad_digits = (digits > 9).any(axis=1)
+    return digits, bad_literals | bad_digits
+
+
+def find_img_frame_mask(img_frames) -> np.ndarray:
+    '''
+    Return the mask of the img_frames that match IMG_FRAME_TEMPLATE,
+    e.g. to drop the malformed rows before encode_frame_ids
+    '''
+    chars = np.asarray(img_frames, dtype=str)
+    if chars.size == 0:
+        return np.zeros(0, dtype=bool)
+    has_length = np.char.str_len(chars) == IMG_FRAME_LEN
+    codes = chars.astype(f"U{IMG_FRAME_LEN}").view(np.uint32).reshape(-1, IMG_FRAME_LEN)
+    _, bad_rows = _parse_codes(codes)
+    return has_length & ~bad_rows
+
+
+def encode_frame_ids(img_frames) -> np.ndarray:
+    '''
+    Vectorized conversion of a sequence of img_frame strings,
+    e.g. "TT_S01_E01_FRM-00-19-16-19", into an int64 array of frame_ids
+    Raise ValueError if any img_frame does not match IMG_FRAME_TEMPLATE,
+    see find_img_frame_mask
+    '''
+    chars = np.asarray(img_frames, dtype=str)
+    if chars.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if chars.dtype.itemsize != IMG_FRAME_LEN * 4:
+        raise ValueError(f"img_frames must all have length {IMG_FRAME_LEN} like {IMG_FRAME_TEMPLATE}")
+
+    # one row of unicode code points per img_frame
+    codes = chars.view(np.uint32).reshape(-1, IMG_FRAME_LEN)
+    digits, bad_rows = _parse_codes(codes)
+    if bad_rows.any():
+        bad_examples = chars[bad_rows][:3].tolist()
+        raise ValueError(f"{bad_rows.sum()} img_frames don't match {IMG_FRAME_TEMPLATE} e.g. {bad_examples}")
+
+    episode_number = _field(digits, SEASON_DIGITS) * 100 + _field(digits, EPISODE_DIGITS)
+    return (episode_number * EPISODE_RADIX
+        + _field(digits, HH_DIGITS) * HH_RADIX
+        + _field(digits, MM_DIGITS) * MM_RADIX
+        + _field(digits, SS_DIGITS) * SS_RADIX
+        + _field(digits, FF_DIGITS))
+
+
+def decode_frame_ids(frame_ids) -> np.ndarray:
+    '''
+    Vectorized conversion of an array of frame_ids back into
+    an array of img_frame strings, e.g. "TT_S01_E01_FRM-00-19-16-19"
+    '''
+    frame_ids = np.asarray(frame_ids, dtype=np.int64)
+    codes = np.tile(_template_codes(), (frame_ids.size, 1))
+    fields = [
+        (SEASON_DIGITS, frame_ids // (EPISODE_RADIX * 100)),
+        (EPISODE_DIGITS, frame_ids // EPISODE_RADIX % 100),
+        (HH_DIGITS, frame_ids // HH_RADIX % 100),
+        (MM_DIGITS, frame_ids // MM_RADIX % 100),
+        (SS_DIGITS, frame_ids // SS_RADIX % 100),
+        (FF_DIGITS, frame_ids % 100),
+    ]
+    for (first, _), values in fields:
+        codes[:, first] = _ZERO + values // 10
+        codes[:, first + 1] = _ZERO + values % 10
+    return codes.view(f"U{IMG_FRAME_LEN}").ravel()
+
+
+def frame_id_episode_numbers(frame_ids) -> np.ndarray:
+    '''
+    Return season * 100 + episode for each frame_id, e.g. S01E02 -> 102
+    '''
+    return np.asarray(frame_ids, dtype=np.int64) // EPISODE_RADIX
+
+
+def find_frame_id_range(season: int, episode: int, hh: int=None, mm: int=None, ss: int=None) -> Tuple[int,int]:
+    '''
+    Return the half-open [first, last) frame_id range of all frames
+    of an episode, or of one of its hours, minutes or seconds
+    e.g. all frames of minute 12 of S01E01:
+        first, last = find_frame_id_range(1, 1, hh=0, mm=12)
+        minute_12 = frame_ids[(frame_ids >= first) & (frame_ids < last)]
+    '''
+    first = (season * 100 + episode) * EPISODE_RADIX
+    span = EPISODE_RADIX
+    for value, radix in [(hh, HH_RADIX), (mm, MM_RADIX), (ss, SS_RADIX)]:
+        if value is None:
+            break
+        first += value * radix
+        span = radix
+    return first, first + span
+
+
+if __name__ == "__main__":
+    logger.info("done")
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, Optional, Tuple
+
+from episode_service import DATA_STAGES
+from dataset_snapshot import read_stage_data_files_df
+from frame_cache import decode_frame
+from env import get_local_data_files_dir, get_local_source_images_dir
+from import_utils import lazy_import
+
+# pandas, numpy and PIL are only imported on first use
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("frame_loader")
+
+# ============================================
+# frame_loader MODULE OVERVIEW
+#
+# usage:
+#     python frame_loader.py --stage train|test|pred [--batch-size <pos int>] [--workers <pos int>]
+#         [--processes] [--prefetch <pos int>] [--draft <width> <height>] [--seed <int>] [--epochs <pos int>]
+#
+# FrameLoader streams (images, labels) batches from a <stage>_data.csv,
+# where images is a uint8 array of shape (batch_size, H, W, 3) and
+# labels is the array of their classifications:
+#
+#   loader = FrameLoader('train', batch_size=64, seed=42, draft_size=(128, 72))
+#   for epoch in range(num_epochs):
+#       for images, labels in loader:
+#           ...
+#
+# a producer thread submits the jpg decodes of each batch to a pool
+# of worker threads (or processes) and puts the decoded batches into
+# a queue bounded by prefetch, so decoding runs ahead of training by
+# at most prefetch batches. With shuffle the rows are permuted anew
+# each epoch by a generator seeded with seed + epoch, so runs are
+# reproducible. With draft_size, jpgs are decoded in PIL draft mode
+# and resized to draft_size by decode_draft_frame. Draft pixels differ
+# from a full decode, so the frame cache never uses it. Each epoch logs
+# its images/sec.
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_PREFETCH = 4
+DEFAULT_NUM_WORKERS = 8
+
+# seconds between checks of the stop event by a producer blocked on a full queue
+QUEUE_PUT_TIMEOUT = 0.1
+
+# max number of missing source files named in the log
+MAX_MISSING_FILES_LOGGED = 10
+
+
+def decode_draft_frame(item: Tuple[str, Tuple[int,int]]) -> np.ndarray:
+    '''
+    Decode the jpg at src_path like frame_cache.decode_frame, but in
+    PIL draft mode, which lets the decoder downscale a jpg larger than
+    the given (width, height) by up to 8x before the final resize
+    '''
+    src_path, size = item
+    with Image.open(src_path) as img:
+        img.draft("RGB", size)
+        img = img.convert("RGB")
+        if img.size != size:
+            img = img.resize(size)
+        return np.asarray(img, dtype=np.uint8)
+
+
+class FrameLoader:
+    '''
+    Iterable of (images, labels) batches of one stage data file
+    see the MODULE OVERVIEW
+    '''
+    def __init__(self, stage: str, batch_size: int=DEFAULT_BATCH_SIZE, shuffle: bool=True, seed: int=None,
+            prefetch: int=DEFAULT_PREFETCH, num_workers: int=DEFAULT_NUM_WORKERS, use_processes: bool=False,
+            draft_size: Optional[Tuple[int,int]]=None, drop_last: bool=False,
+            source_dir: str=None, data_files_dir: str=None):
+        if stage not in DATA_STAGES:
+            raise ValueError(f"stage must be one of {DATA_STAGES} not {stage}")
+        if batch_size <= 0 or prefetch <= 0 or num_workers <= 0:
+            raise ValueError("batch_size, prefetch and num_workers must be positive")
+        self.stage = stage
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.prefetch = prefetch
+        self.num_workers = num_workers
+        self.use_processes = use_processes
+        self.draft_size = tuple(draft_size) if draft_size is not None else None
+        self.drop_last = drop_last
+        self.epoch = 0
+        self.num_images = 0
+        self.elapsed_seconds = 0.0
+
+        source_dir = source_dir if source_dir is not None else get_local_source_images_dir()
+        data_files_dir = data_files_dir if data_files_dir is not None else get_local_data_files_dir()
+        rows = read_stage_data_files_df({stage: os.path.join(data_files_dir, f"{stage}_data.csv")})
+        src_paths = source_dir + os.sep + rows['file_name']
+        is_found = src_paths.map(os.path.isfile)
+        if not is_found.all():
+            missing = rows['file_name'][~is_found].tolist()
+            logger.warning(f"{len(missing)} files of the {stage} data file are not in {source_dir} e.g. {missing[:MAX_MISSING_FILES_LOGGED]}")
+        self.src_paths = src_paths[is_found].to_numpy()
+        self.labels = rows['label'][is_found].to_numpy()
+
+    def __len__(self) -> int:
+        '''
+        Return the number of batches per epoch
+        '''
+        if self.drop_last:
+            return len(self.src_paths) // self.batch_size
+        return (len(self.src_paths) + self.batch_size - 1) // self.batch_size
+
+    @property
+    def images_per_sec(self) -> float:
+        '''
+        Return the throughput over all epochs so far
+        '''
+        return self.num_images / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def get_epoch_order(self, epoch: int) -> np.ndarray:
+        if not self.shuffle:
+            return np.arange(len(self.src_paths))
+        seed = self.seed + epoch if self.seed is not None else None
+        return np.random.default_rng(seed).permutation(len(self.src_paths))
+
+    def create_executor(self) -> Executor:
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.num_workers)
+        return ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def produce_batches(self, order: np.ndarray, batches: queue.Queue, stop: threading.Event) -> None:
+        '''
+        Decode the batches of the given row order into batches, ending with
+        None, or with the exception that stopped the producer
+        '''
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=QUEUE_PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            with self.create_executor() as executor:
+                for batch_num in range(len(self)):
+                    rows = order[batch_num * self.batch_size:(batch_num + 1) * self.batch_size]
+                    items = [(src_path, self.draft_size) for src_path in self.src_paths[rows]]
+                    images = np.stack(list(executor.map(decode_frame if self.draft_size is None else decode_draft_frame, items)))
+                    if not put((images, self.labels[rows])):
+                        return
+            put(None)
+        except Exception as exp:
+            put(exp)
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        order = self.get_epoch_order(self.epoch)
+        self.epoch += 1
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(target=self.produce_batches, args=(order, batches, stop), daemon=True)
+
+        num_images = 0
+        start = time.perf_counter()
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                num_images += len(item[0])
+                yield item
+        finally:
+            # also reached when the consumer stops early
+            stop.set()
+            producer.join()
+            elapsed_seconds = time.perf_counter() - start
+            self.num_images += num_images
+            self.elapsed_seconds += elapsed_seconds
+            images_per_sec = num_images / elapsed_seconds if elapsed_seconds > 0 else 0.0
+            logger.info(f"{self.stage} epoch:{self.epoch - 1} images:{num_images} seconds:{elapsed_seconds:.2f} images/sec:{images_per_sec:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream the (images, labels) batches of a stage data file and report the loader throughput",
+        usage="--help/-h --stage train|test|pred [--batch-size <pos int>] [--workers <pos int>] [--processes] "
+            "[--prefetch <pos int>] [--draft <width> <height>] [--seed <int>] [--epochs <pos int>]")
+    parser.add_argument(
+        '--stage', required=True,
+        choices=DATA_STAGES,
+        help='the stage data file to load')
+    parser.add_argument(
+        '--batch-size', default=DEFAULT_BATCH_SIZE, type=int,
+        help='number of images per batch')
+    parser.add_argument(
+        '--workers', default=DEFAULT_NUM_WORKERS, type=int,
+        help='number of decode workers')
+    parser.add_argument(
+        '--processes', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to decode in worker processes instead of threads')
+    parser.add_argument(
+        '--prefetch', default=DEFAULT_PREFETCH, type=int,
+        help='max number of decoded batches waiting in the queue')
+    parser.add_argument(
+        '--draft', default=None, nargs=2, type=int,
+        metavar=("<width>", "<height>"),
+        help='optional size of the images, decoded in PIL draft mode')
+    parser.add_argument(
+        '--seed', default=None, type=int,
+        help='optional shuffle seed')
+    parser.add_argument(
+        '--epochs', default=1, type=int,
+        help='number of epochs to load')
+    args = vars(parser.parse_args())
+
+    loader = FrameLoader(
+        stage=args['stage'],
+        batch_size=args['batch_size'],
+        seed=args['seed'],
+        prefetch=args['prefetch'],
+        num_workers=args['workers'],
+        use_processes=args['processes'],
+        draft_size=args['draft'])
+    for _ in range(args['epochs']):
+        for _ in loader:
+            pass
+    print(f"frame_loader images/sec: {loader.images_per_sec:.1f}")
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
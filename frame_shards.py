@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import tarfile
+from typing import Dict, Iterator, List, Tuple
+
+from episode_service import DATA_STAGES
+from dataset_snapshot import read_stage_data_files_df
+from s3_utils import s3_upload_files, s3_list_keys, s3_list_key_etags, s3_delete_files, s3_sync_download_folders
+from sync_s3_image_files import DEFAULT_IMG_SIZE
+from env import S3_MEDIA_ANGEL_NFT_BUCKET, get_local_data_files_dir, get_local_source_images_dir
+from import_utils import lazy_import
+
+# pandas is only imported on first use
+pd = lazy_import("pandas")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("frame_shards")
+
+# ============================================
+# frame_shards MODULE OVERVIEW
+#
+# usage:
+#     python frame_shards.py [--pack] [--upload] [--download] [--size <img_size>] [--shard-mb <pos int>]
+#
+# packs the source images of each <stage>_data.csv into uncompressed
+# tar shards of about --shard-mb each, under
+# <local data files dir>/shards/<img_size>/:
+#
+#   <stage>-00000.tar         the jpg files of the shard
+#   <stage>-00000.index.csv   file_name,label,offset,size of each jpg
+#
+# offset is the position of the jpg bytes within the tar, so a reader
+# makes one sequential read of the shard and slices every frame out of
+# it, see read_shard_frames. Shards are uploaded to and downloaded from
+# s3://media.angel-nft.com/tuttle_twins/shards/<img_size>/ by s3_utils,
+# so a stage is transferred with a handful of requests instead of one
+# request per ~2 KB thumbnail. Shards remain valid tar files.
+# Shard names are reused by every pack, so the s3 ETag of each
+# downloaded file is kept in <local data files dir>/shards/<img_size>.etags.json
+# and a local file whose ETag changed on s3 is downloaded again.
+
+SHARDS_DIR_NAME = "shards"
+S3_SHARDS_DIR = "tuttle_twins/shards"
+
+DEFAULT_SHARD_MB = 64
+
+SHARD_INDEX_COLUMNS = ['file_name', 'label', 'offset', 'size']
+SHARD_INDEX_SUFFIX = ".index.csv"
+SHARD_ETAGS_SUFFIX = ".etags.json"
+
+# max number of missing source files named in the log
+MAX_MISSING_FILES_LOGGED = 10
+
+
+def get_local_shards_dir(img_size: str=DEFAULT_IMG_SIZE) -> str:
+    return os.path.join(get_local_data_files_dir(), SHARDS_DIR_NAME, img_size)
+
+
+def get_local_shard_etags_file(img_size: str=DEFAULT_IMG_SIZE) -> str:
+    '''
+    e.g. <local data files dir>/shards/thumbnails.etags.json, outside of
+    the shards dir, whose files are all synced with s3
+    '''
+    return os.path.join(get_local_data_files_dir(), SHARDS_DIR_NAME, img_size + SHARD_ETAGS_SUFFIX)
+
+
+def get_s3_shards_dir(img_size: str=DEFAULT_IMG_SIZE) -> str:
+    return f"{S3_SHARDS_DIR}/{img_size}"
+
+
+def get_shard_name(stage: str, shard_num: int) -> str:
+    return f"{stage}-{shard_num:05d}.tar"
+
+
+def get_shard_index_path(shard_path: str) -> str:
+    return shard_path[:-len(".tar")] + SHARD_INDEX_SUFFIX
+
+
+def find_stage_shard_paths(shards_dir: str, stage: str) -> List[str]:
+    '''
+    Return the sorted paths of the local shards of the given stage
+    '''
+    return sorted(glob.glob(os.path.join(shards_dir, f"{stage}-[0-9]*.tar")))
+
+
+def write_shard(shard_path: str, rows: List[Tuple[str,str,str]]) -> None:
+    '''
+    Write the tar shard of the given (file_name, label, src_path) rows
+    and its offset index
+    '''
+    index_rows = []
+    with tarfile.open(shard_path, mode="w", format=tarfile.USTAR_FORMAT) as tar:
+        for file_name, label, src_path in rows:
+            with open(src_path, "rb") as f:
+                data = f.read()
+            tarinfo = tarfile.TarInfo(name=file_name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+            # the data blocks end at tar.offset
+            num_blocks = (len(data) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+            offset = tar.offset - num_blocks * tarfile.BLOCKSIZE
+            index_rows.append((file_name, label, offset, len(data)))
+    pd.DataFrame(index_rows, columns=SHARD_INDEX_COLUMNS).to_csv(get_shard_index_path(shard_path), index=False)
+
+
+def pack_stage_shards(stage: str, stage_data_file: str, source_dir: str, shards_dir: str, shard_mb: int=DEFAULT_SHARD_MB) -> List[str]:
+    '''
+    Pack the source images of the rows of a stage data file into
+    shards of about shard_mb each, replacing the previous shards of the stage
+    Return the list of shard paths
+    '''
+    if shard_mb <= 0:
+        raise ValueError(f"shard_mb must be positive not {shard_mb}")
+    shard_bytes = shard_mb * 1024 * 1024
+    os.makedirs(shards_dir, exist_ok=True)
+    for shard_path in find_stage_shard_paths(shards_dir, stage):
+        os.remove(shard_path)
+        if os.path.isfile(get_shard_index_path(shard_path)):
+            os.remove(get_shard_index_path(shard_path))
+
+    rows = read_stage_data_files_df({stage: stage_data_file})
+    src_paths = source_dir + os.sep + rows['file_name']
+    is_found = src_paths.map(os.path.isfile)
+    if not is_found.all():
+        missing = rows['file_name'][~is_found].tolist()
+        logger.warning(f"{len(missing)} files of {stage_data_file} are not in {source_dir} e.g. {missing[:MAX_MISSING_FILES_LOGGED]}")
+
+    shard_paths = []
+    shard_rows = []
+    num_bytes = 0
+    for file_name, label, src_path in zip(rows['file_name'][is_found], rows['label'][is_found], src_paths[is_found]):
+        file_bytes = os.path.getsize(src_path)
+        if len(shard_rows) > 0 and num_bytes + file_bytes > shard_bytes:
+            shard_paths.append(os.path.join(shards_dir, get_shard_name(stage, len(shard_paths))))
+            write_shard(shard_paths[-1], shard_rows)
+            shard_rows = []
+            num_bytes = 0
+        shard_rows.append((file_name, label, src_path))
+        num_bytes += file_bytes
+    if len(shard_rows) > 0:
+        shard_paths.append(os.path.join(shards_dir, get_shard_name(stage, len(shard_paths))))
+        write_shard(shard_paths[-1], shard_rows)
+
+    logger.info(f"{stage} packed {is_found.sum()} files into {len(shard_paths)} shards")
+    return shard_paths
+
+
+def pack_all_stage_shards(img_size: str=DEFAULT_IMG_SIZE, source_dir: str=None, shard_mb: int=DEFAULT_SHARD_MB) -> Dict[str,List[str]]:
+    '''
+    Pack the shards of all local stage data files
+    Return a dict of stage -> list of shard paths
+    '''
+    source_dir = source_dir if source_dir is not None else get_local_source_images_dir()
+    shards_dir = get_local_shards_dir(img_size)
+    local_data_files_dir = get_local_data_files_dir()
+    shard_paths = {}
+    for stage in DATA_STAGES:
+        stage_data_file = os.path.join(local_data_files_dir, f"{stage}_data.csv")
+        if os.path.isfile(stage_data_file):
+            shard_paths[stage] = pack_stage_shards(stage, stage_data_file, source_dir, shards_dir, shard_mb)
+    return shard_paths
+
+
+def read_shard_index_df(shard_path: str) -> pd.DataFrame:
+    return pd.read_csv(get_shard_index_path(shard_path), dtype={'file_name': str, 'label': str}, keep_default_na=False)
+
+
+def read_shard_frames(shard_path: str) -> Iterator[Tuple[str,str,bytes]]:
+    '''
+    Read a shard with one sequential read and
+    yield the (file_name, label, jpg bytes) of each of its frames
+    '''
+    index_df = read_shard_index_df(shard_path)
+    with open(shard_path, "rb") as f:
+        data = memoryview(f.read())
+    for file_name, label, offset, size in zip(index_df['file_name'], index_df['label'], index_df['offset'], index_df['size']):
+        yield file_name, label, bytes(data[offset:offset + size])
+
+
+def upload_shards(img_size: str=DEFAULT_IMG_SIZE) -> Dict[str,int]:
+    '''
+    Upload all local shards and their indexes of the given img_size
+    and delete the s3 shards that no longer exist locally
+    Return a dict of num_uploaded and num_deleted
+    '''
+    shards_dir = get_local_shards_dir(img_size)
+    s3_shards_dir = get_s3_shards_dir(img_size)
+    up_paths = sorted(glob.glob(os.path.join(shards_dir, "*.tar")) + glob.glob(os.path.join(shards_dir, "*" + SHARD_INDEX_SUFFIX)))
+    uploaded_keys = s3_upload_files(up_paths, bucket=S3_MEDIA_ANGEL_NFT_BUCKET, dir=s3_shards_dir)
+    unused_keys = sorted(set(s3_list_keys(S3_MEDIA_ANGEL_NFT_BUCKET, s3_shards_dir)) - set(uploaded_keys))
+    s3_delete_files(S3_MEDIA_ANGEL_NFT_BUCKET, unused_keys)
+    return {
+        "num_uploaded": len(uploaded_keys),
+        "num_deleted": len(unused_keys)
+    }
+
+
+def find_changed_shard_files(shards_dir: str, file_etags: Dict[str,str], local_file_etags: Dict[str,str]) -> List[str]:
+    '''
+    Return the local files of shards_dir whose s3 ETag in file_etags
+    differs from the ETag they were downloaded with in local_file_etags
+    '''
+    return sorted(
+        os.path.join(shards_dir, file_name)
+        for file_name, etag in file_etags.items()
+        if local_file_etags.get(file_name) != etag and os.path.isfile(os.path.join(shards_dir, file_name)))
+
+
+def download_shards(img_size: str=DEFAULT_IMG_SIZE) -> Dict[str,int]:
+    '''
+    Sync the s3 shards and their indexes of the given img_size
+    into the local shards dir, local files whose s3 ETag changed
+    since they were downloaded are downloaded again
+    Return a dict of num_downloaded, num_removed, num_failed and failed
+    '''
+    shards_dir = get_local_shards_dir(img_size)
+    etags_file = get_local_shard_etags_file(img_size)
+    key_etags = s3_list_key_etags(S3_MEDIA_ANGEL_NFT_BUCKET, get_s3_shards_dir(img_size))
+    file_etags = {os.path.basename(key): etag for key, etag in key_etags.items()}
+    local_file_etags = {}
+    if os.path.isfile(etags_file):
+        with open(etags_file, "r") as f:
+            local_file_etags = json.load(f)
+
+    # changed files are removed, so the sync downloads them again
+    changed_files = find_changed_shard_files(shards_dir, file_etags, local_file_etags)
+    for changed_file in changed_files:
+        os.remove(changed_file)
+    logger.info(f"{len(changed_files)} local shard files changed on s3")
+
+    results = s3_sync_download_folders(
+        src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET,
+        src_keys_by_folder={shards_dir: sorted(key_etags.keys())})
+    with open(etags_file + ".tmp", "w") as f:
+        json.dump(file_etags, f, indent=4)
+    os.replace(etags_file + ".tmp", etags_file)
+    return results[shards_dir]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack the local source images of all stage data files into tar shards and sync them with s3",
+        usage="--help/-h [--pack] [--upload] [--download] [--size <img_size>] [--shard-mb <pos int>]")
+    parser.add_argument(
+        '--pack', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to pack the local source images into local shards')
+    parser.add_argument(
+        '--upload', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to upload the local shards to s3')
+    parser.add_argument(
+        '--download', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to sync the s3 shards to the local shards dir')
+    parser.add_argument(
+        '--size', default=None,
+        metavar="<img_size>",
+        help=f'optional <img_size> sub-directory of the local source images, see sync_s3_image_files --sizes, shards are named after {DEFAULT_IMG_SIZE} by default')
+    parser.add_argument(
+        '--shard-mb', default=DEFAULT_SHARD_MB, type=int,
+        help='approximate size of each shard in MB')
+    args = vars(parser.parse_args())
+
+    img_size = args['size'] if args['size'] is not None else DEFAULT_IMG_SIZE
+    results = {}
+    if args['pack']:
+        source_dir = get_local_source_images_dir()
+        if args['size'] is not None:
+            source_dir = os.path.join(source_dir, args['size'])
+        shard_paths = pack_all_stage_shards(img_size=img_size, source_dir=source_dir, shard_mb=args['shard_mb'])
+        results['num_shards'] = {stage: len(paths) for stage, paths in shard_paths.items()}
+    if args['upload']:
+        results['upload'] = upload_shards(img_size)
+    if args['download']:
+        results['download'] = download_shards(img_size)
+    print("frame_shards results:", json.dumps(results, indent=4))
+    if args['download'] and results['download']['num_failed'] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from episode_service import DATA_STAGES
+from dataset_snapshot import SNAPSHOT_COLUMNS, read_stage_data_files_df
+from env import get_local_data_files_dir, get_local_source_images_dir
+from frame_id import encode_frame_ids, frame_id_episode_numbers, find_img_frame_mask
+from import_utils import lazy_import
+
+# pandas, numpy, PIL and plot_hist_lib.image_stats are only imported on first use
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+image_stats = lazy_import("plot_hist_lib.image_stats")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("frame_stats")
+
+# ============================================
+# frame_stats MODULE OVERVIEW
+#
+# usage:
+#     python frame_stats.py [--stage train|test|pred] [--episode <episode_id>] [--workers <pos int>]
+#
+# headless batch version of plot_hist_lib.plotImageHistogram: computes
+# the uint8 value histogram of every frame of a stage and/or episode
+# of the stage data files, with np.bincount in a process pool, and its
+# moments from the histogram. The rows are written to the Parquet
+# feature table <local data files dir>/frame_stats/<name>_frame_stats.parquet
+# with columns FRAME_STATS_COLUMNS, where hist is the list of the
+# HIST_BINS counts of the frame, e.g.
+#
+#   df = pd.read_parquet(get_frame_stats_file("train_S01E01"))
+#   df.groupby('label')[['mean', 'std', 'skew']].describe()
+
+FRAME_STATS_DIR_NAME = "frame_stats"
+
+FRAME_STATS_COLUMNS = SNAPSHOT_COLUMNS + ['episode_id', 'num_values', 'mean', 'std', 'min', 'max', 'skew', 'kurtosis', 'hist']
+
+# number of frames sent to each worker at a time
+STATS_CHUNK_SIZE = 64
+
+# max number of missing source files named in the log
+MAX_MISSING_FILES_LOGGED = 10
+
+# max number of malformed file_names named in the log
+MAX_MALFORMED_FILES_LOGGED = 10
+
+
+def get_frame_stats_file(name: str, data_files_dir: str=None) -> str:
+    data_files_dir = data_files_dir if data_files_dir is not None else get_local_data_files_dir()
+    return os.path.join(data_files_dir, FRAME_STATS_DIR_NAME, f"{name}_frame_stats.parquet")
+
+
+def compute_frame_stats(src_path: str) -> dict:
+    '''
+    Return the moments and the histogram of the jpg at src_path
+    '''
+    with Image.open(src_path) as img:
+        frame = np.asarray(img.convert("RGB"))
+    hist = image_stats.computeImageHistogram(frame)
+    stats = image_stats.computeHistogramMoments(hist)
+    stats['hist'] = hist
+    return stats
+
+
+def find_frame_rows_df(stage: str=None, episode_id: str=None, data_files_dir: str=None) -> pd.DataFrame:
+    '''
+    Return the rows of all stage data files, of only the given stage and/or
+    episode_id, e.g. S01E01, with columns SNAPSHOT_COLUMNS + ['episode_id']
+    Rows with a malformed file_name are dropped and logged.
+    '''
+    data_files_dir = data_files_dir if data_files_dir is not None else get_local_data_files_dir()
+    stages = DATA_STAGES if stage is None else [stage]
+    stage_data_files = {stage: os.path.join(data_files_dir, f"{stage}_data.csv") for stage in stages}
+    rows = read_stage_data_files_df({stage: path for stage, path in stage_data_files.items() if os.path.isfile(path)})
+    img_frames = rows['file_name'].str.removesuffix(".jpg").to_numpy()
+    is_valid = find_img_frame_mask(img_frames)
+    if not is_valid.all():
+        examples = rows['file_name'][~is_valid].tolist()[:MAX_MALFORMED_FILES_LOGGED]
+        logger.warning(f"{int((~is_valid).sum())} rows with a malformed file_name dropped e.g. {examples}")
+        rows = rows[is_valid]
+        img_frames = img_frames[is_valid]
+    # season * 100 + episode, e.g. 101 for "TT_S01_E01_FRM-00-00-09-01.jpg"
+    episode_numbers = pd.Series(frame_id_episode_numbers(encode_frame_ids(img_frames)), index=rows.index)
+    if episode_id is not None:
+        is_episode = episode_numbers == int(episode_id[1:3]) * 100 + int(episode_id[4:6])
+        rows = rows[is_episode]
+        episode_numbers = episode_numbers[is_episode]
+    rows = rows.assign(episode_id="S" + (episode_numbers // 100).astype(str).str.zfill(2) + "E" + (episode_numbers % 100).astype(str).str.zfill(2))
+    return rows.reset_index(drop=True)
+
+
+def compute_frame_stats_df(rows: pd.DataFrame, source_dir: str=None, max_workers: int=None) -> pd.DataFrame:
+    '''
+    Compute the frame stats of the given rows in a process pool
+    Return a dataframe with columns FRAME_STATS_COLUMNS
+    '''
+    source_dir = source_dir if source_dir is not None else get_local_source_images_dir()
+    src_paths = source_dir + os.sep + rows['file_name']
+    is_found = src_paths.map(os.path.isfile).astype(bool)
+    if not is_found.all():
+        missing = rows['file_name'][~is_found].tolist()
+        logger.warning(f"{len(missing)} files are not in {source_dir} e.g. {missing[:MAX_MISSING_FILES_LOGGED]}")
+    rows = rows[is_found].reset_index(drop=True)
+
+    stats_rows = []
+    if len(rows) > 0:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            stats_rows = list(executor.map(compute_frame_stats, src_paths[is_found], chunksize=STATS_CHUNK_SIZE))
+    stats_df = pd.DataFrame(stats_rows, columns=FRAME_STATS_COLUMNS[len(SNAPSHOT_COLUMNS) + 1:])
+    return pd.concat([rows[SNAPSHOT_COLUMNS + ['episode_id']], stats_df], axis=1)[FRAME_STATS_COLUMNS]
+
+
+def write_frame_stats(stage: str=None, episode_id: str=None, source_dir: str=None, max_workers: int=None, data_files_dir: str=None) -> str:
+    '''
+    Write the Parquet frame stats of the given stage and/or episode_id,
+    by default of all stage data files
+    Return the path of the Parquet file
+    '''
+    rows = find_frame_rows_df(stage=stage, episode_id=episode_id, data_files_dir=data_files_dir)
+    df = compute_frame_stats_df(rows, source_dir=source_dir, max_workers=max_workers)
+    name = "_".join([part for part in [stage, episode_id] if part is not None]) or "all"
+    stats_file = get_frame_stats_file(name, data_files_dir)
+    os.makedirs(os.path.dirname(stats_file), exist_ok=True)
+    # parquet needs pyarrow or fastparquet
+    df.to_parquet(stats_file, index=False)
+    logger.info(f"{len(df)} frame stats written to {stats_file}")
+    return stats_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write the histogram and moments of each frame of the stage data files to a Parquet feature table",
+        usage="--help/-h [--stage train|test|pred] [--episode <episode_id>] [--workers <pos int>]")
+    parser.add_argument(
+        '--stage', default=None,
+        choices=DATA_STAGES,
+        help='optional stage, all stages by default')
+    parser.add_argument(
+        '--episode', default=None,
+        metavar="<episode_id>",
+        help='optional episode_id e.g. S01E01, all episodes by default')
+    parser.add_argument(
+        '--workers', default=None, type=int,
+        help='size of the process pool, the number of cpus by default')
+    args = vars(parser.parse_args())
+
+    stats_file = write_frame_stats(stage=args['stage'], episode_id=args['episode'], max_workers=args['workers'])
+    print("frame_stats results:", json.dumps({"stats_file": stats_file}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
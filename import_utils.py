@@ -0,0 +1,40 @@
+import importlib.util
+import sys
+from types import ModuleType
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("import_utils")
+
+
+def lazy_import(name: str) -> ModuleType:
+    '''
+    Return a module whose code is only executed on first attribute access,
+    so heavy packages (e.g. pandas, gspread, boto3) cost nothing at startup
+    for command line calls that never use them.
+    see https://docs.python.org/3/library/importlib.html#implementing-lazy-imports
+
+    Example:
+        pd = lazy_import("pandas")
+        df = pd.DataFrame()  # pandas is imported here
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    # bind a submodule to its parent package like a normal import does,
+    # e.g. botocore.exceptions, which boto3 accesses as an attribute
+    parent_name, _, child_name = name.rpartition('.')
+    if len(parent_name) > 0:
+        setattr(sys.modules[parent_name], child_name, module)
+    loader.exec_module(module)
+    return module
+
+
+if __name__ == "__main__":
+    logger.info("done")
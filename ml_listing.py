@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict, List
+
+from frame_id import encode_frame_ids
+from import_utils import lazy_import
+from storage import get_storage
+from env import S3_MEDIA_ANGEL_NFT_BUCKET
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("ml_listing")
+
+# pandas is only imported on first use
+pd = lazy_import("pandas")
+
+# ============================================
+# ml_listing MODULE OVERVIEW
+#
+# keys under tuttle_twins/ML are not partitioned by episode, so finding
+# the jpg keys of one episode costs a full listing of the ML tree.
+# An MLListingSnapshot lists the ML tree once per run, groups it by
+# episode_id in one vectorized pass and hands each episode its slice.
+# process_episode keeps the snapshot current as it deletes, moves and
+# copies files, so the total listing cost doesn't grow with the number
+# of episodes.
+
+ML_DIR = "tuttle_twins/ML"
+
+# e.g. tuttle_twins/ML/validate/Rare/TT_S01_E01_FRM-00-00-09-01.jpg
+ML_JPG_KEY_PATTERN = r"^tuttle_twins/ML/[^/]+/[^/]+/TT_S\d\d_E\d\d_FRM-\d\d-\d\d-\d\d-\d\d\.jpg$"
+
+EPISODE_KEYS_COLUMNS = ['episode_id', 'frame_id', 'ml_key']
+
+
+def parse_ml_keys_df(keys: List[str]) -> pd.DataFrame:
+    '''
+    Vectorized parse of tuttle_twins/ML jpg keys into a dataframe
+    with columns [episode_id, frame_id, ml_key] sorted by frame_id
+    e.g. "tuttle_twins/ML/validate/Rare/TT_S01_E01_FRM-00-00-09-01.jpg"
+      -> ["S01E01", 10100000901, "validate/Rare"]
+    Keys that don't match ML_JPG_KEY_PATTERN are ignored
+    '''
+    s = pd.Series(keys, dtype=object)
+    s = s[s.str.match(ML_JPG_KEY_PATTERN)]
+    if len(s) == 0:
+        return pd.DataFrame(columns=EPISODE_KEYS_COLUMNS)
+
+    # e.g. ["tuttle_twins", "ML", "validate", "Rare", "TT_S01_E01_FRM-00-00-09-01.jpg"]
+    parts = s.str.split('/', n=4, expand=True)
+    img_frame = parts[4].str[:-len(".jpg")]
+    df = pd.DataFrame({
+        'episode_id': img_frame.str[3:6] + img_frame.str[7:10],
+        'frame_id': encode_frame_ids(img_frame),
+        'ml_key': parts[2] + '/' + parts[3]
+    })
+    return df.sort_values('frame_id', ignore_index=True)
+
+
+class MLListingSnapshot:
+    '''
+    A run-scoped snapshot of all jpg keys under tuttle_twins/ML
+    partitioned by episode_id
+    '''
+    episode_dfs: Dict[str, pd.DataFrame]
+
+    def __init__(self, keys: List[str]):
+        self.lock = threading.Lock()
+        df = parse_ml_keys_df(keys)
+        # one pass over df to find the row positions of each episode_id
+        episode_positions = df.groupby('episode_id', sort=False).indices
+        self.episode_dfs = {
+            episode_id: df.iloc[positions].reset_index(drop=True)
+            for episode_id, positions in episode_positions.items()}
+        logger.debug(f"MLListingSnapshot() num_keys:{len(df)} num_episodes:{len(self.episode_dfs)}")
+
+    @classmethod
+    def from_s3(cls, bucket: str=S3_MEDIA_ANGEL_NFT_BUCKET, dir: str=ML_DIR):
+        '''
+        List the ML tree once and return its snapshot
+        '''
+        return cls(get_storage().list_keys(bucket=bucket, dir=dir))
+
+    def get_episode_ids(self) -> List[str]:
+        return sorted(self.episode_dfs.keys())
+
+    def get_num_keys(self) -> int:
+        return sum(len(df) for df in self.episode_dfs.values())
+
+    def get_episode_df(self, episode_id: str) -> pd.DataFrame:
+        '''
+        Return a copy of the episode's slice of the snapshot
+        with columns [episode_id, frame_id, ml_key]
+        '''
+        with self.lock:
+            df = self.episode_dfs.get(episode_id)
+            if df is None:
+                return pd.DataFrame(columns=EPISODE_KEYS_COLUMNS)
+            return df.copy()
+
+    def remove_episode_keys(self, episode_id: str, removed: pd.DataFrame) -> None:
+        '''
+        Remove the rows of removed, with columns [frame_id, ml_key],
+        from the episode's slice after their s3 files were deleted
+        '''
+        if len(removed) == 0:
+            return
+        removed = pd.DataFrame({
+            'frame_id': removed['frame_id'].to_numpy(),
+            'ml_key': removed['ml_key'].astype(str).to_numpy(),
+            'removed': True})
+        with self.lock:
+            df = self.episode_dfs.get(episode_id)
+            if df is None:
+                return
+            df = df.merge(removed, how='left', on=['frame_id', 'ml_key'], sort=False)
+            df = df[df['removed'].isnull()]
+            self.episode_dfs[episode_id] = df[EPISODE_KEYS_COLUMNS].reset_index(drop=True)
+
+    def add_episode_keys(self, episode_id: str, added: pd.DataFrame) -> None:
+        '''
+        Add the rows of added, with columns [frame_id, ml_key],
+        to the episode's slice after their s3 files were copied
+        '''
+        if len(added) == 0:
+            return
+        added = pd.DataFrame({
+            'episode_id': episode_id,
+            'frame_id': added['frame_id'].to_numpy(),
+            'ml_key': added['ml_key'].astype(str).to_numpy()})
+        with self.lock:
+            df = self.episode_dfs.get(episode_id)
+            if df is not None:
+                added = pd.concat([df, added], ignore_index=True)
+            added = added.drop_duplicates(subset=['frame_id', 'ml_key'])
+            self.episode_dfs[episode_id] = added.sort_values('frame_id', ignore_index=True)
+
+
+if __name__ == "__main__":
+    logger.info("done")
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from typing import Dict, List
+
+from frame_id import decode_frame_ids
+from ml_listing import MLListingSnapshot
+from import_utils import lazy_import
+
+# pandas and numpy are only imported on first use
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("ml_verify")
+
+# ============================================
+# ml_verify MODULE OVERVIEW
+#
+# compares the expected set of (frame_id, ml_key) pairs of an episode,
+# e.g. the sampled frames of the google sheet or an applied mapping,
+# with the actual set under tuttle_twins/ML from a fresh paginated
+# listing, as the run's MLListingSnapshot only repeats the changes the
+# run made. Each pair is coded as the single int64
+# frame_id * num_ml_keys + ml_key code, so the sets are compared as
+# sorted integer arrays. Expected frames are
+#   missing:    not under tuttle_twins/ML at all
+#   misplaced:  only under other ml_keys than the expected one
+# and actual keys that are not expected and not a misplaced frame are
+#   extra:      e.g. frames that are not sampled or stray copies
+# The result has status 0 if the sets are equal, else 1, and
+# verify_episode_mappings checks all episodes of a run against one
+# listing, so the entry points can exit with get_verify_status.
+
+# max number of mismatched keys named in the result and the log
+MAX_MISMATCHES_LOGGED = 10
+
+
+def encode_key_pairs(df: pd.DataFrame, ml_keys: pd.Index) -> np.ndarray:
+    '''
+    Return the sorted unique int64 codes frame_id * len(ml_keys) + ml_key
+    code of the rows of df with columns [frame_id, ml_key]
+    '''
+    codes = ml_keys.get_indexer(df['ml_key'].astype(object).to_numpy())
+    return np.unique(df['frame_id'].to_numpy(dtype=np.int64) * len(ml_keys) + codes)
+
+
+def decode_key_pairs(pairs: np.ndarray, ml_keys: pd.Index) -> List[str]:
+    '''
+    Return the keys <ml_key>/<img_frame> of the given pair codes
+    e.g. "train/Common/TT_S01_E01_FRM-00-00-09-01"
+    '''
+    img_frames = decode_frame_ids(pairs // len(ml_keys))
+    return [f"{ml_key}/{img_frame}" for ml_key, img_frame in zip(ml_keys[pairs % len(ml_keys)], img_frames)]
+
+
+def verify_episode_keys(episode_id: str, expected: pd.DataFrame, actual: pd.DataFrame) -> Dict:
+    '''
+    Compare the expected and the actual (frame_id, ml_key) pairs of the
+    episode, both dataframes with columns [frame_id, ml_key], where
+    expected rows with a null ml_key must not be under tuttle_twins/ML
+    Return a dict of episode_id, status, num_expected, num_actual,
+    num_missing, num_misplaced, num_extra and up to MAX_MISMATCHES_LOGGED
+    missing, misplaced and extra keys
+    '''
+    expected = expected[expected['ml_key'].notnull()]
+    ml_keys = pd.Index(pd.unique(np.concatenate([
+        expected['ml_key'].astype(object).to_numpy(),
+        actual['ml_key'].astype(object).to_numpy()])))
+    if len(ml_keys) == 0:
+        ml_keys = pd.Index([""])
+    num_ml_keys = len(ml_keys)
+
+    expected_pairs = encode_key_pairs(expected, ml_keys)
+    actual_pairs = encode_key_pairs(actual, ml_keys)
+    unfound_pairs = expected_pairs[~np.isin(expected_pairs, actual_pairs, assume_unique=True)]
+    unexpected_pairs = actual_pairs[~np.isin(actual_pairs, expected_pairs, assume_unique=True)]
+
+    # unfound frames that are under another ml_key are misplaced
+    unexpected_frame_ids = unexpected_pairs // num_ml_keys
+    is_misplaced = np.isin(unfound_pairs // num_ml_keys, unexpected_frame_ids)
+    missing_pairs = unfound_pairs[~is_misplaced]
+    misplaced_pairs = unfound_pairs[is_misplaced]
+    extra_pairs = unexpected_pairs[~np.isin(unexpected_frame_ids, misplaced_pairs // num_ml_keys)]
+
+    # unexpected_pairs are sorted by frame_id, so searchsorted finds
+    # the first actual pair of each misplaced frame
+    misplaced_samples = misplaced_pairs[:MAX_MISMATCHES_LOGGED]
+    found_samples = unexpected_pairs[np.searchsorted(unexpected_frame_ids, misplaced_samples // num_ml_keys)]
+    return {
+        "episode_id": episode_id,
+        "status": 0 if len(unfound_pairs) + len(unexpected_pairs) == 0 else 1,
+        "num_expected": len(expected_pairs),
+        "num_actual": len(actual_pairs),
+        "num_missing": len(missing_pairs),
+        "num_misplaced": len(misplaced_pairs),
+        "num_extra": len(extra_pairs),
+        "missing": decode_key_pairs(missing_pairs[:MAX_MISMATCHES_LOGGED], ml_keys),
+        "misplaced": [f"{found} not {key}" for found, key in zip(
+            decode_key_pairs(found_samples, ml_keys), decode_key_pairs(misplaced_samples, ml_keys))],
+        "extra": decode_key_pairs(extra_pairs[:MAX_MISMATCHES_LOGGED], ml_keys)
+    }
+
+
+def log_verify_result(result: Dict) -> None:
+    '''
+    Report a verify_episode_keys result in a single log line
+    '''
+    counts = f"expected:{result['num_expected']} actual:{result['num_actual']}"
+    if result['status'] == 0:
+        logger.info(f"episode_id: {result['episode_id']} verified {counts}")
+        return
+    mismatches = " ".join(
+        f"{name}:{result['num_' + name]} e.g. {result[name]}"
+        for name in ['missing', 'misplaced', 'extra'] if result['num_' + name] > 0)
+    logger.warning(f"episode_id: {result['episode_id']} verify failed {counts} {mismatches}")
+
+
+def verify_episode_mappings(mappings: Dict[str, pd.DataFrame], listing: MLListingSnapshot=None) -> Dict[str, Dict]:
+    '''
+    Verify the expected mapping, with columns [frame_id, ml_key], of each
+    episode_id against the listing, by default one fresh paginated
+    listing of the ML tree
+    Return a dict of episode_id -> verify_episode_keys result
+    '''
+    listing = listing if listing is not None else MLListingSnapshot.from_s3()
+    results = {}
+    for episode_id, expected in mappings.items():
+        results[episode_id] = verify_episode_keys(episode_id, expected=expected, actual=listing.get_episode_df(episode_id))
+        log_verify_result(results[episode_id])
+    return results
+
+
+def get_verify_status(results: Dict[str, Dict]) -> int:
+    '''
+    Return 1 if any verify_episode_keys result failed, else 0
+    '''
+    num_failed = sum(result['status'] for result in results.values())
+    logger.info(f"verified {len(results)} episodes, {num_failed} failed")
+    return 0 if num_failed == 0 else 1
+
+
+if __name__ == "__main__":
+    logger.info("done")
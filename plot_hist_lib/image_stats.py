@@ -0,0 +1,108 @@
+import numpy as np
+
+# one bin per uint8 value
+HIST_BINS = 256
+
+# the uint8 value of each histogram bin
+HIST_VALUES = np.arange(HIST_BINS, dtype=np.float64)
+
+# number of uint8 values counted at a time, which bounds the
+# size of the intp copy that np.bincount makes of its input
+HIST_CHUNK_VALUES = 1 << 20
+
+def computeImageHistogram(frame: np.ndarray) -> np.ndarray:
+    '''
+    given a uint8 frame of any shape, e.g. (H, W, C),
+    return the int64 counts of each of its HIST_BINS values
+    over all pixels and channels, counted in one pass of
+    HIST_CHUNK_VALUES chunks
+
+    Example:
+        frame = np.asarray(Image.open('angel-studios.png'))
+        hist = computeImageHistogram(frame)
+    '''
+    frame = np.asarray(frame)
+    if frame.dtype != np.uint8:
+        raise ValueError(f"frame dtype must be uint8 not {frame.dtype}")
+    values = frame.reshape(-1)
+    hist = np.zeros(HIST_BINS, dtype=np.int64)
+    for start in range(0, len(values), HIST_CHUNK_VALUES):
+        hist += np.bincount(values[start:start + HIST_CHUNK_VALUES], minlength=HIST_BINS)
+    return hist
+
+def computeHistogramMoments(hist: np.ndarray) -> dict:
+    '''
+    given the uint8 value counts of a frame, return its
+    num_values, mean, std, min, max, skew and kurtosis
+    without another pass over the frame
+    '''
+    num_values = int(hist.sum())
+    if num_values == 0:
+        raise ValueError("hist is empty")
+    nonzero = np.flatnonzero(hist)
+    weights = hist / num_values
+    mean = float(np.dot(weights, HIST_VALUES))
+    deviations = HIST_VALUES - mean
+    variance = float(np.dot(weights, deviations ** 2))
+    std = variance ** 0.5
+    if std > 0:
+        skew = float(np.dot(weights, deviations ** 3)) / std ** 3
+        kurtosis = float(np.dot(weights, deviations ** 4)) / variance ** 2 - 3.0
+    else:
+        skew = 0.0
+        kurtosis = 0.0
+    return {
+        'num_values': num_values,
+        'mean': mean,
+        'std': std,
+        'min': int(nonzero[0]),
+        'max': int(nonzero[-1]),
+        'skew': skew,
+        'kurtosis': kurtosis
+    }
+
+def computeImageStats(frame: np.ndarray, min_threshold: float=0.1, max_threshold: float=0.9, bins: int=25) -> dict:
+    '''
+    given a uint8 frame, return the moments of computeHistogramMoments and
+    the histogram of its standardized values (value-mu)/std that are
+    between min_threshold and max_threshold, with the mean and std of
+    those values, as used by plotImageHistogram:
+        threshold_counts: the bins counts
+        threshold_edges: the bins + 1 edges
+        threshold_num_values, threshold_mean, threshold_std
+
+    The frame is read once, by computeImageHistogram. Every
+    standardized value is one of HIST_BINS levels, so the thresholded
+    histogram is computed from the uint8 value counts without a
+    float copy of the frame.
+
+    Example:
+        frame = np.asarray(Image.open('angel-studios.png'))
+        stats = computeImageStats(frame)
+    '''
+    hist = computeImageHistogram(frame)
+    stats = computeHistogramMoments(hist)
+
+    std = stats['std'] if stats['std'] > 0 else 1.0
+    levels = (HIST_VALUES - stats['mean']) / std
+    is_kept = (levels > min_threshold) & (levels < max_threshold) & (hist > 0)
+    kept_levels = levels[is_kept]
+    kept_counts = hist[is_kept]
+    num_kept = int(kept_counts.sum())
+
+    if num_kept > 0:
+        counts, edges = np.histogram(kept_levels, bins=bins, weights=kept_counts)
+        threshold_mean = float(np.dot(kept_counts, kept_levels)) / num_kept
+        threshold_std = (float(np.dot(kept_counts, (kept_levels - threshold_mean) ** 2)) / num_kept) ** 0.5
+    else:
+        counts, edges = np.zeros(bins, dtype=np.int64), np.linspace(min_threshold, max_threshold, bins + 1)
+        threshold_mean = float("nan")
+        threshold_std = float("nan")
+
+    stats['hist'] = hist
+    stats['threshold_counts'] = counts.astype(np.int64)
+    stats['threshold_edges'] = edges
+    stats['threshold_num_values'] = num_kept
+    stats['threshold_mean'] = threshold_mean
+    stats['threshold_std'] = threshold_std
+    return stats
@@ -3,65 +3,42 @@
 # !python3 -m pip install --upgrade pip
 # !python3 -m pip install --upgrade Pillow
 
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from PIL import Image
-import scipy.stats as stats
 
-def plotImageHistogram(image: Image):
+from plot_hist_lib.image_stats import computeImageStats
+
+def plotImageHistogram(image: Image, min_threshold: float=0.1, max_threshold: float=0.9, bins: int=25) -> dict:
     '''
     given an PIL.Image image, standardize it (value-mu)/std
-    and plot its histogram overlayed with a 
+    and plot its histogram overlayed with a
     fitted normal distribution
-    
+    the stats are computed in one pass by computeImageStats,
+    matplotlib is only imported here, for the plot
+    Return the stats of computeImageStats
+
     Example:
         image = Image.open('angel-studios.png')
         plotImageHistogram(image)
 
     '''
-    # create a 2D np array
-    frame = np.asarray(image)
-    # print(f"frame.shape:{frame.shape}")
-
-    # compute stats
-    mu = np.mean(frame)
-    std = np.std(frame)
-    minv = np.min(frame)
-    maxv = np.max(frame)
-    # print(f"mu:{mu}")
-    # print(f"std:{std}")
-    # print(f"minv:{minv}")
-    # print(f"maxv:{maxv}")
+    import matplotlib.pyplot as plt
 
-    # flatten 2-d frame into a 1-d array
-    data = frame.flatten()
-    # print(f"data.shape:{data.shape}")
-
-    # standardize
-    data = (data - mu) / std
-
-    # apply threshold
-    min_threshold = 0.1
-    max_threshold = 0.9
-    data = data[data > min_threshold]
-    data = data[data < max_threshold]
+    # a view of the image, not a copy
+    frame = np.asarray(image)
+    stats = computeImageStats(frame, min_threshold=min_threshold, max_threshold=max_threshold, bins=bins)
 
-    # create a pandas dataframe (only for describe)
-    df = pd.DataFrame(data=data)
-    df.describe()
-        
-    # plot the histogram
-    plt.hist(data, bins=25, density=True, alpha=0.6, color='b')
+    # plot the pre-binned histogram of the thresholded standardized values
+    edges = stats['threshold_edges']
+    plt.hist(edges[:-1], bins=edges, weights=stats['threshold_counts'], density=True, alpha=0.6, color='b')
 
-    # fit a normal distribution to the data
-    mu, std = stats.norm.fit (data) # mean and standard deviation
-    # print(f"mu:{mu} std:{std}")
+    # the normal distribution fitted to the thresholded values
+    mu, std = stats['threshold_mean'], stats['threshold_std']
 
     # create a normal distribution curve
     xmin, xmax = plt.xlim()
     x = np.linspace(xmin, xmax, 100)
-    p = stats.norm.pdf(x, mu, std)
+    p = np.exp(-0.5 * ((x - mu) / std) ** 2) / (std * np.sqrt(2 * np.pi))
 
     # plot the normal distribution curve
     plt.plot(x, p, 'k', linewidth=2)
@@ -70,4 +47,4 @@ def plotImageHistogram(image: Image):
     plt.title(title)
 
     plt.show()
-    
\ No newline at end of file
+    return stats
@@ -0,0 +1,178 @@
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from env import get_local_data_files_dir
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("profile_utils")
+
+# ============================================
+# profile_utils MODULE OVERVIEW
+#
+# usage from a command line entry point:
+#
+#     with run_profiler(mode="both", name="create_data_files"):
+#         with profile_phase("load episodes"):
+#             ...
+#         with profile_phase("episode S01E01"):
+#             ...
+#
+# "cpu" writes <name>_<dt>.pstats, which can be read with pstats,
+# snakeviz or flameprof to make a flamegraph, and a text summary
+# <name>_<dt>_cpu.txt of the top functions by cumulative time.
+# "mem" takes a tracemalloc snapshot at the end of each phase and
+# writes a text summary <name>_<dt>_mem.txt of the top allocations
+# of each phase and their growth since the previous phase.
+# All files are written to LOCAL_DATA_FILES_DIR next to the stage
+# data files, which must exist before the profiled run starts, unless
+# another output_dir is given. profile_phase is a no-op when no profiler is running.
+
+PROFILE_MODES = ['cpu', 'mem', 'both']
+
+PROFILE_TOP_N = 25
+
+_active_profiler = None
+
+
+class RunProfiler:
+    mode: str
+    name: str
+    output_dir: str
+    top_n: int
+
+    def __init__(self, mode: str, name: str, output_dir: str=None, top_n: int=PROFILE_TOP_N):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"profile mode must be one of {PROFILE_MODES} not {mode}")
+        self.mode = mode
+        self.name = name
+        # fail before the profiled run, not after it
+        self.output_dir = output_dir if output_dir is not None else get_local_data_files_dir()
+        self.top_n = top_n
+        self.cpu_profile = None
+        self.phase_snapshots: List[Tuple[str, tracemalloc.Snapshot, int]] = []
+
+    def is_cpu(self) -> bool:
+        return self.mode in ['cpu', 'both']
+
+    def is_mem(self) -> bool:
+        return self.mode in ['mem', 'both']
+
+    def start(self) -> None:
+        if self.is_mem():
+            tracemalloc.start()
+        if self.is_cpu():
+            self.cpu_profile = cProfile.Profile()
+            self.cpu_profile.enable()
+
+    def snapshot_phase(self, phase: str) -> None:
+        '''
+        take a tracemalloc snapshot at the end of the given phase
+        '''
+        if not self.is_mem():
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ])
+        self.phase_snapshots.append((phase, snapshot, peak))
+        tracemalloc.reset_peak()
+
+    def stop(self) -> List[str]:
+        '''
+        stop profiling, write all profile files and return their paths
+        '''
+        if self.cpu_profile is not None:
+            self.cpu_profile.disable()
+        if self.is_mem():
+            self.snapshot_phase("end")
+            tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        dt = datetime.datetime.utcnow().isoformat()
+        base_path = os.path.join(self.output_dir, f"{self.name}_{dt}")
+
+        profile_files = []
+        if self.cpu_profile is not None:
+            profile_files.extend(self.write_cpu_files(base_path))
+        if self.is_mem():
+            profile_files.append(self.write_mem_file(base_path))
+
+        for profile_file in profile_files:
+            logger.info(f"profile written to {profile_file}")
+        return profile_files
+
+    def write_cpu_files(self, base_path: str) -> List[str]:
+        pstats_file = base_path + ".pstats"
+        self.cpu_profile.dump_stats(pstats_file)
+
+        summary = io.StringIO()
+        stats = pstats.Stats(self.cpu_profile, stream=summary)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+        cpu_file = base_path + "_cpu.txt"
+        with open(cpu_file, "w") as f:
+            f.write(summary.getvalue())
+        return [pstats_file, cpu_file]
+
+    def write_mem_file(self, base_path: str) -> str:
+        mem_file = base_path + "_mem.txt"
+        with open(mem_file, "w") as f:
+            previous_snapshot = None
+            for phase, snapshot, peak in self.phase_snapshots:
+                stats = snapshot.statistics('lineno')
+                total = sum(stat.size for stat in stats)
+                f.write(f"=== phase: {phase} traced: {total / 2**20:.1f} MiB peak: {peak / 2**20:.1f} MiB\n")
+                f.write(f"--- top {self.top_n} allocations\n")
+                for stat in stats[:self.top_n]:
+                    f.write(f"{stat}\n")
+                if previous_snapshot is not None:
+                    f.write(f"--- top {self.top_n} changes since previous phase\n")
+                    for stat in snapshot.compare_to(previous_snapshot, 'lineno')[:self.top_n]:
+                        f.write(f"{stat}\n")
+                f.write("\n")
+                previous_snapshot = snapshot
+        return mem_file
+
+
+@contextmanager
+def run_profiler(mode: str=None, name: str="profile", output_dir: str=None):
+    '''
+    profile the enclosed code with the given mode, one of PROFILE_MODES,
+    or do nothing if mode is None
+    '''
+    global _active_profiler
+    if mode is None:
+        yield None
+        return
+    profiler = RunProfiler(mode=mode, name=name, output_dir=output_dir)
+    _active_profiler = profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        _active_profiler = None
+        profiler.stop()
+
+
+@contextmanager
+def profile_phase(phase: str):
+    '''
+    mark the enclosed code as a pipeline phase of the running profiler
+    '''
+    try:
+        yield
+    finally:
+        if _active_profiler is not None:
+            _active_profiler.snapshot_phase(phase)
+
+
+if __name__ == "__main__":
+    logger.info("done")
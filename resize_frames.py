@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple
+
+from episode_service import get_file_names_from_all_stage_data_files
+from s3_utils import MAX_DOWNLOAD_WORKERS
+from storage import get_storage
+from sync_s3_image_files import DEFAULT_IMG_SIZE, build_src_keys
+from env import S3_MEDIA_ANGEL_NFT_BUCKET, get_local_source_images_dir
+from import_utils import lazy_import
+
+# PIL is only imported on first use
+Image = lazy_import("PIL.Image")
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("resize_frames")
+
+# ============================================
+# resize_frames MODULE OVERVIEW
+#
+# usage:
+#     python resize_frames.py --dst-size <img_size> --width <pos int> --height <pos int>
+#         [--src-size <img_size>] [--from-s3] [--upload] [--episode <episode_id>]
+#         [--quality <pos int>] [--workers <pos int>] [--io-workers <pos int>]
+#
+# creates the new <dst_size> set of all frames of the stage data files,
+# by default from the local source images of <src_size>, see
+# sync_s3_image_files --sizes, or with --from-s3 from the s3 src keys
+# tuttle_twins/<s01e01>/default_eng/v1/frames/<src_size>/<file_name>.
+# A pool of io threads reads each source jpg, hands it to a process pool
+# that decodes it in PIL draft mode, resizes it to width x height and
+# encodes it as a jpg, and then writes it to
+# <local source images dir>/<dst_size>/<file_name>, or with --upload
+# puts it to the s3 key of <dst_size>.
+# Runs are resumable: frames whose dst file or key already exists are
+# skipped, the .tmp files of an interrupted local run are removed, and
+# frames that fail are logged and retried by the next run, while the
+# run exits with status 1. The throughput is logged in images/sec.
+
+DEFAULT_JPG_QUALITY = 90
+
+# number of resized frames between throughput log lines
+PROGRESS_LOG_FRAMES = 1000
+
+# max number of failed file_names named in the log
+MAX_FAILED_FILES_LOGGED = 10
+
+
+def resize_jpg_bytes(data: bytes, size: Tuple[int,int], quality: int=DEFAULT_JPG_QUALITY) -> bytes:
+    '''
+    Decode the jpg data in PIL draft mode, resize it to
+    size (width, height) and return it encoded as a jpg
+    '''
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", size)
+        img = img.convert("RGB").resize(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def find_existing_dst_keys(dst_keys: List[str]) -> Set[str]:
+    '''
+    List each episode folder of the dst_keys once
+    Return the set of dst_keys that already exist in the storage
+    '''
+    existing_keys = set()
+    for dst_dir in sorted(set(os.path.dirname(dst_key) for dst_key in dst_keys)):
+        existing_keys.update(get_storage().list_keys(S3_MEDIA_ANGEL_NFT_BUCKET, dst_dir))
+    return existing_keys
+
+
+class ResizeProgress:
+    '''
+    Thread-safe count of the resized and failed frames
+    that logs the throughput every PROGRESS_LOG_FRAMES frames
+    '''
+    def __init__(self, num_frames: int):
+        self.lock = threading.Lock()
+        self.num_frames = num_frames
+        self.num_resized = 0
+        self.failed = []
+        self.start = time.perf_counter()
+
+    def images_per_sec(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.num_resized / elapsed if elapsed > 0 else 0.0
+
+    def add_resized(self) -> None:
+        with self.lock:
+            self.num_resized += 1
+            if self.num_resized % PROGRESS_LOG_FRAMES == 0:
+                logger.info(f"resized {self.num_resized}/{self.num_frames} images/sec:{self.images_per_sec():.1f}")
+
+    def add_failed(self, file_name: str, exp: Exception) -> None:
+        with self.lock:
+            self.failed.append(file_name)
+        logger.warning(f"resize of {file_name} failed: {type(exp)} {str(exp)}")
+
+
+def resize_frames(dst_size: str, width: int, height: int, src_size: str=DEFAULT_IMG_SIZE,
+        from_s3: bool=False, upload: bool=False, file_names: List[str]=None,
+        quality: int=DEFAULT_JPG_QUALITY, max_workers: int=None, max_io_workers: int=MAX_DOWNLOAD_WORKERS,
+        local_source_images_dir: str=None) -> Dict[str,float]:
+    '''
+    Resize the frames of the given file_names, by default of all stage
+    data files, from src_size to the new dst_size of width x height
+    Return a dict of num_frames, num_skipped, num_resized, num_failed and images_per_sec
+    '''
+    if dst_size == src_size:
+        raise ValueError(f"dst_size must differ from src_size {src_size}")
+    size = (width, height)
+    file_names = sorted(set(file_names if file_names is not None else get_file_names_from_all_stage_data_files()))
+    local_source_images_dir = local_source_images_dir if local_source_images_dir is not None else get_local_source_images_dir()
+    src_dir = local_source_images_dir if src_size == DEFAULT_IMG_SIZE else os.path.join(local_source_images_dir, src_size)
+    dst_dir = os.path.join(local_source_images_dir, dst_size)
+
+    # resume by skipping the frames that already exist
+    if upload:
+        dst_keys = build_src_keys(file_names, dst_size)
+        existing_dst_keys = find_existing_dst_keys(dst_keys)
+        todo = [(file_name, dst_key) for file_name, dst_key in zip(file_names, dst_keys) if dst_key not in existing_dst_keys]
+    else:
+        os.makedirs(dst_dir, exist_ok=True)
+        existing_file_names = set(os.listdir(dst_dir))
+        # the partial jpgs of an interrupted run
+        for tmp_file_name in [file_name for file_name in existing_file_names if file_name.endswith(".tmp")]:
+            os.remove(os.path.join(dst_dir, tmp_file_name))
+        todo = [(file_name, os.path.join(dst_dir, file_name)) for file_name in file_names if file_name not in existing_file_names]
+    src_keys = dict(zip(file_names, build_src_keys(file_names, src_size))) if from_s3 else {}
+    logger.info(f"{len(file_names) - len(todo)} of {len(file_names)} frames of {dst_size} already exist")
+
+    progress = ResizeProgress(len(todo))
+    storage = get_storage()
+
+    def resize_frame(item: Tuple[str,str]) -> None:
+        file_name, dst = item
+        try:
+            if from_s3:
+                data = storage.get_bytes(S3_MEDIA_ANGEL_NFT_BUCKET, src_keys[file_name])
+            else:
+                with open(os.path.join(src_dir, file_name), "rb") as f:
+                    data = f.read()
+            resized = resize_executor.submit(resize_jpg_bytes, data, size, quality).result()
+            if upload:
+                storage.put_bytes(S3_MEDIA_ANGEL_NFT_BUCKET, dst, resized, content_type="image/jpeg")
+            else:
+                # written under a tmp name so an interrupted run leaves no partial jpg
+                with open(dst + ".tmp", "wb") as f:
+                    f.write(resized)
+                os.replace(dst + ".tmp", dst)
+            progress.add_resized()
+        except Exception as exp:
+            progress.add_failed(file_name, exp)
+
+    if len(todo) > 0:
+        with ProcessPoolExecutor(max_workers=max_workers) as resize_executor:
+            with ThreadPoolExecutor(max_workers=min(max_io_workers, len(todo))) as io_executor:
+                list(io_executor.map(resize_frame, todo))
+
+    if len(progress.failed) > 0:
+        logger.warning(f"{len(progress.failed)} frames failed and are retried by the next run e.g. {sorted(progress.failed)[:MAX_FAILED_FILES_LOGGED]}")
+    logger.info(f"resized {progress.num_resized} frames to {dst_size} images/sec:{progress.images_per_sec():.1f}")
+    return {
+        "num_frames": len(file_names),
+        "num_skipped": len(file_names) - len(todo),
+        "num_resized": progress.num_resized,
+        "num_failed": len(progress.failed),
+        "images_per_sec": round(progress.images_per_sec(), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create a new <img_size> set of all frames of the stage data files",
+        usage="--help/-h --dst-size <img_size> --width <pos int> --height <pos int> [--src-size <img_size>] "
+            "[--from-s3] [--upload] [--episode <episode_id>] [--quality <pos int>] [--workers <pos int>] [--io-workers <pos int>]")
+    parser.add_argument(
+        '--dst-size', required=True,
+        metavar="<img_size>",
+        help='the name of the new frames/<img_size> folder')
+    parser.add_argument(
+        '--width', required=True, type=int,
+        help='width of the new frames')
+    parser.add_argument(
+        '--height', required=True, type=int,
+        help='height of the new frames')
+    parser.add_argument(
+        '--src-size', default=DEFAULT_IMG_SIZE,
+        metavar="<img_size>",
+        help=f'the frames/<img_size> folder of the source frames, default {DEFAULT_IMG_SIZE}')
+    parser.add_argument(
+        '--from-s3', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to read the source frames from s3 instead of the local source images')
+    parser.add_argument(
+        '--upload', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to put the new frames to s3 instead of the local source images')
+    parser.add_argument(
+        '--episode', default=None,
+        metavar="<episode_id>",
+        help='optional episode_id e.g. S01E01, all episodes by default')
+    parser.add_argument(
+        '--quality', default=DEFAULT_JPG_QUALITY, type=int,
+        help='jpg quality of the new frames')
+    parser.add_argument(
+        '--workers', default=None, type=int,
+        help='size of the resize process pool, the number of cpus by default')
+    parser.add_argument(
+        '--io-workers', default=MAX_DOWNLOAD_WORKERS, type=int,
+        help='number of threads that read and write frames')
+    args = vars(parser.parse_args())
+
+    file_names = get_file_names_from_all_stage_data_files()
+    if args['episode'] is not None:
+        # e.g. "TT_S01_E01_" for "S01E01"
+        prefix = f"TT_{args['episode'][:3]}_{args['episode'][3:]}_"
+        file_names = [file_name for file_name in file_names if file_name.startswith(prefix)]
+
+    result = resize_frames(
+        dst_size=args['dst_size'],
+        width=args['width'],
+        height=args['height'],
+        src_size=args['src_size'],
+        from_s3=args['from_s3'],
+        upload=args['upload'],
+        file_names=file_names,
+        quality=args['quality'],
+        max_workers=args['workers'],
+        max_io_workers=args['io_workers'])
+    print("resize_frames results:", json.dumps(result, indent=4))
+    if result['num_failed'] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
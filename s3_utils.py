@@ -6,22 +6,77 @@ import re
 import sys
 import subprocess
 import datetime
+import threading
 from time import time, perf_counter
 from typing import List
-import boto3
-from botocore.exceptions import ClientError
 from s3_key import S3Key
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from import_utils import lazy_import
+from env import AWS_REGION
 
-AWS_REGION = "us-east-1"
-s3_client = boto3.client('s3', region_name=AWS_REGION)
-# s3_resource = boto3.resource('s3', region_name=AWS_REGION)
-s3_resource = boto3.session.Session(region_name=AWS_REGION).resource("s3")
+# boto3 and botocore are only imported on first use
+boto3 = lazy_import("boto3")
+botocore = lazy_import("botocore")
+botocore_config = lazy_import("botocore.config")
+botocore_exceptions = lazy_import("botocore.exceptions")
 
 import logging
 logging.basicConfig(level = logging.INFO)
 logger = logging.getLogger("s3_utils")
 
+# size of the connection pool of each s3 client, large enough for the
+# concurrent parts of a multipart upload_file or download_file
+S3_MAX_POOL_CONNECTIONS = 32
+
+# max attempts of each s3 request, including the first one, retried with
+# the adaptive retry mode, which also rate-limits the client on throttling errors
+S3_MAX_ATTEMPTS = 10
+
+# created on first use by get_s3_client(), boto3 sessions are not
+# thread-safe so the clients of all threads are created under _s3_lock
+_s3_session = None
+_s3_lock = threading.Lock()
+_s3_local = threading.local()
+
+# the missing tcp keep-alive of older botocore versions is only logged once
+_tcp_keepalive_warned = False
+
+def get_s3_config():
+    '''
+    Return the botocore Config of all s3 clients: the region of AWS_REGION,
+    a pool of S3_MAX_POOL_CONNECTIONS, adaptive retries and tcp keep-alive
+    if the installed botocore supports it
+    '''
+    global _tcp_keepalive_warned
+    options = {
+        'region_name': AWS_REGION,
+        'max_pool_connections': S3_MAX_POOL_CONNECTIONS,
+        'retries': {'mode': 'adaptive', 'total_max_attempts': S3_MAX_ATTEMPTS}
+    }
+    # tcp_keepalive is only known to newer botocore versions
+    if 'tcp_keepalive' in botocore_config.Config.OPTION_DEFAULTS:
+        options['tcp_keepalive'] = True
+    elif not _tcp_keepalive_warned:
+        _tcp_keepalive_warned = True
+        logger.warning(f"tcp keep-alive is unavailable with botocore {botocore.__version__}, s3 connections are created without it")
+    return botocore_config.Config(**options)
+
+def get_s3_client():
+    '''
+    Return the boto3 s3 client of the calling thread, creating it on first use,
+    so that the workers of a thread pool never share a connection pool
+    '''
+    s3_client = getattr(_s3_local, "s3_client", None)
+    if s3_client is None:
+        global _s3_session
+        with _s3_lock:
+            if _s3_session is None:
+                _s3_session = boto3.session.Session(region_name=AWS_REGION)
+            s3_client = _s3_session.client('s3', config=get_s3_config())
+        _s3_local.s3_client = s3_client
+    return s3_client
+
 def s3_log_timer_info(func):
     '''
     decorator that shows execution time using this module's logger.debug
@@ -39,51 +94,76 @@ def find_existing_file_names(folder: str) -> List[str]:
     existing_file_names = [item for item in existing_items if os.path.isfile(os.path.join(folder, item))]
     return existing_file_names
 
+# size of the download pool shared by all dst_folders of s3_sync_download_folders
+MAX_DOWNLOAD_WORKERS = 16
+
+# max number of failed src_keys named per dst_folder in the results and the log
+MAX_FAILED_KEYS_LOGGED = 10
+
 @s3_log_timer_info
-def s3_sync_download_files(src_bucket: str, src_keys: List[str], dst_folder: str) -> Dict[str,int]:
+def s3_sync_download_folders(src_bucket: str, src_keys_by_folder: Dict[str,List[str]], max_workers: int=MAX_DOWNLOAD_WORKERS) -> Dict[str,Dict[str,int]]:
     '''
-    Create required dst_file_names from required src_keys
-    download missing src_keys to dst_files
-    remove dst_files that not required
-    verify existing file_names match required_file_names if logger level is DEBUG
-    Return a dict of num_downloaded and num_removed
+    Download the src_keys missing from each dst_folder and remove the
+    files of each dst_folder that are not required
+    each dst_folder is created if needed and listed once,
+    the missing files of all dst_folders are downloaded concurrently
+    by one shared pool, each thread with its own s3 client,
+    then the unused files of each dst_folder are removed.
+    A failed download does not stop the others, it is counted and
+    logged per dst_folder and the file is retried by the next sync
+    Return a dict of dst_folder -> dict of num_downloaded, num_removed,
+    num_failed and up to MAX_FAILED_KEYS_LOGGED failed src_keys
     '''
-    
-    # download missing files from s3
-    num_downloaded = 0
-    for src_key in src_keys:
-        file_name = os.path.basename(src_key)
-        dst_file = os.path.join(dst_folder, file_name)
-        if not os.path.isfile(dst_file):
-            s3_download_file(bucket=src_bucket, key=src_key, dn_path=dst_file)
-            num_downloaded += 1
-    
-    # convert src_keys to required file_names
-    required_file_names = [os.path.basename(src_key) for src_key in src_keys]
+    downloads = []
+    unused_dst_files = {}
+    for dst_folder, src_keys in src_keys_by_folder.items():
+        os.makedirs(dst_folder, exist_ok=True)
+        existing_dst_file_names = set(find_existing_file_names(dst_folder))
+        required_file_names = set()
+        for src_key in src_keys:
+            file_name = os.path.basename(src_key)
+            required_file_names.add(file_name)
+            if file_name not in existing_dst_file_names:
+                downloads.append((dst_folder, src_key, os.path.join(dst_folder, file_name)))
+        unused_dst_files[dst_folder] = [
+            os.path.join(dst_folder, file_name)
+            for file_name in existing_dst_file_names - required_file_names]
+
+    def download(item: Tuple[str,str,str]) -> Tuple[str,str,Optional[Exception]]:
+        dst_folder, src_key, dst_file = item
+        try:
+            get_s3_client().download_file(src_bucket, src_key, dst_file)
+            return dst_folder, src_key, None
+        except Exception as exp:
+            return dst_folder, src_key, exp
+
+    results = {
+        dst_folder: {"num_downloaded": 0, "num_removed": 0, "num_failed": 0, "failed": []}
+        for dst_folder in src_keys_by_folder.keys()}
+    errors = {}
+    if len(downloads) > 0:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(downloads))) as executor:
+            for dst_folder, src_key, exp in executor.map(download, downloads):
+                result = results[dst_folder]
+                if exp is None:
+                    result["num_downloaded"] += 1
+                    continue
+                result["num_failed"] += 1
+                if len(result["failed"]) < MAX_FAILED_KEYS_LOGGED:
+                    result["failed"].append(src_key)
+                errors.setdefault(dst_folder, exp)
+
+    for dst_folder, exp in errors.items():
+        result = results[dst_folder]
+        logger.warning(f"{result['num_failed']} downloads into {dst_folder} failed e.g. {result['failed']} first error: {str(exp)}")
+
+    for dst_folder, dst_files in unused_dst_files.items():
+        for dst_file in dst_files:
+            os.remove(dst_file)
+        results[dst_folder]["num_removed"] = len(dst_files)
+
+    return results
 
-    # find existing dst file_names
-    existing_dst_file_names = find_existing_file_names(dst_folder)
-    
-    # remove unused = existing - required
-    unused_dst_file_names = list(set(existing_dst_file_names) - set(required_file_names))
-    num_removed = 0
-    for dst_file_name in unused_dst_file_names:
-        dst_file = os.path.join(dst_folder, dst_file_name)
-        os.remove(dst_file)
-        num_removed += 1
-        
-    # verify = True if logger.getEffectiveLevel() == logging.DEBUG else False
-    verify = True
-    if verify:
-        # verify existing dst keys == required src keys
-        existing_dst_file_names = find_existing_file_names(dst_folder)
-        assert len(set(required_file_names) - set(existing_dst_file_names)) == 0
-    
-    return {
-        "num_downloaded": num_downloaded,
-        "num_removed": num_removed
-    }
-            
 
 def s3_copy_file(src_bucket: str, src_key: str, dst_bucket: str, dst_key: str) -> dict:
     '''
@@ -95,13 +175,13 @@ def s3_copy_file(src_bucket: str, src_key: str, dst_bucket: str, dst_key: str) -
         assert dst_key is not None, f"ERROR: s3_copy_file() - dst_key is undefined"
 
     try:
-        response = s3_client.copy_object(
+        response = get_s3_client().copy_object(
             CopySource={'Bucket': src_bucket, 'Key': src_key}, 
             Bucket=dst_bucket, 
             Key=dst_key
         )            
         return response
-    except ClientError as ex:
+    except botocore_exceptions.ClientError as ex:
         if ex.response['Error']['Code'] == 'NoSuchKey':
             logger.error(f"s3_copy_file() - NoSuchKey for src_key:{src_key} or dst_key:{dst_key} - returning empty")
             return dict()
@@ -110,15 +190,20 @@ def s3_copy_file(src_bucket: str, src_key: str, dst_bucket: str, dst_key: str) -
 
 
 @s3_log_timer_info
-def s3_copy_files(src_bucket:str, src_keys: List[str], dst_bucket: str, dst_keys: List[str])-> None:
+def s3_copy_files(src_bucket:str, src_keys: List[str], dst_bucket: str, dst_keys: List[str])-> List[str]:
     '''
     Copy a list of s3 src objects to s3 dst objects
+    Return the dst_keys that were actually copied, a missing src_key is skipped
     '''
     logger.debug(f"s3_copy_files() {len(src_keys)} src files to {len(dst_keys)} destinations")
     try:
+        copied_dst_keys = []
         zipped_keys = zip(src_keys, dst_keys)
         for src_key, dst_key in zipped_keys:
-            s3_copy_file(src_bucket=src_bucket, src_key=src_key, dst_bucket=dst_bucket, dst_key=dst_key)
+            response = s3_copy_file(src_bucket=src_bucket, src_key=src_key, dst_bucket=dst_bucket, dst_key=dst_key)
+            if len(response) > 0:
+                copied_dst_keys.append(dst_key)
+        return copied_dst_keys
     except Exception as exp:
         logger.error(type(exp),str(exp))
         raise
@@ -126,7 +211,7 @@ def s3_copy_files(src_bucket:str, src_keys: List[str], dst_bucket: str, dst_keys
 
 def s3_delete_file(bucket: str, key: str) -> None:
     try:
-        s3_resource.Object(bucket, key).delete()
+        get_s3_client().delete_object(Bucket=bucket, Key=key)
     except Exception as exp:
         logger.error(type(exp),str(exp))
         raise
@@ -135,8 +220,9 @@ def s3_delete_file(bucket: str, key: str) -> None:
 @s3_log_timer_info
 def s3_delete_files(bucket: str, keys: List[str]) -> None:
     logger.debug(f"s3_delete_files() {len(keys)} files")
+    s3_client = get_s3_client()
     for key in keys:
-        s3_resource.Object(bucket, key).delete()
+        s3_client.delete_object(Bucket=bucket, Key=key)
 
 
 def s3_upload_file(up_path: str, bucket: str, channel: str):
@@ -145,8 +231,32 @@ def s3_upload_file(up_path: str, bucket: str, channel: str):
     '''
     up_file = os.path.basename(up_path)
     key = channel + "/" + up_file
-    data = open(up_path, "rb")
-    s3_resource.Bucket(bucket).put_object(Key=key, Body=data)
+    with open(up_path, "rb") as data:
+        get_s3_client().put_object(Bucket=bucket, Key=key, Body=data)
+
+
+@s3_log_timer_info
+def s3_upload_files(up_paths: List[str], bucket: str, dir: str, max_workers: int=MAX_DOWNLOAD_WORKERS) -> List[str]:
+    '''
+    upload local files concurrently to s3://<bucket>/<dir>/<file_name>
+    each thread with its own s3 client, which makes multipart
+    uploads of large files
+    Return the list of uploaded keys
+    '''
+    if len(dir) > 0 and not dir.endswith("/"):
+        dir += "/"
+
+    def upload(up_path: str) -> str:
+        key = dir + os.path.basename(up_path)
+        get_s3_client().upload_file(up_path, bucket, key)
+        return key
+
+    if len(up_paths) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(up_paths))) as executor:
+        keys = list(executor.map(upload, up_paths))
+    logger.debug(f"s3_upload_files() s3://{bucket}/{dir} uploaded:{len(keys)}")
+    return keys
 
 
 def s3_download_file(bucket: str, key: str, dn_path: str):
@@ -154,7 +264,7 @@ def s3_download_file(bucket: str, key: str, dn_path: str):
     download a text file from s3 into dn_path
     '''
     try:
-        s3_resource.Bucket(bucket).download_file(key, dn_path)
+        get_s3_client().download_file(bucket, key, dn_path)
     except Exception as e:
         if e.response['Error']['Code'] == "404":
             print("The object does not exist.")
@@ -163,6 +273,39 @@ def s3_download_file(bucket: str, key: str, dn_path: str):
             raise
 
 
+def s3_get_object_bytes(bucket: str, key: str, if_none_match: str=None) -> Tuple[Optional[bytes], Optional[str]]:
+    '''
+    get the body of an s3 object directly into memory
+    if if_none_match is given, a conditional GET is made and
+    (None, if_none_match) is returned when the object is unchanged
+    Return the tuple (body_bytes, etag)
+    '''
+    kwargs = {'Bucket': bucket, 'Key': key}
+    if if_none_match is not None:
+        kwargs['IfNoneMatch'] = if_none_match
+    try:
+        response = get_s3_client().get_object(**kwargs)
+        return response['Body'].read(), response.get('ETag')
+    except botocore_exceptions.ClientError as ex:
+        error_code = ex.response['Error']['Code']
+        if error_code in ('304', 'NotModified'):
+            logger.debug(f"s3_get_object_bytes() key:{key} not modified since etag:{if_none_match}")
+            return None, if_none_match
+        raise
+
+def s3_put_object_bytes(bucket: str, key: str, body: bytes, content_type: str=None) -> str:
+    '''
+    put the given bytes directly from memory as a single s3 object
+    Return the etag of the new object
+    '''
+    kwargs = {'Bucket': bucket, 'Key': key, 'Body': body}
+    if content_type is not None:
+        kwargs['ContentType'] = content_type
+    response = get_s3_client().put_object(**kwargs)
+    logger.debug(f"s3_put_object_bytes() key:{key} num_bytes:{len(body)}")
+    return response.get('ETag')
+
+
 @s3_log_timer_info
 def s3_list_files(bucket: str, dir: str, prefix: str=None, suffix: str=None, key_pattern: str=None, verbose: bool=False) -> List[dict]:
     '''
@@ -179,7 +322,7 @@ def s3_list_files(bucket: str, dir: str, prefix: str=None, suffix: str=None, key
     if len(dir) > 0 and not dir.endswith("/"):
         dir += "/"
 
-    response = s3_client.list_objects_v2(
+    response = get_s3_client().list_objects_v2(
         Bucket=bucket,
         Prefix=dir )
 
@@ -203,6 +346,40 @@ def s3_list_files(bucket: str, dir: str, prefix: str=None, suffix: str=None, key
 
     return s3_key_rows
 
+@s3_log_timer_info
+def s3_list_keys(bucket: str, dir: str) -> List[str]:
+    '''
+    returns the keys of all s3 objects under s3://<bucket>/<dir>/
+    using a paginated list_objects_v2, which has no 1000 key limit
+    '''
+    if len(dir) > 0 and not dir.endswith("/"):
+        dir += "/"
+
+    keys = []
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=dir):
+        keys.extend(obj['Key'] for obj in page.get("Contents", []))
+
+    logger.debug(f"s3_list_keys() s3://{bucket}/{dir} found:{len(keys)}")
+    return keys
+
+@s3_log_timer_info
+def s3_list_key_etags(bucket: str, dir: str) -> Dict[str,str]:
+    '''
+    returns the dict of key -> ETag of all s3 objects under s3://<bucket>/<dir>/
+    using a paginated list_objects_v2
+    '''
+    if len(dir) > 0 and not dir.endswith("/"):
+        dir += "/"
+
+    key_etags = {}
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=dir):
+        key_etags.update((obj['Key'], obj['ETag']) for obj in page.get("Contents", []))
+
+    logger.debug(f"s3_list_key_etags() s3://{bucket}/{dir} found:{len(key_etags)}")
+    return key_etags
+
 @s3_log_timer_info
 def s3_ls_recursive(s3_uri: str) -> List[S3Key]:
     '''
@@ -239,7 +416,9 @@ def s3_ls_recursive(s3_uri: str) -> List[S3Key]:
 
     
 def parse_args(args):
-    
+    # profile_utils is only imported by the command line interface
+    from profile_utils import PROFILE_MODES
+
     example = """
     python s3_utils.py media.angel-nft.com tuttle_twins/manifests --suffix .jl
 
@@ -247,7 +426,7 @@ def parse_args(args):
     """
     parser = argparse.ArgumentParser(
         description='List files in S3.', 
-        usage=f"--help/-h <bucket> <dir> [--prefix <prefix>] [--suffix <suffix>]\nexample: {example}")
+        usage=f"--help/-h <bucket> <dir> [--prefix <prefix>] [--suffix <suffix>] [--profile cpu|mem|both]\nexample: {example}")
     
     parser.add_argument('bucket', 
                         help='an s3 bucket')
@@ -261,6 +440,8 @@ def parse_args(args):
                         help='an optional regex key pattern')
     parser.add_argument("--verbose", "-v", help="increase output verbosity",
                         action="store_true")
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                        help='optional cpu and/or memory profile written next to the stage data files')
     try:
         return parser.parse_args(args)
     except Exception as exp:
@@ -282,6 +463,7 @@ def s3_list_file_cli(argv: List[str]) -> List[dict]:
     suffix = args['suffix']
     key_pattern = args['key_pattern']
     verbose = args['verbose']
+    profile_mode = args['profile']
     
     logger.debug(f"bucket: {bucket}")
     logger.debug(f"dir: {dir}")
@@ -290,7 +472,10 @@ def s3_list_file_cli(argv: List[str]) -> List[dict]:
     logger.debug(f"key_pattern: {key_pattern}")
     logger.debug(f"verbose: {verbose}")
 
-    s3_key_rows = s3_list_files(bucket=bucket, dir=dir, prefix=prefix, suffix=suffix, key_pattern=key_pattern, verbose=verbose)
+    from profile_utils import run_profiler, profile_phase
+    with run_profiler(mode=profile_mode, name="s3_utils"):
+        with profile_phase("list files"):
+            s3_key_rows = s3_list_files(bucket=bucket, dir=dir, prefix=prefix, suffix=suffix, key_pattern=key_pattern, verbose=verbose)
     
     num_keys = len(s3_key_rows)
     print(f"found {num_keys} files")
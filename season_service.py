@@ -1,10 +1,10 @@
 from episode import Episode
 from s3_key import S3Key
-import s3_utils
-import datetime
-import os
+from storage import get_storage
 import json
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 from env import S3_MEDIA_ANGEL_NFT_BUCKET, S3_MANIFESTS_DIR
 
 # use pip install python-dotenv
@@ -18,77 +18,130 @@ logger = logging.getLogger("season_service")
 # ============================================
 # season_service MODULE OVERVIEW
 #
+# season manifest files are read straight from get_storage() object
+# bodies into memory and memoized for the life of the process, so
+# repeated calls cost zero network. A refresh re-validates each memoized
+# manifest with an ETag conditional GET, so unchanged manifests are
+# never downloaded twice.
 
-def find_all_season_manifest_s3_keys() -> List[S3Key]:
+MAX_MANIFEST_WORKERS = 8
+
+# season_manifest_key -> (etag, list of Episode)
+_season_manifest_cache: Dict[str, Tuple[str, List[Episode]]] = {}
+_season_manifest_s3_keys: List[S3Key] = None
+_cache_lock = threading.Lock()
+
+
+def clear_season_manifest_cache() -> None:
+    '''
+    Forget all memoized season manifest keys and episodes
     '''
-    Use s3_utils.s3_list_files to find
+    global _season_manifest_s3_keys
+    with _cache_lock:
+        _season_manifest_cache.clear()
+        _season_manifest_s3_keys = None
+
+def find_all_season_manifest_s3_keys(refresh: bool=False) -> List[S3Key]:
+    '''
+    Use get_storage().list_objects to find
     the S3Keys of all season json files found
     under the s3 manifests directory
     e.g. S01-episodes.json
+    The listing is memoized unless refresh is set
     '''
-    s3_line_dicts = s3_utils.s3_list_files(
-        bucket=S3_MEDIA_ANGEL_NFT_BUCKET, 
-        dir=S3_MANIFESTS_DIR, 
-        suffix="-episodes.json")
-    s3Keys = [S3Key(s3_line_dict=s3_line_dict) for s3_line_dict in s3_line_dicts]
-    return s3Keys
+    global _season_manifest_s3_keys
+    if _season_manifest_s3_keys is not None and not refresh:
+        return list(_season_manifest_s3_keys)
+
+    s3Keys = [s3Key for s3Key in get_storage().list_objects(bucket=S3_MEDIA_ANGEL_NFT_BUCKET, dir=S3_MANIFESTS_DIR)
+        if s3Key.get_key().endswith("-episodes.json")]
+    with _cache_lock:
+        _season_manifest_s3_keys = s3Keys
+    return list(s3Keys)
     
 
-def download_season_episodes(season_manifest_key: str) -> List[Episode]:
+def parse_season_episodes(json_bytes: bytes) -> List[Episode]:
     '''
-    Download a season json file from the s3 manifests directory
-    and return a list of all Episode dicts in that season json 
-    file. Return empty list if season json is not found
+    Parse the raw bytes of a season json file 
+    into a list of Episode
+    '''
+    json_dicts = json.loads(json_bytes)
+    return [Episode(json_dict) for json_dict in json_dicts]
+
+
+def download_season_episodes(season_manifest_key: str, refresh: bool=False) -> List[Episode]:
+    '''
+    Load a season json file from the s3 manifests directory
+    directly into memory and return a list of all Episode 
+    dicts in that season json file. 
+    Memoized episodes are returned without any network call
+    unless refresh is set, in which case an ETag conditional
+    GET only downloads the manifest if it has changed.
+    Return an empty list if the season json file is not found.
     '''
     assert season_manifest_key is not None, "undefined season_manifest_key"
-    episodes = []
-    tmp_file = "/tmp/tmp-" + datetime.datetime.utcnow().isoformat() + ".json"
+    cached = _season_manifest_cache.get(season_manifest_key)
+    if cached is not None and not refresh:
+        return list(cached[1])
+
+    cached_etag = cached[0] if cached is not None else None
     try:
-        s3_utils.s3_download_file(
+        json_bytes, etag = get_storage().get_bytes_etag(
             bucket=S3_MEDIA_ANGEL_NFT_BUCKET,
             key=season_manifest_key,
-            dn_path=tmp_file)
-
-        if os.path.exists(tmp_file):
-            with open(tmp_file,"r") as f:
-                json_dicts = json.load(f)
-                for json_dict in json_dicts:
-                    episode = Episode(json_dict)
-                    episodes.append(episode)
-                
+            if_none_match=cached_etag)
+    except FileNotFoundError as exp:
+        logger.warning(f"season manifest not found {str(exp)}")
+        with _cache_lock:
+            _season_manifest_cache.pop(season_manifest_key, None)
+        return []
     except Exception as exp:
-        logger.error(type(exp), str(exp))
+        logger.error(f"{type(exp)} {str(exp)}")
         raise
 
-    finally:
-        if os.path.exists(tmp_file):
-            os.remove(tmp_file)
-        return episodes
+    # not modified since the memoized etag
+    if json_bytes is None:
+        return list(cached[1])
+
+    episodes = parse_season_episodes(json_bytes)
+    with _cache_lock:
+        _season_manifest_cache[season_manifest_key] = (etag, episodes)
+    return list(episodes)
 
-def download_all_seasons_episodes() -> List[Episode]:
+def download_all_seasons_episodes(refresh: bool=False) -> List[Episode]:
     '''
     Return a list of all Episodes from all season json
     files (e.g. S01-episodes.json) found in the S3 manifest 
     directory. Return an empty list if zero season json files 
     with Episode dicts are not found.
+    Season manifests are loaded concurrently.
     '''
     all_episodes = []
     try:
         # e.g. [S01-episodes.json, S02-episodes.json, S03-episodes.json, ...]
-        season_manifest_s3_keys = find_all_season_manifest_s3_keys()
-        for season_manifest_s3_key in season_manifest_s3_keys:
-            season_episodes = download_season_episodes(season_manifest_s3_key.get_key())
-            if season_episodes and len(season_episodes) > 0:
-                all_episodes.extend(season_episodes)
+        season_manifest_s3_keys = find_all_season_manifest_s3_keys(refresh=refresh)
+        season_manifest_keys = [s3key.get_key() for s3key in season_manifest_s3_keys]
+        if len(season_manifest_keys) == 0:
+            return all_episodes
+
+        max_workers = min(MAX_MANIFEST_WORKERS, len(season_manifest_keys))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map preserves the manifest key order
+            all_season_episodes = executor.map(
+                lambda key: download_season_episodes(key, refresh=refresh),
+                season_manifest_keys)
+            for season_episodes in all_season_episodes:
+                if season_episodes and len(season_episodes) > 0:
+                    all_episodes.extend(season_episodes)
     except Exception as exp:
-        logger.error(type(exp),str(exp))
+        logger.error(f"{type(exp)} {str(exp)}")
         raise
     return all_episodes
 
-def find_all_season_codes() -> List[str]:
+def find_all_season_codes(refresh: bool=False) -> List[str]:
     # e.g. [S01, S02, S03, ...]
     all_season_codes = []
-    all_season_s3_keys = find_all_season_manifest_s3_keys()
+    all_season_s3_keys = find_all_season_manifest_s3_keys(refresh=refresh)
     # [s3key.get_key()[0:3] for s3key in all_season_s3_keys]
     for s3key in all_season_s3_keys:
         key = s3key.get_key()
@@ -0,0 +1,310 @@
+import abc
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from s3_key import S3Key
+from s3_utils import (botocore_exceptions, get_s3_client, s3_list_keys, s3_get_object_bytes, s3_put_object_bytes,
+    s3_copy_file, s3_delete_file, s3_sync_download_folders, MAX_DOWNLOAD_WORKERS)
+from env import S3_MEDIA_ANGEL_NFT_BUCKET, LOCAL_STORAGE_DIR
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("storage")
+
+# ============================================
+# storage MODULE OVERVIEW
+#
+# usage:
+#     python storage.py --mirror <dir> --root <local root> [--bucket <bucket>]
+#
+# Storage is the abstract interface of the object store operations used
+# by the dataset updates: list_keys, list_objects, get_bytes, get_bytes_etag,
+# put_bytes, copy and delete, with copy_many and batch_delete defaults
+# made of copy and delete. It has two implementations:
+#
+#   S3Storage      the s3 buckets, through s3_utils and the shared s3 client
+#   LocalStorage   a local mirror of the buckets laid out as
+#                  <root>/<bucket>/<key>, where server-side copies are
+#                  hardlinks and writes replace files, so a put never
+#                  changes the files linked to the old content
+#
+# get_storage() returns the shared Storage, a LocalStorage of
+# LOCAL_STORAGE_DIR if that is set, else an S3Storage, so development
+# runs, benchmarks and disaster-recovery rebuilds run against a local
+# mirror at filesystem speed. A mirror of an s3 dir is made by
+# mirror_s3_dir, e.g.
+#   python storage.py --mirror tuttle_twins/s01e01/default_eng/v1/frames/thumbnails --root ../mirror
+
+# max number of keys of one s3 delete_objects request
+S3_MAX_DELETE_KEYS = 1000
+
+
+class Storage(abc.ABC):
+    '''
+    interface of the object store operations, see the MODULE OVERVIEW
+    '''
+    @abc.abstractmethod
+    def list_keys(self, bucket: str, dir: str) -> List[str]:
+        '''
+        Return the keys of all objects under <bucket>/<dir>/
+        '''
+        pass
+
+    @abc.abstractmethod
+    def list_objects(self, bucket: str, dir: str) -> List[S3Key]:
+        '''
+        Return the S3Key, with last_modified and size, of all objects under <bucket>/<dir>/
+        '''
+        pass
+
+    @abc.abstractmethod
+    def get_bytes(self, bucket: str, key: str) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def get_bytes_etag(self, bucket: str, key: str, if_none_match: str=None) -> Tuple[Optional[bytes], Optional[str]]:
+        '''
+        Conditional get like s3_utils.s3_get_object_bytes
+        Return the tuple (body_bytes, etag), or (None, if_none_match)
+        if the object still has the etag if_none_match
+        Raise FileNotFoundError if there is no such key
+        '''
+        pass
+
+    @abc.abstractmethod
+    def put_bytes(self, bucket: str, key: str, body: bytes, content_type: str=None) -> None:
+        pass
+
+    @abc.abstractmethod
+    def copy(self, src_bucket: str, src_key: str, dst_bucket: str, dst_key: str) -> bool:
+        '''
+        Copy an object, a missing src_key is logged and skipped like s3_utils.s3_copy_file
+        Return True if the object was copied
+        '''
+        pass
+
+    @abc.abstractmethod
+    def delete(self, bucket: str, key: str) -> None:
+        '''
+        Delete an object, a missing key is not an error
+        '''
+        pass
+
+    def copy_many(self, src_bucket: str, src_keys: List[str], dst_bucket: str, dst_keys: List[str]) -> List[str]:
+        '''
+        Return the dst_keys that were actually copied
+        '''
+        return [dst_key for src_key, dst_key in zip(src_keys, dst_keys) if self.copy(src_bucket, src_key, dst_bucket, dst_key)]
+
+    def batch_delete(self, bucket: str, keys: List[str]) -> None:
+        for key in keys:
+            self.delete(bucket, key)
+
+
+class S3Storage(Storage):
+    '''
+    Storage of the s3 buckets
+    '''
+    def list_keys(self, bucket: str, dir: str) -> List[str]:
+        return s3_list_keys(bucket=bucket, dir=dir)
+
+    def list_objects(self, bucket: str, dir: str) -> List[S3Key]:
+        if len(dir) > 0 and not dir.endswith("/"):
+            dir += "/"
+        s3_keys = []
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=dir):
+            for obj in page.get("Contents", []):
+                s3_keys.append(S3Key(s3_line_dict={
+                    # naive utc like the parsed lines of "aws s3 ls"
+                    'last_modified': obj['LastModified'].astimezone(datetime.timezone.utc).replace(tzinfo=None),
+                    'size': obj['Size'],
+                    'key': obj['Key']}))
+        return s3_keys
+
+    def get_bytes(self, bucket: str, key: str) -> bytes:
+        body, _ = s3_get_object_bytes(bucket=bucket, key=key)
+        return body
+
+    def get_bytes_etag(self, bucket: str, key: str, if_none_match: str=None) -> Tuple[Optional[bytes], Optional[str]]:
+        try:
+            return s3_get_object_bytes(bucket=bucket, key=key, if_none_match=if_none_match)
+        except botocore_exceptions.ClientError as ex:
+            if ex.response['Error']['Code'] in ('NoSuchKey', '404'):
+                raise FileNotFoundError(f"no key s3://{bucket}/{key}") from ex
+            raise
+
+    def put_bytes(self, bucket: str, key: str, body: bytes, content_type: str=None) -> None:
+        s3_put_object_bytes(bucket=bucket, key=key, body=body, content_type=content_type)
+
+    def copy(self, src_bucket: str, src_key: str, dst_bucket: str, dst_key: str) -> bool:
+        # s3_copy_file returns an empty response for a missing src_key
+        return len(s3_copy_file(src_bucket=src_bucket, src_key=src_key, dst_bucket=dst_bucket, dst_key=dst_key)) > 0
+
+    def delete(self, bucket: str, key: str) -> None:
+        s3_delete_file(bucket=bucket, key=key)
+
+    def batch_delete(self, bucket: str, keys: List[str]) -> None:
+        '''
+        Delete up to S3_MAX_DELETE_KEYS keys per request
+        '''
+        keys = list(keys)
+        for start in range(0, len(keys), S3_MAX_DELETE_KEYS):
+            objects = [{'Key': key} for key in keys[start:start + S3_MAX_DELETE_KEYS]]
+            response = get_s3_client().delete_objects(Bucket=bucket, Delete={'Objects': objects, 'Quiet': True})
+            errors = response.get('Errors', [])
+            if len(errors) > 0:
+                raise Exception(f"batch_delete() {len(errors)} keys not deleted e.g. {errors[:3]}")
+
+
+class LocalStorage(Storage):
+    '''
+    Storage of a local mirror of the buckets under <root>/<bucket>/<key>
+    '''
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def get_path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def list_keys(self, bucket: str, dir: str) -> List[str]:
+        bucket_dir = os.path.join(self.root, bucket)
+        keys = []
+        for folder, _, file_names in os.walk(self.get_path(bucket, dir.rstrip('/'))):
+            prefix = os.path.relpath(folder, bucket_dir).replace(os.sep, '/')
+            # the files directly under the bucket dir have no prefix
+            prefix = "" if prefix == "." else prefix + "/"
+            keys.extend(f"{prefix}{file_name}" for file_name in file_names if not file_name.endswith(".tmp"))
+        return sorted(keys)
+
+    def list_objects(self, bucket: str, dir: str) -> List[S3Key]:
+        s3_keys = []
+        for key in self.list_keys(bucket, dir):
+            stat = os.stat(self.get_path(bucket, key))
+            s3_keys.append(S3Key(s3_line_dict={
+                'last_modified': datetime.datetime.utcfromtimestamp(int(stat.st_mtime)),
+                'size': stat.st_size,
+                'key': key}))
+        return s3_keys
+
+    def get_bytes(self, bucket: str, key: str) -> bytes:
+        with open(self.get_path(bucket, key), "rb") as f:
+            return f.read()
+
+    def get_bytes_etag(self, bucket: str, key: str, if_none_match: str=None) -> Tuple[Optional[bytes], Optional[str]]:
+        # the etag of a local file is its mtime and size, as a put replaces the file
+        path = self.get_path(bucket, key)
+        stat = os.stat(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if etag == if_none_match:
+            return None, if_none_match
+        with open(path, "rb") as f:
+            return f.read(), etag
+
+    def put_bytes(self, bucket: str, key: str, body: bytes, content_type: str=None) -> None:
+        path = self.get_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+
+    def copy(self, src_bucket: str, src_key: str, dst_bucket: str, dst_key: str) -> bool:
+        src_path = self.get_path(src_bucket, src_key)
+        dst_path = self.get_path(dst_bucket, dst_key)
+        if not os.path.isfile(src_path):
+            logger.error(f"copy() - no src_key:{src_key} - skipped")
+            return False
+        # removing the dst of a copy onto itself would remove the src
+        if src_path == dst_path:
+            return True
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        if os.path.lexists(dst_path):
+            os.remove(dst_path)
+        try:
+            os.link(src_path, dst_path)
+        except OSError:
+            shutil.copyfile(src_path, dst_path)
+        return True
+
+    def delete(self, bucket: str, key: str) -> None:
+        try:
+            os.remove(self.get_path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+
+# created on first use by get_storage()
+_storage = None
+
+def get_storage() -> Storage:
+    '''
+    Return the shared Storage, a LocalStorage of LOCAL_STORAGE_DIR
+    if that is set, else an S3Storage, creating it on first use
+    '''
+    global _storage
+    if _storage is None:
+        if LOCAL_STORAGE_DIR is not None:
+            logger.info(f"using the local storage mirror {LOCAL_STORAGE_DIR}")
+            _storage = LocalStorage(LOCAL_STORAGE_DIR)
+        else:
+            _storage = S3Storage()
+    return _storage
+
+def set_storage(storage: Storage) -> None:
+    '''
+    Replace the shared Storage, e.g. by a LocalStorage for a development run
+    '''
+    global _storage
+    _storage = storage
+
+
+def mirror_s3_dir(bucket: str, dir: str, root: str, max_workers: int=MAX_DOWNLOAD_WORKERS) -> Dict[str,int]:
+    '''
+    Sync all s3 objects under <bucket>/<dir>/ into the local mirror under root
+    Return a dict of num_downloaded, num_removed and num_failed
+    '''
+    local_storage = LocalStorage(root)
+    src_keys_by_folder = {}
+    for key in s3_list_keys(bucket=bucket, dir=dir):
+        folder = os.path.dirname(local_storage.get_path(bucket, key))
+        src_keys_by_folder.setdefault(folder, []).append(key)
+    results = s3_sync_download_folders(src_bucket=bucket, src_keys_by_folder=src_keys_by_folder, max_workers=max_workers)
+    return {
+        "num_downloaded": sum(result["num_downloaded"] for result in results.values()),
+        "num_removed": sum(result["num_removed"] for result in results.values()),
+        "num_failed": sum(result["num_failed"] for result in results.values())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mirror an s3 dir into a local storage root for LOCAL_STORAGE_DIR",
+        usage="--help/-h --mirror <dir> --root <local root> [--bucket <bucket>]")
+    parser.add_argument(
+        '--mirror', required=True,
+        metavar="<dir>",
+        help='the s3 dir to mirror')
+    parser.add_argument(
+        '--root', required=True,
+        metavar="<local root>",
+        help='root of the local mirror')
+    parser.add_argument(
+        '--bucket', default=S3_MEDIA_ANGEL_NFT_BUCKET,
+        metavar="<bucket>",
+        help='the s3 bucket, S3_MEDIA_ANGEL_NFT_BUCKET by default')
+    args = vars(parser.parse_args())
+
+    result = mirror_s3_dir(bucket=args['bucket'], dir=args['mirror'], root=args['root'])
+    print("mirror_s3_dir results:", json.dumps(result, indent=4))
+    if result["num_failed"] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")
@@ -1,41 +1,96 @@
+from __future__ import annotations
+
+import argparse
 import json
+import os
+import sys
+from typing import Dict, List
 
 from episode_service import get_file_names_from_all_stage_data_files
-from s3_utils import s3_sync_download_files
-from env import S3_MEDIA_ANGEL_NFT_BUCKET, LOCAL_SOURCE_IMAGES_DIR
+from s3_utils import s3_sync_download_folders, MAX_DOWNLOAD_WORKERS
+from profile_utils import PROFILE_MODES, run_profiler, profile_phase
+from env import S3_MEDIA_ANGEL_NFT_BUCKET, get_local_source_images_dir
+from import_utils import lazy_import
+
+# pandas is only imported on first use
+pd = lazy_import("pandas")
+
+# the <img_size> folder under frames/ of the default sync
+DEFAULT_IMG_SIZE = "thumbnails"
 
 # example:
 #   activate
 #   python sync_s3_image_files.py
+#   python sync_s3_image_files.py --sizes thumbnails <img_size> ...
 #
-def sync_s3_data_files():
-    # get a list of all required file_names 
-    file_names = get_file_names_from_all_stage_data_files()
-    
-    # convert file_names to src_keys
-    # s3://media.angel-nft.com/tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/TT_S01_E01_FRM-00-00-00-00.jpg
-    # src_bucket = media.angel-nft.com
-    # src_key = tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/TT_S01_E01_FRM-00-00-00-00.jpg
-    # file_name = TT_S01_E01_FRM-00-00-00-00
-    # season_code = S01
-    # episode_code = E01
-    
-    src_keys = []
-    for file_name in file_names:
-        parts = file_name.split("_")
-        season_code_low = parts[1].lower()
-        episode_code_low = parts[2].lower()
-        src_prefix = f"tuttle_twins/{season_code_low}{episode_code_low}/default_eng/v1/frames/thumbnails/"
-        src_key = src_prefix + file_name
-        src_keys.append(src_key)
-    
-    result = s3_sync_download_files(
-        src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET, 
-        src_keys=src_keys, 
-        dst_folder=LOCAL_SOURCE_IMAGES_DIR)
-    
-    print("sync_s3_data_files results:", json.dumps(result, indent=4))
+def build_src_keys(file_names: List[str], img_size: str=DEFAULT_IMG_SIZE) -> List[str]:
+    '''
+    Vectorized conversion of file_names to src_keys of the given img_size
+    e.g. TT_S01_E01_FRM-00-00-00-00.jpg ->
+    tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/TT_S01_E01_FRM-00-00-00-00.jpg
+    '''
+    file_names = pd.Series(file_names, dtype=object)
+    # e.g. "s01e01" from "TT_S01_E01_..."
+    episode_dirs = (file_names.str[3:6] + file_names.str[7:10]).str.lower()
+    src_keys = "tuttle_twins/" + episode_dirs + f"/default_eng/v1/frames/{img_size}/" + file_names
+    return src_keys.tolist()
+
+
+def sync_s3_data_files(img_sizes: List[str]=None, max_workers: int=MAX_DOWNLOAD_WORKERS) -> Dict[str,Dict[str,int]]:
+    '''
+    Sync the source image files of all stage data files
+    The default thumbnails sync is made into the local source images directory.
+    If img_sizes are given, each size is synced into its own local tree
+    <local source images dir>/<img_size>/ and all sizes share
+    one download pool.
+    Return a dict of local dir -> dict of num_downloaded, num_removed,
+    num_failed and failed, see s3_sync_download_folders
+    '''
+    # get a list of all required file_names once for all sizes
+    with profile_phase("find file names"):
+        file_names = get_file_names_from_all_stage_data_files()
+
+    local_source_images_dir = get_local_source_images_dir()
+    with profile_phase("build src keys"):
+        if img_sizes is None:
+            src_keys_by_folder = {local_source_images_dir: build_src_keys(file_names)}
+        else:
+            src_keys_by_folder = {
+                os.path.join(local_source_images_dir, img_size): build_src_keys(file_names, img_size)
+                for img_size in img_sizes}
+
+    with profile_phase("sync download files"):
+        results = s3_sync_download_folders(
+            src_bucket=S3_MEDIA_ANGEL_NFT_BUCKET,
+            src_keys_by_folder=src_keys_by_folder,
+            max_workers=max_workers)
+
+    print("sync_s3_data_files results:", json.dumps(results, indent=4))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sync the s3 source image files of all stage data files to the local source images directory",
+        usage="--help/-h [--sizes <img_size> ...] [--workers <pos int>] [--profile cpu|mem|both]")
+    parser.add_argument(
+        '--sizes', default=None, nargs='+',
+        metavar="<img_size>",
+        help=f'optional frames/<img_size> folders, each synced into its own local tree, default {DEFAULT_IMG_SIZE} only')
+    parser.add_argument(
+        '--workers', default=MAX_DOWNLOAD_WORKERS, type=int,
+        help='size of the download pool shared by all sizes')
+    parser.add_argument(
+        '--profile', default=None,
+        choices=PROFILE_MODES,
+        help='optional cpu and/or memory profile written next to the stage data files')
+    args = vars(parser.parse_args())
+
+    with run_profiler(mode=args['profile'], name="sync_s3_image_files"):
+        results = sync_s3_data_files(img_sizes=args['sizes'], max_workers=args['workers'])
+    if sum(result["num_failed"] for result in results.values()) > 0:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    sync_s3_data_files()
+    main()
@@ -0,0 +1,84 @@
+# call from project directory
+# python -m unittest tests/test_build_training_tree.py
+
+import os
+import tempfile
+import unittest
+
+from build_training_tree import *
+
+class TestBuildTrainingTreeMethods(unittest.TestCase):
+
+    def write_stage_data_files(self, data_files_dir, rows):
+        for stage in DATA_STAGES:
+            with open(os.path.join(data_files_dir, f"{stage}_data.csv"), "w") as f:
+                for row_stage, file_name, label in rows:
+                    if row_stage == stage:
+                        f.write(f"{file_name},{label}\n")
+
+    def test_build_training_tree_is_incremental(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "src")
+            root = os.path.join(tmp_dir, "tree")
+            os.makedirs(source_dir)
+            for i in range(4):
+                with open(os.path.join(source_dir, f"f{i}.jpg"), "w") as f:
+                    f.write(str(i))
+
+            self.write_stage_data_files(tmp_dir, [
+                ('train', 'f0.jpg', 'Common'), ('train', 'f1.jpg', 'Rare'), ('test', 'f2.jpg', 'Rare')])
+            result = build_training_tree(root, source_dir=source_dir, link_mode='hardlink', data_files_dir=tmp_dir)
+            self.assertEqual(result['num_added'], 3)
+            self.assertEqual(os.stat(os.path.join(root, "train", "Rare", "f1.jpg")).st_ino, os.stat(os.path.join(source_dir, "f1.jpg")).st_ino)
+
+            # f1 is relabelled, f2 is removed, f3 is added and f9 has no source file
+            self.write_stage_data_files(tmp_dir, [
+                ('train', 'f0.jpg', 'Common'), ('train', 'f1.jpg', 'Mythic'), ('pred', 'f3.jpg', 'Rare'), ('pred', 'f9.jpg', 'Rare')])
+            result = build_training_tree(root, source_dir=source_dir, link_mode='hardlink', data_files_dir=tmp_dir)
+            self.assertEqual(result, {"num_added": 2, "num_removed": 2, "num_unchanged": 1, "num_missing": 1, "num_symlinked": 0})
+            self.assertFalse(os.path.exists(os.path.join(root, "test", "Rare")))
+            self.assertTrue(os.path.isfile(os.path.join(root, "train", "Mythic", "f1.jpg")))
+
+    def test_build_training_tree_with_symlinks(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "src")
+            root = os.path.join(tmp_dir, "tree")
+            os.makedirs(source_dir)
+            with open(os.path.join(source_dir, "f0.jpg"), "w") as f:
+                f.write("0")
+            self.write_stage_data_files(tmp_dir, [('train', 'f0.jpg', 'Common')])
+            result = build_training_tree(root, source_dir=source_dir, link_mode='symlink', data_files_dir=tmp_dir)
+            self.assertEqual(result['num_symlinked'], 1)
+            self.assertTrue(os.path.islink(os.path.join(root, "train", "Common", "f0.jpg")))
+            result = build_training_tree(root, source_dir=source_dir, link_mode='symlink', data_files_dir=tmp_dir)
+            self.assertEqual(result['num_unchanged'], 1)
+            self.assertEqual(result['num_added'], 0)
+
+    def test_build_training_tree_keeps_other_entries(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "src")
+            root = os.path.join(tmp_dir, "tree")
+            os.makedirs(source_dir)
+            with open(os.path.join(source_dir, "f0.jpg"), "w") as f:
+                f.write("0")
+            # a user file and a directory under a stage dir and a file under a non-stage dir
+            other_paths = [os.path.join(root, "train", "Common", "notes.txt"), os.path.join(root, "other", "Common", "f9.jpg")]
+            for path in other_paths:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as f:
+                    f.write("x")
+            other_dir = os.path.join(root, "train", "Rare", "subdir")
+            os.makedirs(other_dir)
+
+            self.write_stage_data_files(tmp_dir, [('train', 'f0.jpg', 'Common')])
+            build_training_tree(root, source_dir=source_dir, link_mode='hardlink', data_files_dir=tmp_dir)
+            self.write_stage_data_files(tmp_dir, [])
+            result = build_training_tree(root, source_dir=source_dir, link_mode='hardlink', data_files_dir=tmp_dir)
+            self.assertEqual(result['num_removed'], 1)
+            self.assertFalse(os.path.exists(os.path.join(root, "train", "Common", "f0.jpg")))
+            for path in other_paths:
+                self.assertTrue(os.path.isfile(path))
+            self.assertTrue(os.path.isdir(other_dir))
+
+if __name__ == '__main__':
+    unittest.main()
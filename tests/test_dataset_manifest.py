@@ -0,0 +1,51 @@
+# call from project directory
+# python -m unittest tests/test_dataset_manifest.py
+
+import unittest
+
+import pandas as pd
+
+from dataset_manifest import *
+
+class TestDatasetManifestMethods(unittest.TestCase):
+
+    def get_test_G(self, episode_id: str, new_ml_keys):
+        img_frames = [f"TT_{episode_id[0:3]}_{episode_id[3:6]}_FRM-00-00-00-{i:02d}" for i in range(len(new_ml_keys))]
+        return pd.DataFrame({
+            'episode_id': episode_id,
+            'img_src': [f"tuttle_twins/{episode_id.lower()}/default_eng/v1/frames/thumbnails/{img_frame}.jpg" for img_frame in img_frames],
+            'img_frame': img_frames,
+            'new_ml_key': new_ml_keys})
+
+    def test_get_dataset_manifest_key(self):
+        self.assertEqual(get_dataset_manifest_key("train"), "tuttle_twins/datasets/train_manifest.csv")
+        self.assertEqual(get_dataset_manifest_key("pred", "parquet"), "tuttle_twins/datasets/pred_manifest.parquet")
+        with self.assertRaises(ValueError):
+            get_dataset_manifest_key("train", "json")
+
+    def test_find_episode_manifest_df_drops_unlabeled_rows(self):
+        G = self.get_test_G("S01E01", ["train/Common", None, "test/Rare"])
+        df = find_episode_manifest_df(G)
+        self.assertEqual(list(df.columns), ['stage'] + DATASET_MANIFEST_COLUMNS)
+        self.assertEqual(df['stage'].tolist(), ["train", "test"])
+        self.assertEqual(df['label'].tolist(), ["Common", "Rare"])
+        self.assertEqual(df['src_key'].tolist()[1], "tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/TT_S01_E01_FRM-00-00-00-02.jpg")
+
+    def test_split_stage_manifest_dfs(self):
+        episode_manifest_dfs = [
+            find_episode_manifest_df(self.get_test_G("S01E02", ["train/Common", "pred/Rare"])),
+            find_episode_manifest_df(self.get_test_G("S01E01", ["train/Mythic"])),
+        ]
+        stage_manifest_dfs = split_stage_manifest_dfs(episode_manifest_dfs)
+        self.assertEqual(sorted(stage_manifest_dfs.keys()), sorted(DATA_STAGES))
+        self.assertEqual(stage_manifest_dfs['train']['episode_id'].tolist(), ["S01E01", "S01E02"])
+        self.assertEqual(len(stage_manifest_dfs['test']), 0)
+        self.assertEqual(list(stage_manifest_dfs['test'].columns), DATASET_MANIFEST_COLUMNS)
+
+    def test_csv_round_trip(self):
+        df = split_stage_manifest_dfs([find_episode_manifest_df(self.get_test_G("S01E01", ["train/Common"]))])['train']
+        result = dataset_manifest_from_bytes(dataset_manifest_to_bytes(df, 'csv'), 'csv')
+        self.assertEqual(result.values.tolist(), df.values.tolist())
+
+if __name__ == '__main__':
+    unittest.main()
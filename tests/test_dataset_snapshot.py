@@ -0,0 +1,79 @@
+# call from project directory
+# python -m unittest tests/test_dataset_snapshot.py
+
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from dataset_snapshot import *
+
+class TestDatasetSnapshotMethods(unittest.TestCase):
+
+    def get_test_rows(self, rows):
+        df = pd.DataFrame(rows, columns=SNAPSHOT_COLUMNS)
+        return df.sort_values(SNAPSHOT_COLUMNS, ignore_index=True)
+
+    def test_read_stage_data_files_df(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stage_data_files = {}
+            for stage, lines in [('train', "b.jpg,Rare\na.jpg,Common\n"), ('test', "c.jpg,Mythic\n")]:
+                stage_data_files[stage] = os.path.join(tmp_dir, f"{stage}_data.csv")
+                with open(stage_data_files[stage], "w") as f:
+                    f.write(lines)
+            rows = read_stage_data_files_df(stage_data_files)
+        self.assertEqual(rows.values.tolist(), [
+            ['test', 'c.jpg', 'Mythic'],
+            ['train', 'a.jpg', 'Common'],
+            ['train', 'b.jpg', 'Rare']])
+
+    def test_compute_snapshot_id_depends_only_on_content(self):
+        rows = self.get_test_rows([['train', 'a.jpg', 'Common'], ['test', 'b.jpg', 'Rare']])
+        same_rows = self.get_test_rows([['test', 'b.jpg', 'Rare'], ['train', 'a.jpg', 'Common']])
+        other_rows = self.get_test_rows([['test', 'b.jpg', 'Common'], ['train', 'a.jpg', 'Common']])
+        self.assertEqual(len(compute_snapshot_id(rows)), SNAPSHOT_ID_LEN)
+        self.assertEqual(compute_snapshot_id(rows), compute_snapshot_id(same_rows))
+        self.assertNotEqual(compute_snapshot_id(rows), compute_snapshot_id(other_rows))
+
+    def test_delta_round_trip(self):
+        parent_rows = self.get_test_rows([['train', 'a.jpg', 'Common'], ['train', 'b.jpg', 'Rare'], ['test', 'c.jpg', 'Rare']])
+        rows = self.get_test_rows([['train', 'a.jpg', 'Common'], ['train', 'b.jpg', 'Mythic'], ['pred', 'd.jpg', 'Rare']])
+        delta = find_snapshot_delta_df(parent_rows, rows)
+        self.assertEqual(list(delta.columns), DELTA_COLUMNS)
+        self.assertEqual(sorted(delta.values.tolist()), [
+            ['+', 'pred', 'd.jpg', 'Rare'],
+            ['+', 'train', 'b.jpg', 'Mythic'],
+            ['-', 'test', 'c.jpg', 'Rare'],
+            ['-', 'train', 'b.jpg', 'Rare']])
+        self.assertEqual(apply_snapshot_delta(parent_rows, delta).values.tolist(), rows.values.tolist())
+
+    def test_delta_of_repeated_rows(self):
+        parent_rows = self.get_test_rows([['train', 'a.jpg', 'Common'], ['train', 'a.jpg', 'Common'], ['test', 'c.jpg', 'Rare']])
+        rows = self.get_test_rows([['train', 'a.jpg', 'Common'], ['train', 'a.jpg', 'Common']])
+        delta = find_snapshot_delta_df(parent_rows, rows)
+        self.assertEqual(delta.values.tolist(), [['-', 'test', 'c.jpg', 'Rare']])
+
+    def write_stage_data_files(self, data_files_dir, lines):
+        stage_data_file = os.path.join(data_files_dir, "train_data.csv")
+        with open(stage_data_file, "w") as f:
+            f.write(lines)
+        return {'train': stage_data_file}
+
+    def test_publish_existing_snapshot_after_other_parent(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            a_id = publish_dataset_snapshot(self.write_stage_data_files(tmp_dir, "a.jpg,Common\n"), data_files_dir=tmp_dir)
+            b_id = publish_dataset_snapshot(self.write_stage_data_files(tmp_dir, "a.jpg,Rare\nb.jpg,Rare\n"), data_files_dir=tmp_dir)
+            self.assertEqual(publish_dataset_snapshot(self.write_stage_data_files(tmp_dir, "a.jpg,Common\n"), data_files_dir=tmp_dir), a_id)
+            self.assertEqual(get_latest_snapshot_id(tmp_dir), a_id)
+
+            # a consumer that holds B applies the delta of A against B
+            b_rows = load_snapshot_rows_df(b_id, tmp_dir)
+            delta = load_snapshot_delta_df(a_id, parent_id=b_id, data_files_dir=tmp_dir)
+            a_rows = load_snapshot_rows_df(a_id, tmp_dir)
+            self.assertEqual(apply_snapshot_delta(b_rows, delta).values.tolist(), a_rows.values.tolist())
+            # the original delta of A is unchanged
+            self.assertEqual(load_snapshot_delta_df(a_id, data_files_dir=tmp_dir).values.tolist(), [['+', 'train', 'a.jpg', 'Common']])
+
+if __name__ == '__main__':
+    unittest.main()
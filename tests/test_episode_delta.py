@@ -0,0 +1,70 @@
+# call from project directory
+# python -m unittest tests/test_episode_delta.py
+
+import json
+import tempfile
+import unittest
+
+import pandas as pd
+
+from episode_delta import *
+from frame_id import encode_frame_ids
+from storage import LocalStorage, set_storage
+from env import S3_MEDIA_ANGEL_NFT_BUCKET
+
+class TestEpisodeDeltaMethods(unittest.TestCase):
+
+    def get_frame_ids(self, n: int):
+        return encode_frame_ids([f"TT_S01_E01_FRM-00-00-00-{i:02d}" for i in range(n)])
+
+    def test_find_sheet_delta_df(self):
+        frame_ids = self.get_frame_ids(5)
+        applied = pd.DataFrame({
+            'frame_id': frame_ids[0:4],
+            'ml_key': ["train/Common", "test/Rare", "pred/Common", None]})
+        sheet_classes = pd.DataFrame({
+            'frame_id': frame_ids,
+            'new_ml_img_class': ["Common", "Mythic", None, "Rare", "Rare"]})
+        delta = find_sheet_delta_df(applied, sheet_classes)
+        self.assertEqual(list(delta.columns), ['frame_id', 'ml_key', 'new_ml_key'])
+        # frame 0 is unchanged and frame 4 was never sampled
+        self.assertEqual(delta['frame_id'].tolist(), list(frame_ids[1:4]))
+        # relabelled frames keep their stage
+        self.assertEqual(delta['new_ml_key'].tolist()[0], "test/Mythic")
+        # removed
+        self.assertTrue(pd.isnull(delta['new_ml_key'].tolist()[1]))
+        # added frames get a random stage
+        self.assertTrue(delta['new_ml_key'].tolist()[2] in ["train/Rare", "test/Rare", "pred/Rare"])
+
+    def test_find_sheet_delta_df_removed_rows(self):
+        frame_ids = self.get_frame_ids(2)
+        applied = pd.DataFrame({'frame_id': frame_ids, 'ml_key': ["train/Common", "train/Common"]})
+        sheet_classes = pd.DataFrame({'frame_id': frame_ids[0:1], 'new_ml_img_class': ["Common"]})
+        delta = find_sheet_delta_df(applied, sheet_classes)
+        self.assertEqual(delta['frame_id'].tolist(), [frame_ids[1]])
+        self.assertTrue(pd.isnull(delta['new_ml_key'].tolist()[0]))
+
+    def test_apply_sheet_delta_keeps_sources_of_failed_copies(self):
+        with open("manifests/S01-episodes.json", "rb") as f:
+            episode = Episode(json.load(f)[0])
+        frame_ids = self.get_frame_ids(2)
+        delta = pd.DataFrame({
+            'frame_id': frame_ids,
+            'ml_key': ["train/Common", "train/Common"],
+            'new_ml_key': ["train/Rare", "train/Rare"]})
+        old_storage = get_storage()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                storage = LocalStorage(tmp_dir)
+                set_storage(storage)
+                # only frame 0 is under tuttle_twins/ML, so the copy of frame 1 fails
+                storage.put_bytes(S3_MEDIA_ANGEL_NFT_BUCKET, "tuttle_twins/ML/train/Common/TT_S01_E01_FRM-00-00-00-00.jpg", b"0")
+                applied = apply_sheet_delta(episode, delta, src_dir="unused")
+                self.assertEqual(applied['ml_key'].tolist(), ["train/Rare", "train/Common"])
+                self.assertEqual(storage.list_keys(S3_MEDIA_ANGEL_NFT_BUCKET, "tuttle_twins/ML"), [
+                    "tuttle_twins/ML/train/Rare/TT_S01_E01_FRM-00-00-00-00.jpg"])
+        finally:
+            set_storage(old_storage)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 # python -m unittest tests/test_episode_service.py
 
 import unittest
+from unittest import mock
 
 from episode_service import *
 
@@ -27,6 +28,27 @@ class TestEpisodeServiceMethods(unittest.TestCase):
             result = set(G.columns)
             self.assertEqual(result,expected, f"ERROR: expected G.columns: {expected} not {result}")
 
+    def test_coalesce_row_ranges(self):
+        result = coalesce_row_ranges([11, 2, 3, 4, 9, 12, 3])
+        expected = [(2, 4), (9, 9), (11, 12)]
+        self.assertEqual(result, expected)
+
+    def test_find_sample_row_ranges(self):
+        row_ranges = find_sample_row_ranges(num_data_rows=28800, subsample_rate=200)
+        sampled_rows = [row for first_row, last_row in row_ranges for row in range(first_row, last_row + 1)]
+        self.assertEqual(len(sampled_rows), 144)
+        self.assertTrue(min(sampled_rows) >= 2)
+        self.assertTrue(max(sampled_rows) <= 28801)
+
+    def test_find_missing_source_frame_ids(self):
+        frame_ids = pd.Series(encode_frame_ids([
+            "TT_S01_E02_FRM-00-00-00-01", 
+            "TT_S01_E02_FRM-00-00-00-02", 
+            "TT_S01_E02_FRM-00-00-00-03"]))
+        source_frame_ids = encode_frame_ids(["TT_S01_E02_FRM-00-00-00-01", "TT_S01_E02_FRM-00-00-00-03"])
+        missing_frame_ids = find_missing_source_frame_ids(frame_ids, source_frame_ids)
+        self.assertEqual(decode_frame_ids(missing_frame_ids).tolist(), ["TT_S01_E02_FRM-00-00-00-02"])
+
     # def test_s3_find_episode_jpg_keys_df(self):
     #     episode = self.get_test_episode()
     #     episode_id = episode.get_episode_id()
@@ -48,6 +70,22 @@ class TestEpisodeServiceMethods(unittest.TestCase):
     #     result = create_all_stage_data_files()
     #     self.assertEqual(len(result), len(DATA_STAGES))
 
+    def test_encode_episode_keys_df_drops_malformed_img_frames(self):
+        G = pd.DataFrame({
+            'episode_id': ["S01E02"] * 3,
+            'img_frame': ["TT_S01_E02_FRM-00-00-00-01", "TT_S01_E02_FRM-00-00-0x-02", "TT_S01_E02_FRM-00-00-00-00"],
+            'new_ml_key': ["train/Common", "train/Common", "test/Rare"]})
+        G = encode_episode_keys_df(G, find_episode_key_dtypes(G))
+        self.assertEqual(G['frame_id'].tolist(), list(encode_frame_ids(["TT_S01_E02_FRM-00-00-00-00", "TT_S01_E02_FRM-00-00-00-01"])))
+        self.assertEqual(G['new_ml_key'].tolist(), ["test/Rare", "train/Common"])
+
+    def test_find_google_sheet_version_with_http_client(self):
+        # gspread 6 clients only have http_client.request
+        client = mock.Mock(spec=['http_client'])
+        client.http_client.request.return_value.json.return_value = {"version": 42}
+        with mock.patch("episode_service.get_gspread_client", return_value=client):
+            self.assertEqual(find_google_sheet_version(self.get_test_episode()), "42")
+        self.assertEqual(client.http_client.request.call_args.args[0], "get")
 
 if __name__ == '__main__':
     unittest.main()
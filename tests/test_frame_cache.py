@@ -0,0 +1,86 @@
+# call from project directory
+# python -m unittest tests/test_frame_cache.py
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from frame_cache import *
+
+class TestFrameCacheMethods(unittest.TestCase):
+
+    def write_frame(self, source_dir, file_name, value):
+        # a uniform jpg decodes to its exact value
+        pixels = np.full((16, 16, 3), value, dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(source_dir, file_name), format="JPEG", quality=95)
+
+    def write_train_data_file(self, data_files_dir, lines):
+        with open(os.path.join(data_files_dir, "train_data.csv"), "w") as f:
+            f.write(lines)
+
+    def test_decode_frame_is_a_full_decode(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src_path = os.path.join(tmp_dir, "f.jpg")
+            pixels = np.random.default_rng(0).integers(0, 256, size=(64, 96, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(src_path, format="JPEG")
+            with Image.open(src_path) as img:
+                expected = np.asarray(img.convert("RGB").resize((24, 16)), dtype=np.uint8)
+            # no draft mode, which would decode other pixels
+            self.assertTrue(np.array_equal(decode_frame((src_path, (24, 16))), expected))
+
+    def test_build_frame_cache_is_incremental(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "src")
+            os.makedirs(source_dir)
+            for i, file_name in enumerate(["a.jpg", "b.jpg", "c.jpg", "d.jpg"]):
+                self.write_frame(source_dir, file_name, 10 * (i + 1))
+
+            self.write_train_data_file(tmp_dir, "a.jpg,Common\nb.jpg,Rare\n")
+            result = build_frame_cache(source_dir=source_dir, max_workers=1, data_files_dir=tmp_dir)
+            self.assertEqual(result['num_decoded'], 2)
+            self.assertEqual(result['capacity'], 2)
+
+            # b is relabelled, a is removed, and c can't reuse the row of a before index.csv is replaced
+            self.write_train_data_file(tmp_dir, "b.jpg,Mythic\nc.jpg,Common\n")
+            result = build_frame_cache(source_dir=source_dir, max_workers=1, data_files_dir=tmp_dir)
+            self.assertEqual(result, {"num_decoded": 1, "num_freed": 1, "num_relabelled": 1, "num_missing": 0, "capacity": 3})
+
+            frames, index_df, labels = load_frame_cache(data_files_dir=tmp_dir)
+            self.assertEqual(frames.shape, (3, 16, 16, 3))
+            batch, label_codes = load_frame_batch(frames, index_df, ["c.jpg", "b.jpg"])
+            self.assertEqual(batch[:, 0, 0, 0].tolist(), [30, 20])
+            self.assertEqual([labels[code] for code in label_codes], ['Common', 'Mythic'])
+
+            # d reuses the row of a
+            self.write_train_data_file(tmp_dir, "b.jpg,Mythic\nc.jpg,Common\nd.jpg,Common\n")
+            result = build_frame_cache(source_dir=source_dir, max_workers=1, data_files_dir=tmp_dir)
+            self.assertEqual((result['num_decoded'], result['num_relabelled'], result['capacity']), (1, 0, 3))
+            frames, index_df, _ = load_frame_cache(data_files_dir=tmp_dir)
+            self.assertEqual(index_df.set_index('file_name').loc['d.jpg', 'row'], 0)
+
+    def test_build_frame_cache_crash_keeps_indexed_frames(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "src")
+            os.makedirs(source_dir)
+            for i, file_name in enumerate(["a.jpg", "b.jpg", "c.jpg"]):
+                self.write_frame(source_dir, file_name, 10 * (i + 1))
+
+            self.write_train_data_file(tmp_dir, "a.jpg,Common\nb.jpg,Rare\n")
+            build_frame_cache(source_dir=source_dir, max_workers=1, data_files_dir=tmp_dir)
+
+            # a crash after c is decoded and before the index is replaced
+            self.write_train_data_file(tmp_dir, "b.jpg,Rare\nc.jpg,Common\n")
+            with mock.patch("frame_cache.json.dump", side_effect=OSError("crash")):
+                with self.assertRaises(OSError):
+                    build_frame_cache(source_dir=source_dir, max_workers=1, data_files_dir=tmp_dir)
+
+            frames, index_df, _ = load_frame_cache(data_files_dir=tmp_dir)
+            batch, _ = load_frame_batch(frames, index_df, ["a.jpg", "b.jpg"])
+            self.assertEqual(batch[:, 0, 0, 0].tolist(), [10, 20])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# call from project directory
+# python -m unittest tests/test_frame_hash_index.py
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from frame_hash_index import *
+from episode_service import add_randomized_new_ml_folder_column
+
+class TestFrameHashIndexMethods(unittest.TestCase):
+
+    def test_popcount64(self):
+        values = np.array([0, 1, 0xFF, 0xFFFFFFFFFFFFFFFF, 0x8000000000000001], dtype=np.uint64)
+        self.assertEqual(popcount64(values).tolist(), [0, 1, 8, 64, 2])
+
+    def test_compute_dhashes(self):
+        rising = np.tile(np.arange(9, dtype=np.uint8), (8, 1))
+        falling = rising[:, ::-1]
+        hashes = compute_dhashes(np.stack([rising, falling]))
+        self.assertEqual(hashes.dtype, np.uint64)
+        self.assertEqual(hashes.tolist(), [0xFFFFFFFFFFFFFFFF, 0])
+
+    def test_find_neighbor_pairs_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        bases = rng.integers(0, 2**63, size=20, dtype=np.uint64)
+        # near-duplicates of each base with 0 to 6 flipped bits
+        flips = [np.uint64(sum(1 << int(bit) for bit in rng.choice(64, size=k, replace=False))) for k in rng.integers(0, 7, size=60)]
+        hashes = np.concatenate([bases, bases[np.arange(60) % 20] ^ np.array(flips, dtype=np.uint64)])
+        i, j, distances = find_neighbor_pairs(hashes, max_distance=4)
+
+        expected = set()
+        for a in range(len(hashes)):
+            for b in range(a + 1, len(hashes)):
+                if bin(int(hashes[a]) ^ int(hashes[b])).count("1") <= 4:
+                    expected.add((a, b))
+        self.assertEqual(set(zip(i.tolist(), j.tolist())), expected)
+        self.assertTrue((distances <= 4).all())
+
+    def test_find_neighbor_pairs_with_identical_hashes(self):
+        hashes = np.array([5, 7, 5, 5, 1 << 40, 7], dtype=np.uint64)
+        i, j, distances = find_neighbor_pairs(hashes, max_distance=1)
+        expected = [(a, b) for a in range(6) for b in range(a + 1, 6)
+            if bin(int(hashes[a]) ^ int(hashes[b])).count("1") <= 1]
+        self.assertEqual(list(zip(i.tolist(), j.tolist())), expected)
+        self.assertEqual(distances.tolist(), [bin(int(hashes[a]) ^ int(hashes[b])).count("1") for a, b in expected])
+
+    def test_find_frame_groups_collapses_identical_hashes(self):
+        img_frames = ["TT_S01_E01_FRM-00-00-00-00", "TT_S01_E01_FRM-00-00-00-01", "TT_S01_E01_FRM-00-00-00-02",
+            "TT_S01_E02_FRM-00-00-00-00", "TT_S01_E02_FRM-00-00-00-01", "TT_S01_E03_FRM-00-00-00-00"]
+        # E01 has a still scene, E02 has one frame of it and E03 is unrelated
+        hashes = np.array([3, 3, 3, 3, 1 << 50, 1 << 60], dtype=np.uint64)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_file = get_frame_hash_index_file(DEFAULT_IMG_SIZE, tmp_dir)
+            os.makedirs(os.path.dirname(index_file))
+            np.savez(index_file, frame_ids=encode_frame_ids(img_frames), hashes=hashes)
+            for scope, expected in [
+                    ('all', [0, 0, 0, 0, 1, 2]),
+                    ('within', [0, 0, 0, 1, 2, 3]),
+                    ('across', [0, 0, 0, 0, 1, 2])]:
+                groups = find_frame_groups(img_frames, max_distance=0, scope=scope, data_files_dir=tmp_dir)
+                self.assertEqual(groups.tolist(), expected, scope)
+            # malformed frames are groups of their own
+            groups = find_frame_groups(img_frames[:2] + ["TT_S01_E01_FRM-bad", None], max_distance=0, data_files_dir=tmp_dir)
+            self.assertEqual(groups.tolist(), [0, 0, 1, 2])
+            # frames of one episode are not grouped across episodes without a partner
+            groups = find_frame_groups(img_frames[:3] + img_frames[4:], max_distance=0, scope='across', data_files_dir=tmp_dir)
+            self.assertEqual(len(set(groups.tolist())), 5)
+
+    def test_count_neighbor_pairs_matches_expanded_pairs(self):
+        frame_ids = encode_frame_ids([f"TT_S01_E0{1 + k % 3}_FRM-00-00-00-{k:02d}" for k in range(12)])
+        hashes = np.array([3, 3, 3, 3, 2, 2, 1 << 50, 3, (1 << 50) | 1, 1 << 60, 3, 3], dtype=np.uint64)
+        i, j, _ = find_neighbor_pairs(hashes, max_distance=1)
+        groups = find_neighbor_groups(len(frame_ids), i, j)
+        self.assertEqual(count_neighbor_pairs(frame_ids, hashes, max_distance=1), {
+            "num_frames": 12,
+            "num_pairs_within_episodes": int(filter_neighbor_pairs(frame_ids, i, j, 'within').sum()),
+            "num_pairs_across_episodes": int(filter_neighbor_pairs(frame_ids, i, j, 'across').sum()),
+            "num_unique_frames": int(find_unique_frame_mask(groups).sum())})
+        empty = np.empty(0, dtype=np.int64)
+        self.assertEqual(count_neighbor_pairs(empty, empty.astype(np.uint64))["num_unique_frames"], 0)
+
+    def test_filter_neighbor_pairs_by_episode(self):
+        frame_ids = encode_frame_ids(["TT_S01_E01_FRM-00-00-00-00", "TT_S01_E01_FRM-00-00-00-01", "TT_S01_E02_FRM-00-00-00-00"])
+        i, j = np.array([0, 0]), np.array([1, 2])
+        self.assertEqual(filter_neighbor_pairs(frame_ids, i, j, 'within').tolist(), [True, False])
+        self.assertEqual(filter_neighbor_pairs(frame_ids, i, j, 'across').tolist(), [False, True])
+
+    def test_near_duplicate_frames_share_a_group_and_a_stage(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "src")
+            os.makedirs(source_dir)
+            gradient = np.tile(np.linspace(0, 250, 64), (36, 1))
+            frames = {
+                "TT_S01_E01_FRM-00-00-00-00": gradient,
+                "TT_S01_E01_FRM-00-00-00-01": gradient + 2,
+                "TT_S01_E01_FRM-00-00-00-02": gradient[:, ::-1],
+            }
+            for img_frame, pixels in frames.items():
+                Image.fromarray(pixels.astype(np.uint8)).convert("RGB").save(os.path.join(source_dir, img_frame + ".jpg"))
+
+            frame_ids, hashes = build_frame_hash_index(source_dir=source_dir, max_workers=1, data_files_dir=tmp_dir)
+            self.assertEqual(len(frame_ids), 3)
+            img_frames = list(frames) + ["TT_S01_E01_FRM-00-00-00-03"]
+            groups = find_frame_groups(img_frames, max_distance=4, data_files_dir=tmp_dir)
+            self.assertEqual(groups[0], groups[1])
+            self.assertEqual(len(set(groups.tolist())), 3)
+            self.assertEqual(find_unique_frame_mask(groups).tolist(), [True, False, True, True])
+
+            df = pd.DataFrame({'img_frame': img_frames * 50})
+            df = add_randomized_new_ml_folder_column(df, groups=np.tile(groups, 50))
+            self.assertEqual(df.groupby(np.tile(groups, 50))['new_ml_folder'].nunique().max(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# call from project directory
+# python -m unittest tests/test_frame_id.py
+
+import unittest
+
+from frame_id import *
+
+class TestFrameIdMethods(unittest.TestCase):
+
+    def test_encode_decode_round_trip(self):
+        img_frames = ["TT_S01_E01_FRM-00-19-16-19", "TT_S01_E02_FRM-00-00-00-00", "TT_S12_E34_FRM-01-59-59-23"]
+        frame_ids = encode_frame_ids(img_frames)
+        self.assertEqual(frame_ids.dtype, np.int64)
+        self.assertEqual(frame_ids[0], 10100191619)
+        self.assertEqual(decode_frame_ids(frame_ids).tolist(), img_frames)
+
+    def test_frame_ids_sort_in_time_order(self):
+        img_frames = ["TT_S01_E01_FRM-00-01-00-00", "TT_S01_E01_FRM-00-00-59-23", "TT_S01_E02_FRM-00-00-00-00"]
+        frame_ids = encode_frame_ids(img_frames)
+        self.assertEqual(np.argsort(frame_ids).tolist(), [1, 0, 2])
+
+    def test_find_frame_id_range(self):
+        img_frames = ["TT_S01_E01_FRM-00-11-59-23", "TT_S01_E01_FRM-00-12-00-00", "TT_S01_E01_FRM-00-12-59-23", "TT_S01_E01_FRM-00-13-00-00"]
+        frame_ids = encode_frame_ids(img_frames)
+        first, last = find_frame_id_range(1, 1, hh=0, mm=12)
+        minute_12 = frame_ids[(frame_ids >= first) & (frame_ids < last)]
+        self.assertEqual(decode_frame_ids(minute_12).tolist(), img_frames[1:3])
+        self.assertEqual(frame_id_episode_numbers(frame_ids).tolist(), [101] * 4)
+
+    def test_encode_rejects_bad_img_frames(self):
+        with self.assertRaises(ValueError):
+            encode_frame_ids(["TT_S01_E01_FRM-00-19-16-19", "TT_S01_E01_FRM-00-19-16-1"])
+        with self.assertRaises(ValueError):
+            encode_frame_ids(["TT_S01_E01_FRM-00-19-16-1x"])
+
+    def test_find_img_frame_mask(self):
+        img_frames = ["TT_S01_E01_FRM-00-19-16-19", "TT_S01_E01_FRM-00-19-16-1", "TT_S01_E01_FRM-00-19-16-1x",
+            "TT_S01_E01_FRM-00-19-16-190", "", None]
+        self.assertEqual(find_img_frame_mask(img_frames).tolist(), [True, False, False, False, False, False])
+        self.assertEqual(find_img_frame_mask([]).tolist(), [])
+
+if __name__ == '__main__':
+    unittest.main()
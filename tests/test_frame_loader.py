@@ -0,0 +1,59 @@
+# call from project directory
+# python -m unittest tests/test_frame_loader.py
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from frame_loader import *
+
+class TestFrameLoaderMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = os.path.join(self.tmp_dir.name, "src")
+        os.makedirs(self.source_dir)
+        with open(os.path.join(self.tmp_dir.name, "train_data.csv"), "w") as f:
+            for i in range(10):
+                file_name = f"f{i}.jpg"
+                Image.fromarray(np.full((32, 48, 3), 20 * i, dtype=np.uint8)).save(os.path.join(self.source_dir, file_name))
+                f.write(f"{file_name},{'Rare' if i % 2 else 'Common'}\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_loader(self, **kwargs):
+        return FrameLoader('train', source_dir=self.source_dir, data_files_dir=self.tmp_dir.name, num_workers=2, **kwargs)
+
+    def test_batches_cover_the_stage_once_per_epoch(self):
+        loader = self.get_loader(batch_size=4, shuffle=False, prefetch=1)
+        self.assertEqual(len(loader), 3)
+        batches = list(loader)
+        self.assertEqual([len(images) for images, _ in batches], [4, 4, 2])
+        self.assertEqual(batches[0][0].shape, (4, 32, 48, 3))
+        self.assertEqual(batches[0][1].tolist(), ['Common', 'Rare', 'Common', 'Rare'])
+        self.assertEqual(loader.num_images, 10)
+        self.assertGreater(loader.images_per_sec, 0)
+
+    def test_shuffle_is_reproducible_with_a_seed(self):
+        def first_pixels(loader):
+            return [int(images[i, 0, 0, 0]) for images, _ in loader for i in range(len(images))]
+        loader = self.get_loader(batch_size=3, seed=7)
+        other_loader = self.get_loader(batch_size=3, seed=7)
+        epoch_0 = first_pixels(loader)
+        self.assertEqual(epoch_0, first_pixels(other_loader))
+        self.assertNotEqual(epoch_0, first_pixels(loader))
+        self.assertEqual(sorted(epoch_0), sorted(first_pixels(loader)))
+
+    def test_draft_size_and_early_stop(self):
+        loader = self.get_loader(batch_size=2, draft_size=(24, 16), drop_last=True, prefetch=1)
+        for images, labels in loader:
+            self.assertEqual(images.shape, (2, 16, 24, 3))
+            break
+        self.assertEqual(loader.num_images, 2)
+
+if __name__ == '__main__':
+    unittest.main()
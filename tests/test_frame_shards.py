@@ -0,0 +1,66 @@
+# call from project directory
+# python -m unittest tests/test_frame_shards.py
+
+import os
+import tarfile
+import tempfile
+import unittest
+
+from frame_shards import *
+
+class TestFrameShardsMethods(unittest.TestCase):
+
+    def test_pack_and_read_stage_shards(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "src")
+            shards_dir = os.path.join(tmp_dir, "shards")
+            os.makedirs(source_dir)
+            frames = {}
+            for i in range(5):
+                file_name = f"TT_S01_E01_FRM-00-00-00-0{i}.jpg"
+                frames[file_name] = bytes([i]) * (600 + i)
+                with open(os.path.join(source_dir, file_name), "wb") as f:
+                    f.write(frames[file_name])
+            stage_data_file = os.path.join(tmp_dir, "train_data.csv")
+            with open(stage_data_file, "w") as f:
+                for i, file_name in enumerate(sorted(frames)):
+                    f.write(f"{file_name},{'Rare' if i % 2 else 'Common'}\n")
+                f.write("TT_S01_E01_FRM-00-00-00-99.jpg,Rare\n")
+
+            # shards of at most 1 MB hold all frames
+            shard_paths = pack_stage_shards('train', stage_data_file, source_dir, shards_dir, shard_mb=1)
+            self.assertEqual([os.path.basename(path) for path in shard_paths], ['train-00000.tar'])
+
+            read_frames = {file_name: (label, data) for file_name, label, data in read_shard_frames(shard_paths[0])}
+            self.assertEqual(len(read_frames), 5)
+            for file_name, data in frames.items():
+                self.assertEqual(read_frames[file_name][1], data)
+            self.assertEqual(read_frames["TT_S01_E01_FRM-00-00-00-01.jpg"][0], 'Rare')
+
+            # shards are valid tar files
+            with tarfile.open(shard_paths[0]) as tar:
+                self.assertEqual(sorted(tar.getnames()), sorted(frames))
+
+    def test_find_stage_shard_paths(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ["train-00001.tar", "train-00000.tar", "test-00000.tar", "train-00000.index.csv"]:
+                open(os.path.join(tmp_dir, name), "w").close()
+            paths = find_stage_shard_paths(tmp_dir, 'train')
+            self.assertEqual([os.path.basename(path) for path in paths], ["train-00000.tar", "train-00001.tar"])
+
+    def test_find_changed_shard_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for file_name in ["train-00000.tar", "train-00001.tar"]:
+                with open(os.path.join(tmp_dir, file_name), "w") as f:
+                    f.write(file_name)
+            file_etags = {"train-00000.tar": '"a"', "train-00001.tar": '"b2"', "train-00002.tar": '"c"'}
+            local_file_etags = {"train-00000.tar": '"a"', "train-00001.tar": '"b1"'}
+            changed_files = find_changed_shard_files(tmp_dir, file_etags, local_file_etags)
+            # a repacked shard is changed, a missing shard is left to the sync
+            self.assertEqual(changed_files, [os.path.join(tmp_dir, "train-00001.tar")])
+            # files downloaded without a recorded ETag are downloaded again
+            self.assertEqual(len(find_changed_shard_files(tmp_dir, file_etags, {})), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# call from project directory
+# python -m unittest tests/test_frame_stats.py
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from frame_stats import *
+
+class TestFrameStatsMethods(unittest.TestCase):
+
+    def test_write_frame_stats_of_an_episode(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "src")
+            os.makedirs(source_dir)
+            with open(os.path.join(tmp_dir, "train_data.csv"), "w") as f:
+                for i, file_name in enumerate(["TT_S01_E01_FRM-00-00-00-00.jpg", "TT_S01_E01_FRM-00-00-00-01.jpg", "TT_S01_E02_FRM-00-00-00-00.jpg"]):
+                    Image.fromarray(np.full((8, 8, 3), 50 * i, dtype=np.uint8)).save(os.path.join(source_dir, file_name), format="PNG")
+                    f.write(f"{file_name},Common\n")
+                f.write("TT_S01_E01_FRM-00-00-00-02.jpg,Rare\n")
+                f.write("TT_S01_E01_FRM-bad.jpg,Rare\n")
+
+            with self.assertLogs("frame_stats", level="WARNING") as logs:
+                stats_file = write_frame_stats(episode_id="S01E01", source_dir=source_dir, max_workers=1, data_files_dir=tmp_dir)
+            self.assertIn("1 rows with a malformed file_name dropped", logs.output[0])
+            self.assertEqual(os.path.basename(stats_file), "S01E01_frame_stats.parquet")
+            df = pd.read_parquet(stats_file)
+            self.assertEqual(list(df.columns), FRAME_STATS_COLUMNS)
+            self.assertEqual(df['file_name'].tolist(), ["TT_S01_E01_FRM-00-00-00-00.jpg", "TT_S01_E01_FRM-00-00-00-01.jpg"])
+            self.assertEqual(df['episode_id'].tolist(), ["S01E01", "S01E01"])
+            self.assertEqual(df['mean'].tolist(), [0.0, 50.0])
+            self.assertEqual(int(df['hist'][1][50]), 8 * 8 * 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# call from project directory
+# python -m unittest tests/test_image_stats.py
+
+import unittest
+
+import numpy as np
+import scipy.stats as stats
+
+from plot_hist_lib.image_stats import *
+
+class TestImageStatsMethods(unittest.TestCase):
+
+    def test_histogram_moments_match_numpy(self):
+        frame = np.random.default_rng(0).integers(3, 250, size=(36, 64, 3), dtype=np.uint8)
+        hist = computeImageHistogram(frame)
+        self.assertEqual(hist.shape, (HIST_BINS,))
+        self.assertEqual(hist.sum(), frame.size)
+
+        moments = computeHistogramMoments(hist)
+        self.assertAlmostEqual(moments['mean'], np.mean(frame))
+        self.assertAlmostEqual(moments['std'], np.std(frame))
+        self.assertEqual(moments['min'], np.min(frame))
+        self.assertEqual(moments['max'], np.max(frame))
+        self.assertAlmostEqual(moments['skew'], stats.skew(frame.reshape(-1)))
+        self.assertAlmostEqual(moments['kurtosis'], stats.kurtosis(frame.reshape(-1)))
+
+    def test_constant_frame(self):
+        moments = computeHistogramMoments(computeImageHistogram(np.full((4, 4), 7, dtype=np.uint8)))
+        self.assertEqual((moments['mean'], moments['std'], moments['min'], moments['max']), (7.0, 0.0, 7, 7))
+
+    def test_non_uint8_frame_is_rejected(self):
+        with self.assertRaises(ValueError):
+            computeImageHistogram(np.zeros((4, 4), dtype=np.float32))
+
+    def test_image_stats_match_the_standardized_thresholded_values(self):
+        frame = np.random.default_rng(1).integers(0, 256, size=(72, 128, 3), dtype=np.uint8)
+        image_stats = computeImageStats(frame, min_threshold=0.1, max_threshold=0.9, bins=25)
+
+        data = (frame.reshape(-1) - np.mean(frame)) / np.std(frame)
+        data = data[(data > 0.1) & (data < 0.9)]
+        counts, edges = np.histogram(data, bins=25)
+        self.assertEqual(image_stats['threshold_num_values'], len(data))
+        self.assertEqual(image_stats['threshold_counts'].tolist(), counts.tolist())
+        self.assertTrue(np.allclose(image_stats['threshold_edges'], edges))
+        mu, std = stats.norm.fit(data)
+        self.assertAlmostEqual(image_stats['threshold_mean'], mu)
+        self.assertAlmostEqual(image_stats['threshold_std'], std)
+
+    def test_histogram_is_counted_in_chunks(self):
+        frame = np.random.default_rng(2).integers(0, 256, size=HIST_CHUNK_VALUES + 1001, dtype=np.uint8)
+        self.assertEqual(computeImageHistogram(frame).tolist(), np.bincount(frame, minlength=HIST_BINS).tolist())
+
+if __name__ == '__main__':
+    unittest.main()
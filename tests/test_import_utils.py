@@ -0,0 +1,36 @@
+# call from project directory
+# python -m unittest tests/test_import_utils.py
+
+import subprocess
+import sys
+import unittest
+
+from import_utils import *
+
+class TestImportUtilsMethods(unittest.TestCase):
+
+    def run_fresh_python(self, code: str) -> subprocess.CompletedProcess:
+        # a fresh interpreter, so botocore is not already imported by another test
+        return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+
+    def test_lazy_import_binds_submodule_to_parent(self):
+        result = self.run_fresh_python(
+            "import sys\n"
+            "from import_utils import lazy_import\n"
+            "exceptions = lazy_import('botocore.exceptions')\n"
+            "assert sys.modules['botocore'].exceptions is exceptions\n")
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_s3_client_after_lazy_import_of_submodule(self):
+        # creating a client needs no network or credentials
+        result = self.run_fresh_python(
+            "from import_utils import lazy_import\n"
+            "boto3 = lazy_import('boto3')\n"
+            "botocore_exceptions = lazy_import('botocore.exceptions')\n"
+            "boto3.session.Session(region_name='us-east-1').client('s3')\n"
+            "assert issubclass(botocore_exceptions.ClientError, Exception)\n")
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
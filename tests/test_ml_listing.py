@@ -0,0 +1,44 @@
+# call from project directory
+# python -m unittest tests/test_ml_listing.py
+
+import unittest
+
+import pandas as pd
+
+from ml_listing import *
+from frame_id import encode_frame_ids
+
+class TestMLListingMethods(unittest.TestCase):
+
+    def get_test_keys(self):
+        return [
+            "tuttle_twins/ML/train/Common/TT_S01_E02_FRM-00-00-00-01.jpg",
+            "tuttle_twins/ML/test/Rare/TT_S01_E01_FRM-00-00-00-02.jpg",
+            "tuttle_twins/ML/train/Common/TT_S01_E01_FRM-00-00-00-01.jpg",
+            "tuttle_twins/ML/deleteme/test.jpg",
+        ]
+
+    def test_parse_ml_keys_df(self):
+        df = parse_ml_keys_df(self.get_test_keys())
+        self.assertEqual(list(df.columns), EPISODE_KEYS_COLUMNS)
+        self.assertEqual(len(df), 3)
+        self.assertEqual(df['episode_id'].tolist(), ["S01E01", "S01E01", "S01E02"])
+        self.assertEqual(df['ml_key'].tolist(), ["train/Common", "test/Rare", "train/Common"])
+
+    def test_snapshot_partitions_by_episode(self):
+        listing = MLListingSnapshot(self.get_test_keys())
+        self.assertEqual(listing.get_episode_ids(), ["S01E01", "S01E02"])
+        self.assertEqual(len(listing.get_episode_df("S01E01")), 2)
+        self.assertEqual(len(listing.get_episode_df("S01E03")), 0)
+
+    def test_snapshot_add_and_remove(self):
+        listing = MLListingSnapshot(self.get_test_keys())
+        frame_ids = encode_frame_ids(["TT_S01_E01_FRM-00-00-00-02", "TT_S01_E01_FRM-00-00-00-03"])
+        listing.remove_episode_keys("S01E01", pd.DataFrame({'frame_id': frame_ids[:1], 'ml_key': ["test/Rare"]}))
+        listing.add_episode_keys("S01E01", pd.DataFrame({'frame_id': frame_ids, 'ml_key': ["pred/Rare", "pred/Common"]}))
+        df = listing.get_episode_df("S01E01")
+        self.assertEqual(df['ml_key'].tolist(), ["train/Common", "pred/Rare", "pred/Common"])
+        self.assertEqual(listing.get_num_keys(), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# call from project directory
+# python -m unittest tests/test_ml_verify.py
+
+import unittest
+
+import pandas as pd
+
+from ml_verify import *
+from ml_listing import MLListingSnapshot
+from frame_id import encode_frame_ids
+
+class TestMLVerifyMethods(unittest.TestCase):
+
+    def get_expected_df(self):
+        img_frames = [f"TT_S01_E01_FRM-00-00-00-0{i}" for i in range(5)]
+        return pd.DataFrame({
+            'frame_id': encode_frame_ids(img_frames),
+            'ml_key': pd.Categorical(["train/Common", "test/Rare", "pred/Common", "train/Rare", None])})
+
+    def test_verify_episode_keys_equal(self):
+        listing = MLListingSnapshot([
+            "tuttle_twins/ML/train/Common/TT_S01_E01_FRM-00-00-00-00.jpg",
+            "tuttle_twins/ML/test/Rare/TT_S01_E01_FRM-00-00-00-01.jpg",
+            "tuttle_twins/ML/pred/Common/TT_S01_E01_FRM-00-00-00-02.jpg",
+            "tuttle_twins/ML/train/Rare/TT_S01_E01_FRM-00-00-00-03.jpg"])
+        result = verify_episode_keys("S01E01", self.get_expected_df(), listing.get_episode_df("S01E01"))
+        self.assertEqual(result['status'], 0)
+        self.assertEqual((result['num_expected'], result['num_actual']), (4, 4))
+        self.assertEqual((result['num_missing'], result['num_misplaced'], result['num_extra']), (0, 0, 0))
+
+    def test_verify_episode_keys_mismatches(self):
+        listing = MLListingSnapshot([
+            "tuttle_twins/ML/train/Common/TT_S01_E01_FRM-00-00-00-00.jpg",
+            # an extra copy of a frame that is also at its expected ml_key
+            "tuttle_twins/ML/pred/Rare/TT_S01_E01_FRM-00-00-00-00.jpg",
+            # misplaced
+            "tuttle_twins/ML/train/Rare/TT_S01_E01_FRM-00-00-00-01.jpg",
+            # frame 02 is missing, frame 03 is correct
+            "tuttle_twins/ML/train/Rare/TT_S01_E01_FRM-00-00-00-03.jpg",
+            # frame 04 has no ml_key and frame 05 is not expected
+            "tuttle_twins/ML/test/Rare/TT_S01_E01_FRM-00-00-00-04.jpg",
+            "tuttle_twins/ML/test/Rare/TT_S01_E01_FRM-00-00-00-05.jpg"])
+        result = verify_episode_keys("S01E01", self.get_expected_df(), listing.get_episode_df("S01E01"))
+        self.assertEqual(result['status'], 1)
+        self.assertEqual(result['missing'], ["pred/Common/TT_S01_E01_FRM-00-00-00-02"])
+        self.assertEqual(result['misplaced'], ["train/Rare/TT_S01_E01_FRM-00-00-00-01 not test/Rare/TT_S01_E01_FRM-00-00-00-01"])
+        self.assertEqual(result['extra'], [
+            "pred/Rare/TT_S01_E01_FRM-00-00-00-00",
+            "test/Rare/TT_S01_E01_FRM-00-00-00-04",
+            "test/Rare/TT_S01_E01_FRM-00-00-00-05"])
+        self.assertEqual((result['num_missing'], result['num_misplaced'], result['num_extra']), (1, 1, 3))
+
+    def test_verify_episode_keys_empty(self):
+        empty_df = pd.DataFrame({'frame_id': pd.Series([], dtype='int64'), 'ml_key': pd.Series([], dtype=object)})
+        result = verify_episode_keys("S01E01", empty_df, empty_df)
+        self.assertEqual(result['status'], 0)
+        result = verify_episode_keys("S01E01", self.get_expected_df(), empty_df)
+        self.assertEqual((result['status'], result['num_missing']), (1, 4))
+
+    def test_verify_episode_mappings_status(self):
+        listing = MLListingSnapshot([
+            "tuttle_twins/ML/train/Common/TT_S01_E01_FRM-00-00-00-00.jpg",
+            "tuttle_twins/ML/test/Rare/TT_S01_E02_FRM-00-00-00-00.jpg"])
+        frame_ids = encode_frame_ids(["TT_S01_E01_FRM-00-00-00-00", "TT_S01_E02_FRM-00-00-00-00"])
+        mappings = {
+            "S01E01": pd.DataFrame({'frame_id': frame_ids[:1], 'ml_key': ["train/Common"]}),
+            "S01E02": pd.DataFrame({'frame_id': frame_ids[1:], 'ml_key': ["test/Rare"]})}
+        self.assertEqual(get_verify_status(verify_episode_mappings(mappings, listing=listing)), 0)
+        mappings["S01E02"]['ml_key'] = ["pred/Rare"]
+        results = verify_episode_mappings(mappings, listing=listing)
+        self.assertEqual(results["S01E02"]['num_misplaced'], 1)
+        self.assertEqual(get_verify_status(results), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+# call from project directory
+# python -m unittest tests/test_profile_utils.py
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from profile_utils import *
+
+class TestProfileUtilsMethods(unittest.TestCase):
+
+    def test_run_profiler_writes_to_output_dir(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = os.path.join(tmp_dir, "profiles")
+            with run_profiler(mode="both", name="test", output_dir=output_dir):
+                with profile_phase("phase"):
+                    sum(range(1000))
+            profile_files = sorted(os.listdir(output_dir))
+            self.assertEqual(len(profile_files), 3)
+            self.assertTrue(profile_files[0].endswith(".pstats"))
+
+    def test_run_profiler_without_data_files_dir(self):
+        # fails before the profiled code runs
+        ran = []
+        with mock.patch("env.LOCAL_DATA_FILES_DIR", None):
+            with self.assertRaisesRegex(AssertionError, "LOCAL_DATA_FILES_DIR not found"):
+                with run_profiler(mode="cpu", name="test"):
+                    ran.append(True)
+        self.assertEqual(ran, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
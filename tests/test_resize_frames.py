@@ -0,0 +1,46 @@
+# call from project directory
+# python -m unittest tests/test_resize_frames.py
+
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from resize_frames import *
+
+class TestResizeFramesMethods(unittest.TestCase):
+
+    def test_resize_jpg_bytes(self):
+        buffer = io.BytesIO()
+        Image.fromarray(np.full((360, 640, 3), 128, dtype=np.uint8)).save(buffer, format="JPEG")
+        resized = resize_jpg_bytes(buffer.getvalue(), (160, 90), quality=80)
+        with Image.open(io.BytesIO(resized)) as img:
+            self.assertEqual(img.format, "JPEG")
+            self.assertEqual(img.size, (160, 90))
+            self.assertTrue(abs(int(np.asarray(img)[45, 80, 0]) - 128) <= 2)
+
+    def test_local_resize_resumes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for file_name in ["a.jpg", "b.jpg"]:
+                Image.fromarray(np.full((36, 64, 3), 128, dtype=np.uint8)).save(os.path.join(tmp_dir, file_name), format="JPEG")
+            dst_dir = os.path.join(tmp_dir, "small")
+            os.makedirs(dst_dir)
+            # the partial jpg of an interrupted run
+            with open(os.path.join(dst_dir, "b.jpg.tmp"), "wb") as f:
+                f.write(b"partial")
+
+            kwargs = dict(dst_size="small", width=16, height=9, file_names=["a.jpg", "b.jpg", "missing.jpg"],
+                max_workers=1, max_io_workers=2, local_source_images_dir=tmp_dir)
+            result = resize_frames(**kwargs)
+            self.assertEqual((result['num_skipped'], result['num_resized'], result['num_failed']), (0, 2, 1))
+            result = resize_frames(**kwargs)
+            self.assertEqual((result['num_skipped'], result['num_resized'], result['num_failed']), (2, 0, 1))
+            self.assertEqual(sorted(os.listdir(dst_dir)), ["a.jpg", "b.jpg"])
+            with Image.open(os.path.join(dst_dir, "b.jpg")) as img:
+                self.assertEqual(img.size, (16, 9))
+
+if __name__ == '__main__':
+    unittest.main()
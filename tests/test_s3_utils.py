@@ -1,7 +1,11 @@
 # call from project directory
 # python -m unittest tests/test_s3_utils
 
+import os
+import tempfile
+import threading
 import unittest
+from unittest import mock
 
 from s3_utils import *
 from file_utils import generate_big_random_bin_file, compare_big_bin_files
@@ -12,7 +16,52 @@ logger = logging.getLogger("test_s3_utils")
 
 class TestS3UtilMethods(unittest.TestCase):
     
+    def test_get_s3_client_is_thread_local(self):
+        s3_client = get_s3_client()
+        self.assertIs(get_s3_client(), s3_client)
+        self.assertEqual(s3_client.meta.region_name, AWS_REGION)
+        self.assertEqual(s3_client.meta.config.max_pool_connections, S3_MAX_POOL_CONNECTIONS)
+        self.assertEqual(s3_client.meta.config.retries['mode'], 'adaptive')
+
+        thread_s3_clients = []
+        thread = threading.Thread(target=lambda: thread_s3_clients.append(get_s3_client()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(thread_s3_clients[0], s3_client)
         
+    def test_get_s3_config_warns_once_without_tcp_keepalive(self):
+        config = mock.Mock()
+        config.Config.OPTION_DEFAULTS = {}
+        with mock.patch("s3_utils.botocore_config", config), mock.patch("s3_utils._tcp_keepalive_warned", False):
+            with self.assertLogs("s3_utils", level="WARNING") as logs:
+                get_s3_config()
+                get_s3_config()
+            self.assertEqual(len(logs.output), 1)
+            self.assertIn("tcp keep-alive is unavailable", logs.output[0])
+            self.assertNotIn('tcp_keepalive', config.Config.call_args.kwargs)
+
+    def test_s3_sync_download_folders_continues_after_a_failure(self):
+        def download_file(bucket, key, dst_file):
+            if key.endswith("bad.jpg"):
+                raise IOError("connection reset")
+            with open(dst_file, "wb") as f:
+                f.write(b"ok")
+        s3_client = mock.Mock()
+        s3_client.download_file.side_effect = download_file
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch("s3_utils.get_s3_client", return_value=s3_client):
+            folder_a = os.path.join(tmp_dir, "a")
+            folder_b = os.path.join(tmp_dir, "b")
+            os.makedirs(folder_b)
+            with open(os.path.join(folder_b, "unused.jpg"), "wb") as f:
+                f.write(b"old")
+            results = s3_sync_download_folders("bucket", {
+                folder_a: ["k/f1.jpg", "k/bad.jpg", "k/f2.jpg"],
+                folder_b: ["k/f3.jpg"]}, max_workers=2)
+            self.assertEqual(results[folder_a], {"num_downloaded": 2, "num_removed": 0, "num_failed": 1, "failed": ["k/bad.jpg"]})
+            self.assertEqual(results[folder_b], {"num_downloaded": 1, "num_removed": 1, "num_failed": 0, "failed": []})
+            self.assertEqual(sorted(os.listdir(folder_a)), ["f1.jpg", "f2.jpg"])
+            self.assertEqual(os.listdir(folder_b), ["f3.jpg"])
+
     def test_s3_copy_file(self):
         '''
         "src_url": "s3://media.angel-nft.com/tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/TT_S01_E01_FRM-00-00-00-03.jpg", 
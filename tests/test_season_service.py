@@ -1,9 +1,15 @@
 # call from project directory
 # python -m unittest tests/test_season_service.py
 
+import datetime
+import io
+import tempfile
 import unittest
+from unittest import mock
 
 from season_service import *
+from storage import S3Storage, LocalStorage, get_storage, set_storage
+from s3_utils import botocore_exceptions
 
 class TestSeasonServiceMethods(unittest.TestCase):
 
@@ -19,5 +25,60 @@ class TestSeasonServiceMethods(unittest.TestCase):
         all_season_episodes = download_all_seasons_episodes()
         self.assertTrue(len(all_season_episodes) > 0, "ERROR: no all_season_episodes found")
 
+    def get_fake_s3_client(self, manifest_bytes: bytes):
+        # one manifest key listed, and a get_object that answers 304 to a matching If-None-Match
+        s3_client = mock.Mock()
+        s3_client.get_paginator.return_value.paginate.return_value = [{"Contents": [{
+            'LastModified': datetime.datetime(2022, 5, 3, tzinfo=datetime.timezone.utc),
+            'Size': len(manifest_bytes),
+            'Key': "tuttle_twins/manifests/S01-episodes.json"}]}]
+        def get_object(**kwargs):
+            if kwargs.get('IfNoneMatch') == '"etag1"':
+                raise botocore_exceptions.ClientError({'Error': {'Code': '304'}}, 'GetObject')
+            return {'Body': io.BytesIO(manifest_bytes), 'ETag': '"etag1"'}
+        s3_client.get_object.side_effect = get_object
+        return s3_client
+
+    def test_download_all_seasons_episodes_is_memoized(self):
+        with open("manifests/S01-episodes.json", "rb") as f:
+            s3_client = self.get_fake_s3_client(f.read())
+        old_storage = get_storage()
+        clear_season_manifest_cache()
+        try:
+            set_storage(S3Storage())
+            with mock.patch("storage.get_s3_client", return_value=s3_client), \
+                    mock.patch("s3_utils.get_s3_client", return_value=s3_client):
+                first_episodes = download_all_seasons_episodes()
+                self.assertEqual(s3_client.get_object.call_count, 1)
+                second_episodes = download_all_seasons_episodes()
+                # memoized, so no get_object request
+                self.assertEqual(s3_client.get_object.call_count, 1)
+                refreshed_episodes = download_all_seasons_episodes(refresh=True)
+                self.assertEqual(s3_client.get_object.call_count, 2)
+                self.assertEqual(s3_client.get_object.call_args.kwargs.get('IfNoneMatch'), '"etag1"')
+        finally:
+            set_storage(old_storage)
+            clear_season_manifest_cache()
+        expected = [episode.get_episode_id() for episode in first_episodes]
+        self.assertEqual(expected, ["S01E01", "S01E02"])
+        self.assertEqual([episode.get_episode_id() for episode in second_episodes], expected, "ERROR: memoized episodes differ")
+        self.assertEqual([episode.get_episode_id() for episode in refreshed_episodes], expected)
+
+    def test_download_season_episodes_missing_manifest(self):
+        old_storage = get_storage()
+        clear_season_manifest_cache()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                set_storage(LocalStorage(tmp_dir))
+                self.assertEqual(download_season_episodes("tuttle_twins/manifests/S09-episodes.json"), [])
+        finally:
+            set_storage(old_storage)
+
+    def test_parse_season_episodes(self):
+        with open("manifests/S01-episodes.json", "rb") as f:
+            episodes = parse_season_episodes(f.read())
+        result = [episode.get_episode_id() for episode in episodes]
+        self.assertEqual(result, ["S01E01", "S01E02"])
+
 if __name__ == "__main__":
      unittest.main()
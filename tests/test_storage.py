@@ -0,0 +1,93 @@
+# call from project directory
+# python -m unittest tests/test_storage.py
+
+import os
+import tempfile
+import unittest
+
+from storage import *
+
+BUCKET = "bucket"
+
+class TestStorageMethods(unittest.TestCase):
+
+    def test_local_storage_put_get_list(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = LocalStorage(tmp_dir)
+            storage.put_bytes(BUCKET, "a/b/f1.jpg", b"one")
+            storage.put_bytes(BUCKET, "a/c/f2.jpg", b"two")
+            storage.put_bytes(BUCKET, "x/f3.jpg", b"three")
+
+            self.assertEqual(storage.get_bytes(BUCKET, "a/b/f1.jpg"), b"one")
+            self.assertEqual(storage.list_keys(BUCKET, "a"), ["a/b/f1.jpg", "a/c/f2.jpg"])
+            self.assertEqual(storage.list_keys(BUCKET, "a/"), ["a/b/f1.jpg", "a/c/f2.jpg"])
+            self.assertEqual(storage.list_keys(BUCKET, "missing"), [])
+
+            s3_keys = storage.list_objects(BUCKET, "x")
+            self.assertEqual([s3_key.key for s3_key in s3_keys], ["x/f3.jpg"])
+            self.assertEqual(s3_keys[0].size, "5")
+
+    def test_local_storage_copy_is_a_hardlink(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = LocalStorage(tmp_dir)
+            storage.put_bytes(BUCKET, "src/f1.jpg", b"one")
+            copied = storage.copy_many(BUCKET, ["src/f1.jpg", "src/missing.jpg"], BUCKET, ["ml/f1.jpg", "ml/missing.jpg"])
+            self.assertEqual(copied, ["ml/f1.jpg"])
+
+            self.assertEqual(storage.list_keys(BUCKET, "ml"), ["ml/f1.jpg"])
+            src_path = storage.get_path(BUCKET, "src/f1.jpg")
+            dst_path = storage.get_path(BUCKET, "ml/f1.jpg")
+            self.assertTrue(os.path.samefile(src_path, dst_path))
+
+            # a put replaces the src file and leaves the copy unchanged
+            storage.put_bytes(BUCKET, "src/f1.jpg", b"new")
+            self.assertEqual(storage.get_bytes(BUCKET, "ml/f1.jpg"), b"one")
+
+    def test_local_storage_copy_onto_itself(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = LocalStorage(tmp_dir)
+            storage.put_bytes(BUCKET, "f1.jpg", b"one")
+            self.assertTrue(storage.copy(BUCKET, "f1.jpg", BUCKET, "f1.jpg"))
+            self.assertEqual(storage.get_bytes(BUCKET, "f1.jpg"), b"one")
+            # keys directly under the bucket have no "./" prefix
+            self.assertEqual(storage.list_keys(BUCKET, ""), ["f1.jpg"])
+
+    def test_local_storage_get_bytes_etag(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = LocalStorage(tmp_dir)
+            storage.put_bytes(BUCKET, "m/S01-episodes.json", b"[]")
+            body, etag = storage.get_bytes_etag(BUCKET, "m/S01-episodes.json")
+            self.assertEqual(body, b"[]")
+            self.assertEqual(storage.get_bytes_etag(BUCKET, "m/S01-episodes.json", if_none_match=etag), (None, etag))
+            storage.put_bytes(BUCKET, "m/S01-episodes.json", b"[{}]")
+            body, _ = storage.get_bytes_etag(BUCKET, "m/S01-episodes.json", if_none_match=etag)
+            self.assertEqual(body, b"[{}]")
+
+    def test_local_storage_batch_delete(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = LocalStorage(tmp_dir)
+            storage.put_bytes(BUCKET, "ml/f1.jpg", b"one")
+            storage.put_bytes(BUCKET, "ml/f2.jpg", b"two")
+            storage.batch_delete(BUCKET, ["ml/f1.jpg", "ml/missing.jpg"])
+            self.assertEqual(storage.list_keys(BUCKET, "ml"), ["ml/f2.jpg"])
+
+    def test_incomplete_storage_is_not_instantiable(self):
+        class ReadOnlyStorage(Storage):
+            def list_keys(self, bucket: str, dir: str):
+                return []
+        with self.assertRaises(TypeError):
+            ReadOnlyStorage()
+
+    def test_set_storage(self):
+        old_storage = get_storage()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                local_storage = LocalStorage(tmp_dir)
+                set_storage(local_storage)
+                self.assertIs(get_storage(), local_storage)
+        finally:
+            set_storage(old_storage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+# call from project directory
+# python -m unittest tests/test_sync_s3_image_files.py
+
+import unittest
+
+from sync_s3_image_files import *
+
+class TestSyncS3ImageFilesMethods(unittest.TestCase):
+
+    def test_build_src_keys(self):
+        file_names = ["TT_S01_E01_FRM-00-00-00-00.jpg", "TT_S02_E13_FRM-00-19-16-19.jpg"]
+        self.assertEqual(build_src_keys(file_names), [
+            "tuttle_twins/s01e01/default_eng/v1/frames/thumbnails/TT_S01_E01_FRM-00-00-00-00.jpg",
+            "tuttle_twins/s02e13/default_eng/v1/frames/thumbnails/TT_S02_E13_FRM-00-19-16-19.jpg"])
+        self.assertEqual(build_src_keys(file_names[:1], "large"), [
+            "tuttle_twins/s01e01/default_eng/v1/frames/large/TT_S01_E01_FRM-00-00-00-00.jpg"])
+        self.assertEqual(build_src_keys([]), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# call from project directory
+# python -m unittest tests/test_watch_service.py
+
+import json
+import unittest
+import urllib.request
+from unittest import mock
+
+from watch_service import *
+
+class TestWatchServiceMethods(unittest.TestCase):
+
+    def test_find_changed_episode_ids(self):
+        previous = {
+            "S01E01": ("e1", "10"),
+            "S01E02": ("e2", "20"),
+            "S01E03": ("e3", "30"),
+        }
+        current = {
+            "S01E01": ("e1", "10"),
+            "S01E02": ("e2", "21"),
+            "S01E03": ("e3-renamed", "30"),
+            "S01E04": ("e4", "40"),
+        }
+        self.assertEqual(find_changed_episode_ids(previous, current), ["S01E02", "S01E03", "S01E04"])
+        self.assertEqual(find_changed_episode_ids(current, current), [])
+
+    def test_find_episode_states_keeps_state_of_failed_lookup(self):
+        with open("manifests/S01-episodes.json", "rb") as f:
+            episodes = [Episode(episode_dict) for episode_dict in json.load(f)]
+        watcher = EpisodeWatcher()
+        watcher.episode_states = {"S01E01": ("e1", "10")}
+        with mock.patch("watch_service.find_google_sheet_version", side_effect=Exception("version lookup failed")):
+            episode_states = watcher.find_episode_states(episodes)
+        # S01E01 is unchanged and S01E02, which has no previous state, is retried
+        self.assertEqual(episode_states, {"S01E01": ("e1", "10")})
+        self.assertEqual(watcher.metrics.as_dict()["episode_errors_total"], 2)
+
+    def test_metrics_as_prometheus_text(self):
+        metrics = WatchMetrics()
+        metrics.increment("episodes_processed_total", 3)
+        text = metrics.as_prometheus_text()
+        self.assertIn("# TYPE tuttle_watch_episodes_processed_total counter\n", text)
+        self.assertIn("tuttle_watch_episodes_processed_total 3\n", text)
+        self.assertIn("# TYPE tuttle_watch_episodes_watched gauge\n", text)
+
+    def test_health_server(self):
+        watcher = EpisodeWatcher(interval_seconds=60)
+        server = start_health_server(watcher, port=0)
+        try:
+            base_url = f"http://127.0.0.1:{server.server_address[1]}"
+            with urllib.request.urlopen(base_url + "/health") as response:
+                self.assertEqual(response.status, 200)
+                self.assertEqual(json.loads(response.read())["status"], "ok")
+            with urllib.request.urlopen(base_url + "/metrics") as response:
+                self.assertIn(b"tuttle_watch_ticks_total 0", response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,387 @@
+import argparse
+import json
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+from episode import Episode
+from episode_service import process_episode, find_google_sheet_version, find_sampled_google_episode_keys_df
+from season_service import download_all_seasons_episodes
+from ml_listing import MLListingSnapshot
+from episode_delta import FULL_RECONCILE_SECONDS, process_episode_delta
+from dataset_manifest import DATASET_MANIFEST_FORMATS, find_episode_manifest_df, split_stage_manifest_dfs, publish_dataset_manifests
+
+import logging
+logging.basicConfig(level = logging.INFO)
+logger = logging.getLogger("watch_service")
+
+# ============================================
+# watch_service MODULE OVERVIEW
+#
+# usage:
+#     python watch_service.py [--interval 300] [--port 8089]
+#
+# a long-running alternative to the cron job that cold-starts python
+# and reprocesses every episode on each tick. The watcher keeps the
+# boto3 and gspread clients, the memoized season manifests and the
+# MLListingSnapshot of the ML tree in memory, and on each tick:
+#   1. re-validates the season manifests with ETag conditional GETs
+#   2. reads the google drive version of each episode spreadsheet
+#   3. runs process_episode only for episodes that are new, whose
+#      manifest entry changed or whose spreadsheet version changed
+# The listing is re-read from s3 every listing_refresh_seconds to pick
+# up changes made outside of the watcher.
+# In virtual mode nothing is copied into tuttle_twins/ML. The watcher
+# keeps each episode's dataset manifest rows in memory, re-reads only
+# the changed episodes and republishes the per-stage manifests once.
+# In delta mode a changed episode is processed with process_episode_delta,
+# which only touches the frames whose classification changed.
+#
+# SIGTERM and SIGINT stop the watcher after the current episode.
+# GET /health and GET /metrics are served on localhost:<port>.
+
+WATCH_INTERVAL_SECONDS = 300
+LISTING_REFRESH_SECONDS = 3600
+HEALTH_PORT = 8089
+
+# a tick that hasn't succeeded for this many intervals is unhealthy
+MAX_MISSED_INTERVALS = 3
+
+# episode_id -> (episode manifest entry, spreadsheet version)
+EpisodeState = Tuple[str, str]
+
+
+def find_changed_episode_ids(previous: Dict[str, EpisodeState], current: Dict[str, EpisodeState]) -> List[str]:
+    '''
+    Return the sorted episode_ids of current that are new
+    or whose manifest entry or spreadsheet version has changed
+    '''
+    return sorted(episode_id for episode_id, state in current.items() if previous.get(episode_id) != state)
+
+
+class WatchMetrics:
+    '''
+    Thread-safe counters and gauges of the watcher
+    read by the health server
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.values = {
+            "ticks_total": 0,
+            "tick_errors_total": 0,
+            "episodes_processed_total": 0,
+            "episode_errors_total": 0,
+            "episodes_watched": 0,
+            "ml_listing_keys": 0,
+            "last_tick_seconds": 0.0,
+            "last_success_timestamp": 0.0,
+            "ml_listing_timestamp": 0.0,
+        }
+
+    def increment(self, name: str, amount: int=1) -> None:
+        with self.lock:
+            self.values[name] += amount
+
+    def set(self, name: str, value) -> None:
+        with self.lock:
+            self.values[name] = value
+
+    def as_dict(self) -> Dict[str, float]:
+        with self.lock:
+            values = dict(self.values)
+        values["uptime_seconds"] = time.time() - self.start_time
+        return values
+
+    def is_healthy(self, interval_seconds: float) -> bool:
+        '''
+        healthy until the first tick is overdue and
+        then only if a tick has succeeded recently
+        '''
+        values = self.as_dict()
+        last_ok = values["last_success_timestamp"] or self.start_time
+        return time.time() - last_ok <= MAX_MISSED_INTERVALS * interval_seconds + values["last_tick_seconds"]
+
+    def as_prometheus_text(self) -> str:
+        '''
+        Return the metrics in the prometheus text exposition format
+        e.g. "tuttle_watch_ticks_total 12"
+        '''
+        lines = []
+        for name, value in self.as_dict().items():
+            metric_type = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE tuttle_watch_{name} {metric_type}")
+            lines.append(f"tuttle_watch_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class EpisodeWatcher:
+    '''
+    Polls the season manifests and episode spreadsheets and
+    processes only the episodes that changed since the last tick
+    '''
+    interval_seconds: float
+    listing_refresh_seconds: float
+    episode_states: Dict[str, EpisodeState]
+    listing: MLListingSnapshot
+
+    def __init__(self, interval_seconds: float=WATCH_INTERVAL_SECONDS, listing_refresh_seconds: float=LISTING_REFRESH_SECONDS, virtual: bool=False, manifest_format: str='csv', delta: bool=False, full_reconcile_seconds: float=FULL_RECONCILE_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.listing_refresh_seconds = listing_refresh_seconds
+        self.virtual = virtual
+        self.manifest_format = manifest_format
+        self.delta = delta
+        self.full_reconcile_seconds = full_reconcile_seconds
+        self.episode_states = {}
+        # episode_id -> dataset manifest rows, in virtual mode only
+        self.episode_manifest_dfs = {}
+        self.listing = None
+        self.listing_time = 0.0
+        self.metrics = WatchMetrics()
+        self.stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def is_stopping(self) -> bool:
+        return self.stop_event.is_set()
+
+    def get_listing(self) -> MLListingSnapshot:
+        '''
+        Return the ML listing snapshot, re-reading it from s3
+        if it is older than listing_refresh_seconds
+        '''
+        if self.listing is None or time.time() - self.listing_time > self.listing_refresh_seconds:
+            self.listing = MLListingSnapshot.from_s3()
+            self.listing_time = time.time()
+            self.metrics.set("ml_listing_timestamp", self.listing_time)
+        return self.listing
+
+    def find_episode_states(self, episodes: List[Episode]) -> Dict[str, EpisodeState]:
+        '''
+        Return the current state of each episode. An episode whose
+        spreadsheet version can't be read keeps its previous state, or
+        is left out if it has none, so it is retried on the next tick
+        '''
+        episode_states = {}
+        for episode in episodes:
+            episode_id = episode.get_episode_id()
+            try:
+                episode_states[episode_id] = (episode.as_str(), find_google_sheet_version(episode))
+            except Exception as exp:
+                logger.error(f"episode_id: {episode_id} version lookup failed {type(exp)} {str(exp)}")
+                self.metrics.increment("episode_errors_total")
+                if episode_id in self.episode_states:
+                    episode_states[episode_id] = self.episode_states[episode_id]
+        return episode_states
+
+    def tick(self) -> List[str]:
+        '''
+        Process all changed episodes and return their episode_ids.
+        An episode that fails keeps its previous state so it is
+        retried on the next tick.
+        '''
+        episodes = download_all_seasons_episodes(refresh=True)
+        episode_states = self.find_episode_states(episodes)
+        changed_episode_ids = find_changed_episode_ids(self.episode_states, episode_states)
+        self.metrics.set("episodes_watched", len(episode_states))
+
+        # forget episodes that were removed from the manifests
+        removed_episode_ids = set(self.episode_states) - set(episode_states)
+        for episode_id in removed_episode_ids:
+            del self.episode_states[episode_id]
+            self.episode_manifest_dfs.pop(episode_id, None)
+
+        if len(changed_episode_ids) == 0 and not (self.virtual and len(removed_episode_ids) > 0):
+            logger.debug("tick() no changed episodes")
+            return []
+
+        logger.info(f"tick() changed episodes: {changed_episode_ids}")
+        if self.virtual:
+            return self.publish_virtual_dataset(episodes, episode_states, changed_episode_ids)
+
+        # delta runs don't list the ML tree
+        listing = None if self.delta else self.get_listing()
+        episodes_by_id = {episode.get_episode_id(): episode for episode in episodes}
+        processed_episode_ids = []
+        for episode_id in changed_episode_ids:
+            if self.is_stopping():
+                break
+            try:
+                if self.delta:
+                    process_episode_delta(episodes_by_id[episode_id], listing=listing, full_reconcile_seconds=self.full_reconcile_seconds)
+                else:
+                    process_episode(episodes_by_id[episode_id], listing=listing)
+                self.episode_states[episode_id] = episode_states[episode_id]
+                processed_episode_ids.append(episode_id)
+                self.metrics.increment("episodes_processed_total")
+            except Exception as exp:
+                logger.error(f"episode_id: {episode_id} {type(exp)} {str(exp)}")
+                self.metrics.increment("episode_errors_total")
+        if listing is not None:
+            self.metrics.set("ml_listing_keys", listing.get_num_keys())
+        return processed_episode_ids
+
+    def publish_virtual_dataset(self, episodes: List[Episode], episode_states: Dict[str, EpisodeState], changed_episode_ids: List[str]) -> List[str]:
+        '''
+        Re-read only the changed episodes, then publish the
+        per-stage manifests of all episodes once
+        '''
+        episodes_by_id = {episode.get_episode_id(): episode for episode in episodes}
+        processed_episode_ids = []
+        for episode_id in changed_episode_ids:
+            if self.is_stopping():
+                break
+            try:
+                G = find_sampled_google_episode_keys_df(episodes_by_id[episode_id])
+                self.episode_manifest_dfs[episode_id] = find_episode_manifest_df(G)
+                processed_episode_ids.append(episode_id)
+            except Exception as exp:
+                logger.error(f"episode_id: {episode_id} {type(exp)} {str(exp)}")
+                self.metrics.increment("episode_errors_total")
+
+        stage_manifest_dfs = split_stage_manifest_dfs(list(self.episode_manifest_dfs.values()))
+        publish_dataset_manifests(stage_manifest_dfs, format=self.manifest_format)
+        # episode states are only saved once their rows are published
+        for episode_id in processed_episode_ids:
+            self.episode_states[episode_id] = episode_states[episode_id]
+        self.metrics.increment("episodes_processed_total", len(processed_episode_ids))
+        return processed_episode_ids
+
+    def run(self) -> None:
+        '''
+        Tick every interval_seconds until stop() is called
+        '''
+        logger.info(f"watching episodes every {self.interval_seconds}s")
+        while not self.is_stopping():
+            t1 = time.perf_counter()
+            try:
+                self.tick()
+                self.metrics.set("last_success_timestamp", time.time())
+            except Exception as exp:
+                logger.error(f"tick failed {type(exp)} {str(exp)}")
+                self.metrics.increment("tick_errors_total")
+            self.metrics.increment("ticks_total")
+            self.metrics.set("last_tick_seconds", time.perf_counter() - t1)
+            self.stop_event.wait(self.interval_seconds)
+        logger.info("watcher stopped")
+
+
+def make_health_request_handler(watcher: EpisodeWatcher):
+    '''
+    Return a request handler class that serves
+    GET /health and GET /metrics for the given watcher
+    '''
+    class HealthRequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path == "/health":
+                healthy = watcher.metrics.is_healthy(watcher.interval_seconds)
+                body = json.dumps({
+                    "status": "ok" if healthy else "stale",
+                    "stopping": watcher.is_stopping(),
+                    **watcher.metrics.as_dict()})
+                self.send_body(200 if healthy else 503, "application/json", body)
+            elif self.path == "/metrics":
+                self.send_body(200, "text/plain; version=0.0.4", watcher.metrics.as_prometheus_text())
+            else:
+                self.send_body(404, "text/plain", "not found\n")
+
+        def send_body(self, status: int, content_type: str, body: str):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug("health server " + format % args)
+
+    return HealthRequestHandler
+
+
+def start_health_server(watcher: EpisodeWatcher, port: int=HEALTH_PORT) -> ThreadingHTTPServer:
+    '''
+    Serve the watcher's health and metrics on localhost:<port>
+    from a daemon thread and return the server
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_health_request_handler(watcher))
+    thread = threading.Thread(target=server.serve_forever, name="health_server", daemon=True)
+    thread.start()
+    logger.info(f"health and metrics at http://127.0.0.1:{server.server_address[1]}/health")
+    return server
+
+
+def run_watch(interval_seconds: float=WATCH_INTERVAL_SECONDS, listing_refresh_seconds: float=LISTING_REFRESH_SECONDS, port: int=HEALTH_PORT, virtual: bool=False, manifest_format: str='csv', delta: bool=False, full_reconcile_seconds: float=FULL_RECONCILE_SECONDS) -> None:
+    '''
+    Run the watcher and its health server until SIGTERM or SIGINT
+    '''
+    watcher = EpisodeWatcher(
+        interval_seconds=interval_seconds, 
+        listing_refresh_seconds=listing_refresh_seconds,
+        virtual=virtual,
+        manifest_format=manifest_format,
+        delta=delta,
+        full_reconcile_seconds=full_reconcile_seconds)
+
+    def handle_signal(signum, frame):
+        logger.info(f"received signal {signum}, stopping after the current episode")
+        watcher.stop()
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    server = start_health_server(watcher, port=port)
+    try:
+        watcher.run()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Watch the season manifests and episode spreadsheets and process only the episodes that changed",
+        usage="--help/-h [--interval <seconds>] [--listing-refresh <seconds>] [--port <port>] [--virtual] [--manifest-format csv|parquet] [--delta] [--full-reconcile <seconds>]")
+    parser.add_argument(
+        '--interval', default=WATCH_INTERVAL_SECONDS, type=float,
+        help='seconds between polls of the manifests and spreadsheets')
+    parser.add_argument(
+        '--listing-refresh', default=LISTING_REFRESH_SECONDS, type=float,
+        help='seconds between full listings of the ML tree')
+    parser.add_argument(
+        '--port', default=HEALTH_PORT, type=int,
+        help='localhost port of the health and metrics endpoint')
+    parser.add_argument(
+        '--virtual', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to publish per-stage dataset manifests instead of copying files into tuttle_twins/ML')
+    parser.add_argument(
+        '--manifest-format', default='csv',
+        choices=DATASET_MANIFEST_FORMATS,
+        help='file format of the virtual dataset manifests')
+    parser.add_argument(
+        '--delta', default=False,
+        action=argparse.BooleanOptionalAction,
+        help='option to apply only the changed classifications of a changed episode')
+    parser.add_argument(
+        '--full-reconcile', default=FULL_RECONCILE_SECONDS, type=float,
+        help='max seconds between full runs of an episode in delta mode')
+    args = vars(parser.parse_args())
+
+    run_watch(
+        interval_seconds=args['interval'],
+        listing_refresh_seconds=args['listing_refresh'],
+        port=args['port'],
+        virtual=args['virtual'],
+        manifest_format=args['manifest_format'],
+        delta=args['delta'],
+        full_reconcile_seconds=args['full_reconcile'])
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("done")